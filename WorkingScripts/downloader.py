@@ -0,0 +1,294 @@
+"""
+Shared Download Module
+
+Reference data for the model (TIGER/Line census tracts in o2, USA_Structures
+GDB archives in o3) is made of many large ZIP files. This module provides the
+download machinery used by those stages:
+
+- Pooled HTTP sessions with retries (`make_session`)
+- Resumable downloads into a '.part' file using HTTP Range requests guarded
+  by If-Range, with size and optional sha256 verification before the file is
+  moved into place (`download_file`)
+- A bounded thread pool to fetch many files concurrently, reporting every
+  failure at the end instead of stopping at the first one (`download_many`)
+- A cheap fingerprint of a remote file from its HTTP headers, used to detect
+  changed sources without downloading them (`remote_fingerprint`)
+"""
+
+import os
+import json
+import hashlib
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 1024 * 1024
+# (connect, read) timeouts in seconds
+TIMEOUT = (10, 60)
+
+
+def make_session(pool_size=10, retries=3):
+    """
+    Create an HTTP session with a shared connection pool.
+
+    Parameters
+    ----------
+    pool_size : int
+        Maximum number of pooled connections per host.
+    retries : int
+        Connection-level retries for each request.
+
+    Returns
+    -------
+    requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def file_sha256(path, chunk_size=CHUNK_SIZE):
+    """
+    Compute the sha256 hex digest of a file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_file(path, expected_size=None, sha256=None):
+    """
+    Check a downloaded file against an expected size and/or sha256 digest.
+
+    Returns
+    -------
+    bool
+        True if the file exists and matches every expectation given.
+    """
+    if not os.path.isfile(path):
+        return False
+    if expected_size is not None and os.path.getsize(path) != int(expected_size):
+        return False
+    if sha256 is not None and file_sha256(path) != sha256:
+        return False
+    return True
+
+
+def remote_fingerprint(url, session=None, timeout=TIMEOUT):
+    """
+    Identify the current version of a remote file from a HEAD request.
+
+    Parameters
+    ----------
+    url : str
+        File URL.
+    session : requests.Session, optional
+        Pooled session to use.
+    timeout : tuple of float
+        (connect, read) timeouts in seconds.
+
+    Returns
+    -------
+    dict or None
+        'etag', 'last_modified' and 'content_length' headers of the file, or
+        None if the server could not be reached or returned none of them.
+    """
+    session = session or make_session(pool_size=1)
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        return None
+    fingerprint = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_length": response.headers.get("Content-Length"),
+    }
+    return fingerprint if any(fingerprint.values()) else None
+
+
+def _total_size(response, offset):
+    """
+    Total size of the remote file from a (possibly partial) response, or None.
+    """
+    content_range = response.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    if length is None:
+        return None
+    return int(length) + (offset if response.status_code == 206 else 0)
+
+
+def _validator(headers):
+    """
+    Validator usable in an If-Range header: a strong ETag, else Last-Modified.
+    """
+    etag = headers.get("ETag") or headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified") or headers.get("last_modified")
+
+
+def _read_validator(meta_path):
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f).get("validator")
+    except (OSError, ValueError):
+        return None
+
+
+def _discard_partial(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download_file(url, dest, session=None, expected_size=None, sha256=None,
+                  chunk_size=CHUNK_SIZE, timeout=TIMEOUT, attempts=3):
+    """
+    Download `url` to `dest`, resuming a previous partial download if present.
+
+    Data is written to '{dest}.part', and the validator of the remote file
+    (strong ETag, else Last-Modified) to '{dest}.part.json'. If the partial
+    file already holds bytes, the request asks only for the remaining range
+    with an If-Range header, so a file changed on the server since the partial
+    download is sent in full (HTTP 200) and the file restarts from zero. A
+    partial file without a validator is not resumed. A server answering
+    "range not satisfiable" (HTTP 416) has its HEAD Content-Length checked
+    before the partial file is taken as complete. After the transfer, the file
+    size is checked against the size reported by the server (or
+    `expected_size`) and its sha256 against `sha256` when given, then the file
+    is moved to `dest`. Connection errors resume from the bytes already
+    written, up to `attempts` times.
+
+    Parameters
+    ----------
+    url : str
+        File URL.
+    dest : str
+        Final local path.
+    session : requests.Session, optional
+        Pooled session (see `make_session`); a new one is created if omitted.
+    expected_size : int, optional
+        Expected file size in bytes.
+    sha256 : str, optional
+        Expected sha256 hex digest.
+    chunk_size : int
+        Bytes per write.
+    timeout : tuple of float
+        (connect, read) timeouts in seconds.
+    attempts : int
+        Number of tries before giving up.
+
+    Returns
+    -------
+    str
+        `dest`.
+
+    Raises
+    ------
+    ValueError
+        If the download keeps failing or the file does not verify.
+    """
+    if verify_file(dest, expected_size, sha256):
+        return dest
+
+    session = session or make_session(pool_size=1)
+    part_path = dest + ".part"
+    meta_path = part_path + ".json"
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+
+    last_error = None
+    for _ in range(attempts):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = _read_validator(meta_path)
+        if offset and validator is None:
+            # Bytes of unknown origin cannot be safely extended
+            _discard_partial(part_path, meta_path)
+            offset = 0
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 416:
+                    # Nothing left to fetch if the partial file has the full remote size
+                    fingerprint = remote_fingerprint(url, session, timeout) or {}
+                    length = fingerprint.get("content_length")
+                    total = int(length) if length and length.isdigit() else None
+                    if total is None or total != offset or _validator(fingerprint) != validator:
+                        _discard_partial(part_path, meta_path)
+                        last_error = ValueError("range not satisfiable and partial file does not match")
+                        continue
+                else:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        # Full body: a new download, or the file changed on the server
+                        offset = 0
+                        with open(meta_path, "w") as f:
+                            json.dump({"url": url, "validator": _validator(response.headers)}, f)
+                    total = _total_size(response, offset)
+                    with open(part_path, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+        except requests.exceptions.RequestException as e:
+            last_error = e
+            print(f"Download of {url} interrupted ({e}); retrying from saved bytes...")
+            continue
+
+        size = expected_size if expected_size is not None else total
+        if verify_file(part_path, size, sha256):
+            os.replace(part_path, dest)
+            _discard_partial(meta_path)
+            return dest
+        # Corrupt or inconsistent file: start over on the next attempt
+        _discard_partial(part_path, meta_path)
+        last_error = ValueError("size or checksum mismatch")
+
+    raise ValueError(f"Failed to download {url}: {last_error}")
+
+
+def download_many(jobs, max_workers=4, session=None):
+    """
+    Download several files concurrently on a bounded thread pool.
+
+    Parameters
+    ----------
+    jobs : list of dict
+        Each item holds 'url' and 'dest', and optionally 'expected_size' and 'sha256'.
+    max_workers : int
+        Maximum number of concurrent downloads.
+    session : requests.Session, optional
+        Pooled session shared by all downloads.
+
+    Returns
+    -------
+    list of str
+        Local paths of the downloaded files.
+
+    Raises
+    ------
+    ValueError
+        After all jobs have finished, if any of them failed.
+    """
+    session = session or make_session(pool_size=max_workers)
+    paths, failures = [], {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download_file, session=session, **job): job["url"] for job in jobs}
+        for future in as_completed(futures):
+            try:
+                paths.append(future.result())
+            except ValueError as e:
+                failures[futures[future]] = str(e)
+
+    if failures:
+        for url, error in failures.items():
+            print(f"Failed: {url}: {error}")
+        raise ValueError(f"{len(failures)} of {len(jobs)} downloads failed.")
+    return paths
@@ -0,0 +1,228 @@
+"""
+Warm Model Server
+
+Running `python main.py` for every event pays for the geopandas/scipy imports
+and for loading the national reference data (the tract index with
+population, SVI and residential share, the compiled fragility tables), then
+throws it all away. This module
+keeps one process alive instead:
+
+- The reference data is loaded once at startup (`warm_reference_data`) and
+  kept in memory (see `stage_cache.warm_load`); the tract store partitions
+  read by an event stay in memory for the next one
+- Event and scenario requests are answered by running `main.main` against
+  this warm state, with the stage cache of `main` still applied
+- Requests are served over local HTTP, one at a time
+
+Endpoints
+---------
+GET  /health
+    {"status": "ok", "requests": <number served>}
+POST /run
+    JSON object of config overrides merged into the server's base config
+    (e.g. {"event_id": "nc72282711", "UL_SEVERITY": {...}}). Only the keys
+    in `OVERRIDABLE_KEYS` are accepted, and 'event_id' and 'name' must match
+    `NAME_PATTERN` since they end up in file names; other requests get a 400.
+    Add "return_tracts": true to include the per-tract output rows. Returns
+    the shelter-seeking totals, the output path and the run time; with a
+    "sweep", also the shelter-seeking totals of every scenario.
+
+Example
+-------
+>>> from WorkingScripts.model_server import serve
+>>> serve(config, port=8765)
+
+$ curl -X POST localhost:8765/run -d '{"event_id": "nc72282711", "name": "napa"}'
+"""
+
+import os
+import re
+import json
+import time
+import numpy as np
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+# Config keys a request may override; everything else (paths, feed URL,
+# cache settings) stays as configured on the server
+OVERRIDABLE_KEYS = {
+    "event_id", "name", "BLDNG_USABILITY", "UL_SEVERITY", "SVI_THRESHOLD",
+    "intensity_metric", "sweep", "return_tracts",
+}
+# Event ids and run names are used in output file names
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def warm_reference_data():
+    """
+    Load the national reference data into memory ahead of the first request.
+
+    Tables that do not exist yet are skipped; they are loaded on first use.
+    """
+    from WorkingScripts.o2_tract_store import TRACT_STORE_DIR, INDEX_NAME, load_tract_index
+    from WorkingScripts.o4_TractLevel_DamageAssessmentModel import compile_fragility_tables
+    from WorkingScripts.tract_index import load_national_index
+    from WorkingScripts.stage_cache import warm_load
+
+    start_time = time.time()
+    loaders = [
+        ("fragility tables", compile_fragility_tables),
+        ("national tract index", load_national_index),
+        ("tract index", lambda: warm_load(os.path.join(TRACT_STORE_DIR, INDEX_NAME),
+                                          lambda path: load_tract_index(TRACT_STORE_DIR))),
+    ]
+    for name, loader in loaders:
+        try:
+            loader()
+        except (OSError, ValueError) as e:
+            print(f"Skipped warming {name}: {e}")
+    print(f"Reference data loaded in {time.time() - start_time:.2f} seconds")
+
+
+def validate_request(request):
+    """
+    Check a request against `OVERRIDABLE_KEYS` and `NAME_PATTERN`.
+
+    Raises
+    ------
+    ValueError
+        If the request sets another key or an unsafe event id or name.
+    """
+    unknown = set(request) - OVERRIDABLE_KEYS
+    if unknown:
+        raise ValueError(f"Keys not allowed in a request: {sorted(unknown)}")
+    for key in ("event_id", "name"):
+        if key in request and not (isinstance(request[key], str) and NAME_PATTERN.match(request[key])):
+            raise ValueError(f"Invalid {key}: must match {NAME_PATTERN.pattern}")
+
+
+def run_request(base_config, request):
+    """
+    Run the pipeline for one request against the warm state.
+
+    Parameters
+    ----------
+    base_config : dict
+        Server configuration (see `main.py`).
+    request : dict
+        Config overrides (see `validate_request`); 'return_tracts' adds the
+        per-tract rows to the response.
+
+    Returns
+    -------
+    dict
+        JSON-serializable response.
+    """
+    from main import main
+
+    validate_request(request)
+    request = dict(request)
+    return_tracts = request.pop("return_tracts", False)
+    config = dict(base_config)
+    config.update(request)
+    config["keep_in_memory"] = True
+
+    start_time = time.time()
+    df = main(**config)
+    response = {
+        "event_id": config["event_id"],
+        "name": config["name"],
+        "output": "Data/apr28_output_{}.csv".format(config["name"]),
+        "tracts": len(df),
+        "totals": {col: float(df[col].sum()) for col in df.columns if col.startswith("shelter_seeking_")},
+        "elapsed": time.time() - start_time,
+    }
+    sweep_summary = df.attrs.get("sweep_summary")
+    if sweep_summary is not None:
+        response["sweep_output"] = "Data/apr28_sweep_{}.parquet".format(config["name"])
+        response["sweep"] = sweep_summary
+    if return_tracts:
+        records = df.drop(columns=["geometry"], errors="ignore").replace({np.nan: None})
+        response["records"] = records.to_dict(orient="records")
+    return response
+
+
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler for the /health and /run endpoints.
+    """
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": f"Unknown endpoint: {self.path}"})
+            return
+        self._send_json(200, {"status": "ok", "requests": self.server.requests_served})
+
+    def do_POST(self):
+        if self.path != "/run":
+            self._send_json(404, {"error": f"Unknown endpoint: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("The request body must be a JSON object.")
+            validate_request(request)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            response = run_request(self.server.base_config, request)
+        except Exception as e:
+            # A failed event is reported to the client and does not stop the server
+            print(f"Request failed: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+        self.server.requests_served += 1
+        self._send_json(200, response)
+
+
+def make_server(base_config, host=SERVER_HOST, port=SERVER_PORT):
+    """
+    Create the HTTP server (without starting it) with warm reference data.
+
+    Returns
+    -------
+    http.server.HTTPServer
+    """
+    # Pay for the pipeline imports before the first request
+    import main  # noqa: F401
+
+    warm_reference_data()
+    server = HTTPServer((host, port), ModelRequestHandler)
+    server.base_config = base_config
+    server.requests_served = 0
+    return server
+
+
+def serve(base_config, host=SERVER_HOST, port=SERVER_PORT):
+    """
+    Serve model requests until interrupted.
+
+    Parameters
+    ----------
+    base_config : dict
+        Pipeline configuration shared by all requests (see `main.py`).
+    host : str
+        Interface to listen on (local only by default).
+    port : int
+        TCP port.
+    """
+    server = make_server(base_config, host, port)
+    print(f"Model server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,262 @@
+"""
+Near-Real-Time Earthquake Event Watcher
+
+This module runs the damage model continuously instead of once per process
+launch. It:
+- Polls the USGS FDSN event feed for events with a ShakeMap updated since the
+  previous poll (`updatedafter`), above a minimum magnitude, through a pooled
+  HTTP session, so ShakeMaps revised long after the origin time are seen
+- Deduplicates events on their feed update time and ShakeMap product version,
+  so each new or revised ShakeMap is processed exactly once; events without a
+  usable ShakeMap are skipped until their feed record changes
+- Dispatches qualifying events to a bounded queue served by a fixed number of
+  workers, which run the full pipeline (`main.main`) in a process pool so that
+  polling is never blocked by heavy geoprocessing
+- Runs each event on one worker at a time: a revision that arrives while the
+  event is being processed is held back and coalesced with later revisions,
+  then processed (latest version only) once the running one finishes
+
+The feed root defaults to `o1_getshakemap.FEED_ROOT` (overridable with the
+EQMODEL_USGS_FEED environment variable), so the watcher can run against a local
+stand-in for the USGS service.
+
+Example
+-------
+>>> import asyncio
+>>> from WorkingScripts.o1_event_watcher import watch_events
+>>> asyncio.run(watch_events(config, min_magnitude=4.5, poll_interval=60))
+"""
+
+import asyncio
+import datetime
+import requests
+from concurrent.futures import ProcessPoolExecutor
+
+from WorkingScripts.o1_getshakemap import FEED_ROOT, retrieve_event_data
+from WorkingScripts.downloader import make_session
+
+
+def fetch_feed_json(session, url, params=None, timeout=10):
+    """
+    GET a USGS feed URL through the pooled session and parse the JSON body.
+
+    Raises
+    ------
+    ValueError
+        If the request fails or returns an error status code.
+    """
+    try:
+        response = session.get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data from {url}: {e}")
+        raise ValueError("Failed to fetch earthquake feed.")
+
+
+def poll_feed(session, updated_after, min_magnitude, feed_root=FEED_ROOT, start_time=None):
+    """
+    Query the FDSN event feed for events with a ShakeMap updated since `updated_after`.
+
+    Parameters
+    ----------
+    session : requests.Session
+        Pooled session from `make_session`.
+    updated_after : datetime.datetime
+        Only events whose feed record changed after this time (UTC).
+    min_magnitude : float
+        Minimum event magnitude.
+    feed_root : str
+        Root of the FDSN event service.
+    start_time : datetime.datetime, optional
+        Oldest origin time to consider (the service default, 30 days, when None).
+
+    Returns
+    -------
+    list of dict
+        GeoJSON features of the matching events (summary format).
+    """
+    params = {
+        "updatedafter": updated_after.strftime("%Y-%m-%dT%H:%M:%S"),
+        "minmagnitude": min_magnitude,
+        "producttype": "shakemap",
+        "orderby": "time",
+    }
+    if start_time is not None:
+        params["starttime"] = start_time.strftime("%Y-%m-%dT%H:%M:%S")
+    return fetch_feed_json(session, f"{feed_root}/query.geojson", params=params).get("features", [])
+
+
+def run_event(config):
+    """
+    Run the full pipeline for one event (executed in a worker process).
+
+    Parameters
+    ----------
+    config : dict
+        Pipeline configuration for `main.main`, with 'event_id' set.
+    """
+    from main import main
+    return main(**config)
+
+
+async def dispatch_event(queue, state, event):
+    """
+    Queue the latest version of an event, unless it is already queued or running.
+
+    `state` holds 'pending' (event ID to latest event dict), 'queued' and
+    'in_flight' (sets of event IDs). A newer version of a queued or running
+    event replaces the pending one; the worker running an event processes
+    its pending version when the current run finishes.
+    """
+    event_id = event["eventid"]
+    state["pending"][event_id] = event
+    if event_id not in state["queued"] and event_id not in state["in_flight"]:
+        state["queued"].add(event_id)
+        await queue.put(event_id)
+
+
+async def process_events(queue, executor, base_config, feed_root, state):
+    """
+    Worker coroutine: take events from the queue and run the pipeline in `executor`.
+
+    Each event ID is processed by one worker at a time (see `dispatch_event`).
+    A failure while processing one event is reported and does not stop the worker.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        event_id = await queue.get()
+        state["queued"].discard(event_id)
+        state["in_flight"].add(event_id)
+        try:
+            # Revisions that arrive while the event runs are coalesced in
+            # 'pending' and the latest one is processed next, on this worker
+            while event_id in state["pending"]:
+                event = state["pending"].pop(event_id)
+                config = dict(base_config)
+                config.update({
+                    "event_id": event_id,
+                    "name": event_id,
+                    "feed_url": f"{feed_root}/query.geojson?eventid={{}}",
+                })
+                try:
+                    print(f"Processing {event_id} (ShakeMap version {event.get('shakemap_version')})")
+                    await loop.run_in_executor(executor, run_event, config)
+                    print(f"Finished {event_id}")
+                except Exception as e:
+                    print(f"Failed to process {event_id}: {e}")
+        finally:
+            state["in_flight"].discard(event_id)
+            queue.task_done()
+
+
+async def watch_events(base_config, min_magnitude=4.5, lookback_minutes=60, poll_interval=60,
+                       max_workers=2, max_queue=100, feed_root=FEED_ROOT, max_polls=None,
+                       max_event_age_days=30):
+    """
+    Poll the USGS feed and dispatch new or updated ShakeMaps to a worker pool.
+
+    The first poll asks for events updated in the last `lookback_minutes`;
+    later polls ask for events updated since the previous poll started. An
+    event whose feed 'updated' time has not changed since it was last seen is
+    skipped without further requests; otherwise its detail record is fetched
+    and it is queued only if its ShakeMap version or update time differs from
+    the last one dispatched. Events whose record is malformed or has no usable
+    ShakeMap are remembered and skipped until their feed record changes. Feed
+    requests run in threads and the pipeline runs in a process pool, so the
+    polling loop never waits on processing.
+
+    Parameters
+    ----------
+    base_config : dict
+        Pipeline configuration shared by all events (see `main.py`).
+    min_magnitude : float
+        Minimum magnitude of events to process.
+    lookback_minutes : int
+        Update-time window of the first poll, ending now.
+    poll_interval : float
+        Seconds between polls.
+    max_workers : int
+        Number of events processed concurrently (process pool size).
+    max_queue : int
+        Maximum number of events waiting for a worker.
+    feed_root : str
+        Root of the FDSN event service (a local stand-in for testing).
+    max_polls : int, optional
+        Stop after this many polls and wait for queued events to finish.
+        Runs forever when None.
+    max_event_age_days : float
+        Oldest origin time of events whose ShakeMap revisions are followed.
+
+    Returns
+    -------
+    dict
+        Mapping of dispatched event IDs to their (ShakeMap version, update time).
+    """
+    session = make_session(pool_size=max_workers + 2)
+    queue = asyncio.Queue(maxsize=max_queue)
+    state = {"pending": {}, "queued": set(), "in_flight": set()}
+    feed_updated = {}
+    dispatched = {}
+    polls = 0
+    updated_after = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=lookback_minutes)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        workers = [
+            asyncio.create_task(process_events(queue, executor, base_config, feed_root, state))
+            for _ in range(max_workers)
+        ]
+        try:
+            while max_polls is None or polls < max_polls:
+                polls += 1
+                poll_time = datetime.datetime.now(datetime.timezone.utc)
+                start_time = poll_time - datetime.timedelta(days=max_event_age_days)
+                try:
+                    features = await asyncio.to_thread(
+                        poll_feed, session, updated_after, min_magnitude, feed_root, start_time
+                    )
+                    # The next poll picks up where this one started
+                    updated_after = poll_time
+                except ValueError:
+                    features = []
+
+                for feature in features:
+                    try:
+                        event_id = feature["id"]
+                        updated = feature.get("properties", {}).get("updated")
+                    except (KeyError, TypeError, AttributeError):
+                        print(f"Skipping malformed feed entry: {feature!r:.200}")
+                        continue
+                    if feed_updated.get(event_id) == updated:
+                        continue
+                    try:
+                        detail = await asyncio.to_thread(
+                            fetch_feed_json, session, f"{feed_root}/query.geojson", {"eventid": event_id}
+                        )
+                    except ValueError:
+                        # Transient fetch failure: try again on the next poll
+                        continue
+                    # Seen at this update time, whether or not it can be processed
+                    feed_updated[event_id] = updated
+                    try:
+                        event = retrieve_event_data(detail)
+                    except ValueError:
+                        continue
+
+                    version = (event.get("shakemap_version"), event.get("shakemap_update_time"))
+                    if dispatched.get(event_id) == version:
+                        continue
+                    dispatched[event_id] = version
+                    await dispatch_event(queue, state, event)
+
+                if max_polls is None or polls < max_polls:
+                    await asyncio.sleep(poll_interval)
+
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            session.close()
+
+    return dispatched
@@ -5,7 +5,15 @@ This module provides functions to:
 - Fetch earthquake event data from the USGS GeoJSON feed using an event ID
 - Parse key event metadata including magnitude, coordinates, depth, and URL
 - Download and extract ShakeMap shapefiles (mi, pga, pgv) for qualifying events
+- Keep a versioned local cache of ShakeMap products with a manifest entry per
+  event, so unchanged products are not downloaded twice and revised ShakeMaps
+  are picked up
+- Read ShakeMap layers straight from memory (shape.zip via GDAL /vsimem + /vsizip,
+  or the lighter GeoJSON contour products) without writing anything to disk
 - Save relevant metadata in a structured format for further analysis
+
+The USGS feed root can be pointed at a local stand-in (e.g., for offline testing)
+through the EQMODEL_USGS_FEED environment variable.
 """
 
 import requests
@@ -13,11 +21,21 @@ import json
 import os
 import zipfile
 import io
+import hashlib
+import tempfile
 import datetime
+import shapely
 import geopandas as gpd
 
 SHAKEMAP_DIR = "{}/Data/Shakemap".format(os.getcwd())
-FEEDURL = "https://earthquake.usgs.gov/fdsnws/event/1/query.geojson?eventid={}"
+FEED_ROOT = os.environ.get("EQMODEL_USGS_FEED", "https://earthquake.usgs.gov/fdsnws/event/1")
+FEEDURL = FEED_ROOT + "/query.geojson?eventid={}"
+# Former single manifest, still read; entries are now written per event to MANIFEST_DIR
+MANIFEST_NAME = "manifest.json"
+MANIFEST_DIR = "manifest"
+SHAKEMAP_LAYERS = ("mi", "pgv", "pga")
+# GeoJSON contour product for each ShakeMap layer
+CONTOUR_PRODUCTS = {"mi": "download/cont_mmi.json", "pgv": "download/cont_pgv.json", "pga": "download/cont_pga.json"}
 
 def fetch_earthquake_data(feed_url):
     """
@@ -49,6 +67,24 @@ def fetch_earthquake_data(feed_url):
         print("Check that the USGS event ID is correct and try again.")
         raise ValueError("Failed to fetch earthquake data.")
 
+def shakemap_extent(properties):
+    """
+    Map extent of a ShakeMap product from its feed properties.
+
+    --Parameters
+    properties : dict
+        'properties' of the ShakeMap product in the event GeoJSON.
+    --Returns
+    tuple of float or None
+        (min lon, min lat, max lon, max lat), or None if not published.
+    """
+    try:
+        return tuple(float(properties[key]) for key in (
+            "minimum-longitude", "minimum-latitude", "maximum-longitude", "maximum-latitude"))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 def retrieve_event_data(event_json):
     """
     Parse relevant metadata from a USGS earthquake event GeoJSON dictionary.
@@ -62,7 +98,9 @@ def retrieve_event_data(event_json):
         - event ID, magnitude, location, depth, time, place, URL, and ShakeMap URL.
     --Raises
     ValueError
-        If the ShakeMap product is not available in the event data.
+        If the ShakeMap product is not available in the event data, or the
+        event record or ShakeMap product is malformed or incomplete
+        (e.g. no 'download/shape.zip').
 
         
     Example
@@ -70,43 +108,177 @@ def retrieve_event_data(event_json):
     >>> event = retrieve_event_data(event_json)
     >>> print(event["magnitude"], event["shakemap_url"])
     """
-    event_id = event_json["id"]
-    magnitude = event_json["properties"]["mag"]
+    try:
+        event_id = event_json["id"]
+        products = event_json["properties"]["products"]
+    except (KeyError, TypeError) as e:
+        print(f"Issue: malformed event record (missing {e}).")
+        raise ValueError("Malformed event record.")
     # Check if ShakeMap product is available
-    if "shakemap" not in event_json["properties"]["products"]:
+    if "shakemap" not in products:
         print(f"Issue: {event_id}: No ShakeMap available.")
         print("Please check the event ID and try again.")
         raise ValueError("ShakeMap not available.")
-    # Extract coordinates: [longitude, latitude, depth]
-    lon, lat, depth = event_json["geometry"]["coordinates"]
-    # Build metadata dictionary
-    event_data = {
-        "eventid": event_id,
-        "magnitude": magnitude,
-        "lon": lon,
-        "lat": lat,
-        "depth": depth,
-        "title": event_json["properties"]["title"],
-        "time": event_json["properties"]["time"],
-        "place": event_json["properties"]["place"],
-        "url": event_json["properties"]["url"],
-        "shakemap_url": event_json["properties"]["products"]["shakemap"][0]
-                            ["contents"]["download/shape.zip"]["url"]}
+    try:
+        magnitude = event_json["properties"]["mag"]
+        # Extract coordinates: [longitude, latitude, depth]
+        lon, lat, depth = event_json["geometry"]["coordinates"]
+        # Preferred ShakeMap product and its downloadable shapefile archive
+        shakemap = products["shakemap"][0]
+        shape_zip = shakemap["contents"]["download/shape.zip"]
+        # Build metadata dictionary
+        event_data = {
+            "eventid": event_id,
+            "magnitude": magnitude,
+            "lon": lon,
+            "lat": lat,
+            "depth": depth,
+            "title": event_json["properties"]["title"],
+            "time": event_json["properties"]["time"],
+            "place": event_json["properties"]["place"],
+            "url": event_json["properties"]["url"],
+            "shakemap_url": shape_zip["url"],
+            "shakemap_version": shakemap.get("properties", {}).get("version"),
+            "shakemap_update_time": shakemap.get("updateTime"),
+            "shakemap_sha256": shape_zip.get("sha256"),
+            "shakemap_length": shape_zip.get("length"),
+            "shakemap_extent": shakemap_extent(shakemap.get("properties", {})),
+            "contour_urls": {
+                layer: shakemap["contents"][product]["url"]
+                for layer, product in CONTOUR_PRODUCTS.items()
+                if product in shakemap["contents"]
+            }}
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        print(f"Issue: {event_id}: incomplete event or ShakeMap product ({e!r}).")
+        raise ValueError("ShakeMap product is incomplete.")
     return event_data
 
 
-def download_and_extract_shakemap(event):
+def read_manifest_entry(event_id, shakemap_dir=SHAKEMAP_DIR):
+    """
+    Read the cache manifest entry of one event.
+
+    Each event has its own manifest file, so runs of different events never
+    rewrite a shared file. Entries of the former single `manifest.json` are
+    still read.
+
+    --Parameters
+    event_id : str
+        USGS event ID.
+    shakemap_dir : str
+        Root folder of the ShakeMap cache.
+    --Returns
+    dict or None
+        Cached product metadata (version, update time, sha256 of the archive,
+        extracted file names), or None if the event is not cached.
+    """
+    entry_path = os.path.join(shakemap_dir, MANIFEST_DIR, f"{event_id}.json")
+    if os.path.isfile(entry_path):
+        with open(entry_path, "r") as f:
+            return json.load(f)
+    return read_manifest(shakemap_dir).get(event_id)
+
+
+def read_manifest(shakemap_dir=SHAKEMAP_DIR):
+    """
+    Read the whole ShakeMap product cache manifest.
+
+    --Parameters
+    shakemap_dir : str
+        Root folder of the ShakeMap cache.
+    --Returns
+    dict
+        Mapping of event ID to cached product metadata (see
+        `read_manifest_entry`). Empty if nothing is cached.
+    """
+    manifest = {}
+    legacy_path = os.path.join(shakemap_dir, MANIFEST_NAME)
+    if os.path.isfile(legacy_path):
+        with open(legacy_path, "r") as f:
+            manifest.update(json.load(f))
+    entry_dir = os.path.join(shakemap_dir, MANIFEST_DIR)
+    if os.path.isdir(entry_dir):
+        for name in sorted(os.listdir(entry_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(entry_dir, name), "r") as f:
+                    manifest[name[:-len(".json")]] = json.load(f)
+    return manifest
+
+
+def write_manifest_entry(event_id, entry, shakemap_dir=SHAKEMAP_DIR):
+    """
+    Atomically write the cache manifest entry of one event.
+
+    The entry is written to a private temporary file and moved into place,
+    so concurrent runs (see `o1_event_watcher`) never share a partial file.
+
+    --Parameters
+    event_id : str
+        USGS event ID.
+    entry : dict
+        Cached product metadata.
+    shakemap_dir : str
+        Root folder of the ShakeMap cache.
+    """
+    entry_dir = os.path.join(shakemap_dir, MANIFEST_DIR)
+    os.makedirs(entry_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=entry_dir, prefix=f"{event_id}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, os.path.join(entry_dir, f"{event_id}.json"))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def shakemap_is_current(event, shakemap_dir=SHAKEMAP_DIR):
+    """
+    Check whether the cached ShakeMap for an event matches the product in the feed.
+
+    The cache entry is current when the product version and update time recorded
+    in the manifest match the ones parsed from the USGS feed, and the extracted
+    files are still on disk.
+
+    --Parameters
+    event : dict
+        Event metadata from `retrieve_event_data`.
+    shakemap_dir : str
+        Root folder of the ShakeMap cache.
+    --Returns
+    bool
+        True if no download is needed.
+    """
+    entry = read_manifest_entry(event["eventid"], shakemap_dir)
+    if entry is None:
+        return False
+    event_folder = os.path.join(shakemap_dir, event["eventid"])
+    files_present = all(os.path.exists(os.path.join(event_folder, name)) for name in entry.get("files", []))
+    return (
+        files_present
+        and entry.get("version") == event.get("shakemap_version")
+        and entry.get("update_time") == event.get("shakemap_update_time")
+    )
+
+
+def download_and_extract_shakemap(event, shakemap_dir=SHAKEMAP_DIR):
     """
     Download and extract the ShakeMap ZIP archive for a given earthquake event.
-    This function checks whether the ShakeMap for the event already exists locally.
-    If not, it downloads the ZIP file from the provided URL and extracts it into
-    a dedicated event folder.
+    This function checks the local product cache manifest for the event. If the
+    cached product has the same version and update time as the feed, nothing is
+    downloaded. Otherwise the archive is downloaded, its sha256 is checked against
+    the feed (when published) and against the cached copy, and a changed archive
+    is extracted into the event folder, replacing the files of the previous version.
 
     --Parameters
     event : dict
         Dictionary containing earthquake event metadata. Must include:
         - 'eventid': str
         - 'shakemap_url': str (URL pointing to downloadable ShakeMap ZIP)
+        May include 'shakemap_version', 'shakemap_update_time' and
+        'shakemap_sha256' (see `retrieve_event_data`).
+    shakemap_dir : str
+        Root folder of the ShakeMap cache.
 
     --Returns
     str
@@ -114,7 +286,8 @@ def download_and_extract_shakemap(event):
 
     --Raises
     ValueError
-        If the download or ZIP extraction fails.
+        If the download fails, the archive does not match the published hash,
+        or ZIP extraction fails.
 
     Example
     -------
@@ -123,44 +296,232 @@ def download_and_extract_shakemap(event):
     """
     event_id = event["eventid"]
     shakemap_url = event["shakemap_url"]
-    event_folder = os.path.join(SHAKEMAP_DIR, event_id)
+    event_folder = os.path.join(shakemap_dir, event_id)
 
-    # Skip if ShakeMap already downloaded (no overwrite)
-    if os.path.exists(event_folder):
-        print(f"{event_id}: ShakeMap already downloaded.")
+    # Skip if the cached product is the same version as the feed
+    if shakemap_is_current(event, shakemap_dir):
+        print(f"{event_id}: ShakeMap version {event.get('shakemap_version')} already cached.")
         return event_folder
 
-    os.makedirs(event_folder, exist_ok=True)
-    zip_path = os.path.join(event_folder, "shakemap.zip")
-
-    # Step 1: Download ZIP
+    # Step 1: Download ZIP into memory
     try:
         print(f"Downloading ShakeMap for event {event_id}...")
-        response = requests.get(shakemap_url, stream=True, timeout=15)
+        response = requests.get(shakemap_url, timeout=15)
         response.raise_for_status()
-
-        with open(zip_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        archive = response.content
     except requests.exceptions.RequestException as e:
         print(f"Error downloading ShakeMap for {event_id}: {e}")
         raise ValueError("ShakeMap download failed.")
 
-    # Step 2: Extract ZIP
-    try:
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(event_folder)
-        print(f"Extracted ShakeMap for event {event_id} to {event_folder}")
-    except zipfile.BadZipFile:
-        print(f"Error: Invalid ZIP file for event {event_id}")
-        raise ValueError("Invalid ZIP archive.")
+    # Step 2: Verify content hash
+    digest = hashlib.sha256(archive).hexdigest()
+    expected = event.get("shakemap_sha256")
+    if expected and expected != digest:
+        print(f"Error: ShakeMap archive for {event_id} does not match published sha256")
+        raise ValueError("ShakeMap checksum mismatch.")
 
-    # Step 3: Remove ZIP after extraction
-    os.remove(zip_path)
+    entry = read_manifest_entry(event_id, shakemap_dir) or {}
+    unchanged = entry.get("sha256") == digest and all(
+        os.path.exists(os.path.join(event_folder, name)) for name in entry.get("files", [])
+    )
+
+    # Step 3: Extract ZIP (only if the content changed)
+    if unchanged:
+        print(f"{event_id}: ShakeMap content unchanged, updating cache metadata only.")
+        files = entry["files"]
+    else:
+        try:
+            with zipfile.ZipFile(io.BytesIO(archive), "r") as zip_ref:
+                files = zip_ref.namelist()
+                # Remove files of the previous version that are not in the new archive
+                for name in set(entry.get("files", [])) - set(files):
+                    stale = os.path.join(event_folder, name)
+                    if os.path.isfile(stale):
+                        os.remove(stale)
+                os.makedirs(event_folder, exist_ok=True)
+                zip_ref.extractall(event_folder)
+            print(f"Extracted ShakeMap for event {event_id} to {event_folder}")
+        except zipfile.BadZipFile:
+            print(f"Error: Invalid ZIP file for event {event_id}")
+            raise ValueError("Invalid ZIP archive.")
+
+    # Step 4: Record the cached product in the manifest
+    write_manifest_entry(event_id, {
+        "version": event.get("shakemap_version"),
+        "update_time": event.get("shakemap_update_time"),
+        "sha256": digest,
+        "url": shakemap_url,
+        "files": files,
+        "fetched": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }, shakemap_dir)
     print(f"Success! ShakeMap for event {event_id} is ready.")
 
     return event_folder
 
 
+def download_product_bytes(url, timeout=15):
+    """
+    Download a ShakeMap product into memory.
+
+    --Parameters
+    url : str
+        URL of the product (shape.zip or a GeoJSON contour file).
+    timeout : int
+        Request timeout in seconds.
+    --Returns
+    bytes
+        Raw content of the product.
+    --Raises
+    ValueError
+        If the download fails.
+    """
+    try:
+        response = requests.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading ShakeMap product from {url}: {e}")
+        raise ValueError("ShakeMap download failed.")
+
+
+def read_shakemap_archive(archive, layers=SHAKEMAP_LAYERS):
+    """
+    Read ShakeMap shapefile layers directly from an in-memory shape.zip.
+
+    The archive bytes are handed to GDAL as a /vsimem/ buffer opened through
+    /vsizip/, so each shapefile in the ZIP is read as a layer without being
+    extracted to disk.
+
+    --Parameters
+    archive : bytes
+        Content of the ShakeMap shape.zip.
+    layers : sequence of str
+        Layer names to read (any of 'mi', 'pgv', 'pga').
+    --Returns
+    dict
+        Mapping of layer name to GeoDataFrame.
+    --Raises
+    ValueError
+        If the archive is not a valid ZIP or a requested layer is missing.
+    """
+    if not zipfile.is_zipfile(io.BytesIO(archive)):
+        raise ValueError("Invalid ZIP archive.")
+    shakemap_layers = {}
+    for layer in layers:
+        try:
+            shakemap_layers[layer] = gpd.read_file(io.BytesIO(archive), layer=layer)
+        except Exception as e:
+            print(f"Error reading layer '{layer}' from ShakeMap archive: {e}")
+            raise ValueError(f"ShakeMap layer '{layer}' not found in archive.")
+    return shakemap_layers
+
+
+def contours_to_bands(contours, extent=None, floor_value=0.0):
+    """
+    Convert ShakeMap contour lines into non-overlapping intensity bands.
+
+    The closed contour rings of each level are polygonized and filled with the
+    even-odd rule: a face inside an odd number of rings is at or above the
+    level, so a ring nested in another ring of the same level (a dip of lower
+    intensity) becomes a hole. Each band is then that area minus the areas of
+    all higher levels, labeled with its level as in shape.zip. Contour
+    segments that stay open at the edge of the map cannot enclose an area and
+    are dropped.
 
+    The contours only bound the area above the lowest level. With `extent`,
+    the rest of the map becomes an outer band of `floor_value`; without it,
+    tracts outside every closed contour get no band, unlike shape.zip, which
+    covers the whole map.
 
+    --Parameters
+    contours : GeoDataFrame
+        Contour lines with a 'PARAMVALUE' column.
+    extent : tuple of float, optional
+        Map extent (min lon, min lat, max lon, max lat), see `retrieve_event_data`.
+    floor_value : float
+        Value of the outer band, below the lowest contour level.
+    --Returns
+    GeoDataFrame
+        One polygon band per contour level with its 'PARAMVALUE', plus the
+        outer band when `extent` is given.
+    """
+    levels = contours.dissolve(by="PARAMVALUE").sort_index(ascending=False)
+    covered = shapely.Polygon()
+    values, bands = [], []
+    for value, geom in zip(levels.index, levels.geometry):
+        faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(geom)))
+        # Even-odd fill: every ring toggles the inside of the area
+        area = shapely.Polygon()
+        for ring in shapely.get_exterior_ring(faces):
+            area = shapely.symmetric_difference(area, shapely.Polygon(ring))
+        band = shapely.difference(area, covered)
+        covered = shapely.union(covered, area)
+        if not band.is_empty:
+            values.append(value)
+            bands.append(band)
+    if extent is not None:
+        band = shapely.difference(shapely.box(*extent), covered)
+        if not band.is_empty:
+            values.append(floor_value)
+            bands.append(band)
+    return gpd.GeoDataFrame({"PARAMVALUE": values}, geometry=bands, crs=contours.crs)
+
+
+def read_shakemap_contours(event, layers=SHAKEMAP_LAYERS):
+    """
+    Download and read the GeoJSON contour products of a ShakeMap in memory.
+
+    --Parameters
+    event : dict
+        Event metadata from `retrieve_event_data` (uses 'contour_urls').
+    layers : sequence of str
+        Layer names to read (any of 'mi', 'pgv', 'pga').
+    --Returns
+    dict
+        Mapping of layer name to a GeoDataFrame of intensity bands with a
+        'PARAMVALUE' column (see `contours_to_bands`; the map outside the
+        lowest contour is an outer band only when the feed publishes the
+        ShakeMap extent).
+    --Raises
+    ValueError
+        If a requested contour product is not published for the event.
+    """
+    shakemap_layers = {}
+    for layer in layers:
+        url = event.get("contour_urls", {}).get(layer)
+        if url is None:
+            print(f"Issue: {event['eventid']}: no '{layer}' contour product available.")
+            raise ValueError("ShakeMap contour product not available.")
+        contours = gpd.read_file(io.BytesIO(download_product_bytes(url)))
+        contours = contours.rename(columns={"value": "PARAMVALUE"})
+        shakemap_layers[layer] = contours_to_bands(contours, event.get("shakemap_extent"))
+    return shakemap_layers
+
+
+def load_shakemap_layers(event, layers=SHAKEMAP_LAYERS, source="shape"):
+    """
+    Load ShakeMap layers for an event entirely in memory.
+
+    --Parameters
+    event : dict
+        Event metadata from `retrieve_event_data`.
+    layers : sequence of str
+        Layer names to read (any of 'mi', 'pgv', 'pga').
+    source : str, default "shape"
+        "shape" streams shape.zip into memory and reads it via /vsizip;
+        "contour" reads the lighter GeoJSON contour products.
+    --Returns
+    dict
+        Mapping of layer name to GeoDataFrame with a 'PARAMVALUE' column.
+
+    Example
+    -------
+    >>> layers = load_shakemap_layers(event, layers=("pga",))
+    >>> pga_gdf = layers["pga"]
+    """
+    print(f"Loading ShakeMap {source} product for event {event['eventid']} in memory...")
+    if source == "shape":
+        return read_shakemap_archive(download_product_bytes(event["shakemap_url"]), layers)
+    if source == "contour":
+        return read_shakemap_contours(event, layers)
+    raise ValueError(f"Unknown ShakeMap source: {source}")
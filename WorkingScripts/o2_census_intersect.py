@@ -4,8 +4,12 @@ ShakeMap and Census Tract Geospatial Processing
 This module provides functions to:
 - Load and manage ShakeMap shapefiles (mi, pga, pgv) for earthquake events
 - Locate and download Census Tract boundaries (2019 TIGER/Line shapefiles)
-- Clip ShakeMap layers to census tract geometries
-- Compute max, min, and mean earthquake intensity statistics for each tract
+- Load only the tracts inside a ShakeMap extent using the GeoPackage spatial index
+- Clip ShakeMap layers to census tract geometries (on request)
+- Compute max, min, mean and area-weighted mean earthquake intensity for each
+  tract in a single STRtree pass
+- Record, for each tract, the fraction of its area covered by each ShakeMap
+  intensity band as a compact CSR-style histogram (`tract_intensity_hist.npz`)
 
 Data Sources:
 - Census Tract Shapefile: tl_2019_us_tract.shp
@@ -17,8 +21,16 @@ Data Sources:
 
 import os
 import requests
+import numpy as np
+import pyogrio
+import shapely
 import geopandas as gpd
+from shapely import STRtree
 from pyogrio.errors import DataSourceError 
+from WorkingScripts.o2_tract_store import TRACT_STORE_DIR, tract_store_exists, read_tracts_from_store
+
+TRACTS_CRS = "EPSG:4326"
+HISTOGRAM_NAME = "tract_intensity_hist.npz"
 
 def get_shakemap_files(eventdir):
     """
@@ -82,6 +94,45 @@ def download_census_tracts(data_dir):
         raise ValueError("Census tract shapefile is missing. Please download it manually.")
 
 
+def to_wgs84(gdf):
+    """
+    Reproject a GeoDataFrame to WGS84 (EPSG:4326) only if it is not already there.
+    --Parameters
+    gdf : GeoDataFrame
+        Layer to reproject.
+    --Returns
+    GeoDataFrame
+        The same object if it is already in EPSG:4326, otherwise a reprojected copy.
+    """
+    if gdf.crs is not None and gdf.crs.equals(TRACTS_CRS):
+        return gdf
+    return gdf.to_crs(TRACTS_CRS)
+
+
+def load_tracts_for_extent(tracts_path, shakemap_gdf):
+    """
+    Load only the census tracts that intersect the extent of a ShakeMap layer.
+
+    The ShakeMap bounding box is transformed into the CRS of the tract layer and
+    passed to the reader as a spatial filter, so GDAL uses the GeoPackage R-tree
+    index instead of scanning every tract in the country. The selected tracts
+    are reprojected to EPSG:4326 once, here, so downstream steps do not repeat it.
+    --Parameters
+    tracts_path : str
+        Path to the 'Nationwide_Tracts.gpkg' GeoPackage.
+    shakemap_gdf : GeoDataFrame
+        ShakeMap layer (e.g., PGA) whose extent defines the area of interest.
+    --Returns
+    GeoDataFrame
+        Census tracts intersecting the ShakeMap extent, in EPSG:4326.
+    """
+    tracts_crs = pyogrio.read_info(tracts_path)["crs"]
+    bbox = tuple(shakemap_gdf.to_crs(tracts_crs).total_bounds)
+    tracts_gdf = gpd.read_file(tracts_path, bbox=bbox)
+    print(f"Loaded {len(tracts_gdf)} census tracts within ShakeMap extent {bbox}")
+    return to_wgs84(tracts_gdf)
+
+
 def clip_shakemap_to_tracts(shakemap_gdf, tracts_gdf, output_layer, GPKG_PATH):
     """
     Clip a ShakeMap layer to the boundaries of census tracts.
@@ -107,8 +158,8 @@ def clip_shakemap_to_tracts(shakemap_gdf, tracts_gdf, output_layer, GPKG_PATH):
         The clipped result as a new GeoDataFrame.
     """
     # Ensure both datasets are in WGS84 (EPSG:4326)
-    shakemap_gdf = shakemap_gdf.to_crs(epsg=4326)
-    tracts_gdf = tracts_gdf.to_crs(epsg=4326)
+    shakemap_gdf = to_wgs84(shakemap_gdf)
+    tracts_gdf = to_wgs84(tracts_gdf)
     # Perform spatial intersection (clip)
     clipped_gdf = gpd.overlay(shakemap_gdf, tracts_gdf, how="intersection")
     # Save clipped layer to GeoPackage
@@ -117,16 +168,119 @@ def clip_shakemap_to_tracts(shakemap_gdf, tracts_gdf, output_layer, GPKG_PATH):
     return clipped_gdf
 
 
+def intersect_shakemap_tracts(shakemap_gdf, tracts_gdf):
+    """
+    Match ShakeMap polygons to census tracts with a single STRtree bulk query.
+
+    The ShakeMap geometries are indexed once and every tract is queried against
+    the index in one vectorized call, which returns all intersecting
+    (tract, ShakeMap polygon) pairs without building an overlay GeoDataFrame.
+    The area of each pair's intersection is also returned so callers can
+    weight intensities by how much of the tract each contour band covers.
+
+    --Parameters
+    shakemap_gdf : GeoDataFrame
+        ShakeMap layer with a 'PARAMVALUE' column, in EPSG:4326.
+    tracts_gdf : GeoDataFrame
+        Census tract geometries, in EPSG:4326.
+    --Returns
+    tuple of numpy.ndarray
+        (tract_idx, shakemap_idx, overlap_area): positional indices into
+        `tracts_gdf` and `shakemap_gdf` for each intersecting pair, sorted by
+        tract, and the area of the pair's intersection in squared degrees.
+    """
+    tract_geoms = np.asarray(tracts_gdf.geometry.array)
+    shakemap_geoms = np.asarray(shakemap_gdf.geometry.array)
+
+    tree = STRtree(shakemap_geoms)
+    tract_idx, shakemap_idx = tree.query(tract_geoms, predicate="intersects")
+
+    order = np.argsort(tract_idx, kind="stable")
+    tract_idx = tract_idx[order]
+    shakemap_idx = shakemap_idx[order]
+    overlap_area = shapely.area(
+        shapely.intersection(tract_geoms[tract_idx], shakemap_geoms[shakemap_idx])
+    )
+    return tract_idx, shakemap_idx, overlap_area
+
+
+def tract_intensity_histogram(tract_geoids, tract_idx, values, overlap_area):
+    """
+    Build the per-tract distribution of ShakeMap intensity by covered area.
+
+    Pairs of a tract with polygons of the same intensity band are merged into
+    one bin, and each bin's area is divided by the tract's total overlap area.
+    A tract that only touches ShakeMap boundaries (zero overlap area) gives
+    equal weight to each touching polygon, as its weighted mean does.
+
+    --Parameters
+    tract_geoids : numpy.ndarray
+        GEOID of every tract passed to `intersect_shakemap_tracts`.
+    tract_idx : numpy.ndarray
+        Tract position of each intersecting pair.
+    values : numpy.ndarray
+        ShakeMap 'PARAMVALUE' of each pair.
+    overlap_area : numpy.ndarray
+        Intersection area of each pair.
+    --Returns
+    dict of numpy.ndarray
+        CSR-style arrays: 'geoid' (int64, sorted, one per intersected tract),
+        'indptr' (tracts + 1), and per bin 'intensity' and 'fraction'. The bins
+        of tract i are entries indptr[i]:indptr[i + 1], and their fractions sum to 1.
+    """
+    geoid = np.asarray(tract_geoids).astype("int64")
+    hit = np.unique(tract_idx)
+    hit = hit[np.argsort(geoid[hit], kind="stable")]
+    rank = np.zeros(len(geoid), dtype="int64")
+    rank[hit] = np.arange(len(hit))
+
+    # Sort pairs by (tract in GEOID order, intensity) and merge equal bands
+    r = rank[tract_idx]
+    order = np.lexsort((values, r))
+    r, v, a = r[order], values[order], overlap_area[order]
+    starts = np.flatnonzero(np.r_[True, (r[1:] != r[:-1]) | (v[1:] != v[:-1])]) if len(r) else np.array([], dtype=int)
+    bin_tract = r[starts]
+    bin_area = np.add.reduceat(a, starts) if len(starts) else np.array([], dtype="float64")
+    bin_pairs = np.diff(np.r_[starts, len(r)]).astype("float64")
+
+    tract_area = np.bincount(bin_tract, weights=bin_area, minlength=len(hit))[bin_tract]
+    tract_pairs = np.bincount(bin_tract, weights=bin_pairs, minlength=len(hit))[bin_tract]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(tract_area > 0, bin_area / tract_area, bin_pairs / tract_pairs)
+
+    return {
+        "geoid": geoid[hit],
+        "indptr": np.r_[0, np.cumsum(np.bincount(bin_tract, minlength=len(hit)))].astype("int64"),
+        "intensity": v[starts],
+        "fraction": fraction,
+    }
+
+
+def read_intensity_histogram(eventdir):
+    """
+    Load the per-tract intensity histogram saved by `calculate_shakemap_statistics`.
+
+    --Returns
+    dict of numpy.ndarray
+        See `tract_intensity_histogram`.
+    """
+    with np.load(os.path.join(eventdir, HISTOGRAM_NAME)) as hist:
+        return {key: hist[key] for key in hist.files}
+
+
 def calculate_shakemap_statistics(shakemap_gdf, tracts_gdf, output_layer, GPKG_PATH):
     """
     Calculate summary statistics (max, min, mean) of ShakeMap intensity per census tract.
-    This function joins the clipped ShakeMap data to census tracts, computes
-    intensity statistics (e.g., for PGA), and saves the output as a new layer
-    in a GeoPackage.
+    This function matches the ShakeMap polygons to census tracts in one pass
+    (see `intersect_shakemap_tracts`), reduces the matched 'PARAMVALUE's per
+    tract with segmented numpy reductions, and saves the output as a new layer
+    in a GeoPackage. The per-tract distribution of intensity by covered area
+    (see `tract_intensity_histogram`) is saved next to it as
+    'tract_intensity_hist.npz'.
 
     --Parameters
     shakemap_gdf : GeoDataFrame
-        Clipped ShakeMap data (result of spatial intersection).
+        ShakeMap layer (e.g., PGA) as read from the event directory.
     tracts_gdf : GeoDataFrame
         Census tract geometries.
     output_layer : str
@@ -134,52 +288,92 @@ def calculate_shakemap_statistics(shakemap_gdf, tracts_gdf, output_layer, GPKG_P
     GPKG_PATH : str
         Path to the GeoPackage to store results.
     --Returns
-    None
-        The function writes output to disk and returns nothing.
+    GeoDataFrame
+        One row per intersected tract with 'max_intensity', 'min_intensity',
+        'mean_intensity' and 'weighted_mean_intensity' (mean weighted by the
+        area of the tract covered by each ShakeMap polygon).
     """
     # Ensure consistent CRS
-    shakemap_gdf = shakemap_gdf.to_crs(epsg=4326)
-    tracts_gdf = tracts_gdf.to_crs(epsg=4326)
-    # Spatial join: attach ShakeMap intensity to tracts
-    joined = gpd.sjoin(tracts_gdf, shakemap_gdf, how="inner", predicate="intersects")
-    # Remove duplicate columns from join
-    right_cols = [col for col in joined.columns if "_right" in col]
-    joined = joined.drop(columns=right_cols)
-    # Clean up column names
-    joined.columns = [col.replace("_left", "") for col in joined.columns]
-    # Aggregate intensity stats by tract
-    aggregated = joined.groupby("GEOID").agg({
-        "PARAMVALUE": ["max", "min", "mean"],
-        "geometry": "first"
-    }).reset_index()
+    shakemap_gdf = to_wgs84(shakemap_gdf)
+    tracts_gdf = to_wgs84(tracts_gdf)
+    # Intersecting (tract, ShakeMap polygon) pairs, grouped by tract
+    tract_idx, shakemap_idx, overlap_area = intersect_shakemap_tracts(shakemap_gdf, tracts_gdf)
+    values = shakemap_gdf["PARAMVALUE"].to_numpy(dtype="float64")[shakemap_idx]
+
+    # Segment boundaries of each tract's run of pairs
+    starts = np.flatnonzero(np.r_[True, tract_idx[1:] != tract_idx[:-1]]) if len(tract_idx) else np.array([], dtype=int)
+    counts = np.diff(np.r_[starts, len(tract_idx)])
+    hit = tract_idx[starts]
 
-    # Flatten MultiIndex columns
-    aggregated.columns = ["GEOID", "max_intensity", "min_intensity", "mean_intensity", "geometry"]
+    # Aggregate intensity stats by tract
+    if len(starts):
+        max_intensity = np.maximum.reduceat(values, starts)
+        min_intensity = np.minimum.reduceat(values, starts)
+        mean_intensity = np.add.reduceat(values, starts) / counts
+        area_sum = np.add.reduceat(overlap_area, starts)
+        weighted_sum = np.add.reduceat(overlap_area * values, starts)
+    else:
+        max_intensity = min_intensity = mean_intensity = area_sum = weighted_sum = np.array([], dtype="float64")
+    # Tracts that only touch a ShakeMap boundary have no overlap area
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weighted_mean_intensity = np.where(area_sum > 0, weighted_sum / area_sum, mean_intensity)
 
     # Create final GeoDataFrame
-    result = gpd.GeoDataFrame(aggregated, geometry="geometry", crs=tracts_gdf.crs)
+    result = gpd.GeoDataFrame({
+        "GEOID": tracts_gdf["GEOID"].to_numpy()[hit],
+        "max_intensity": max_intensity,
+        "min_intensity": min_intensity,
+        "mean_intensity": mean_intensity,
+        "weighted_mean_intensity": weighted_mean_intensity,
+        "geometry": tracts_gdf.geometry.array[hit],
+    }, geometry="geometry", crs=tracts_gdf.crs)
+    result = result.sort_values("GEOID").reset_index(drop=True)
 
     # Save to GeoPackage
     result.to_file(GPKG_PATH, layer=output_layer, driver="GPKG", mode="w")
     print(f"Saved {output_layer} (tract-level ShakeMap statistics) to {GPKG_PATH}")
-    return None
+
+    # Save the area-weighted intensity distribution of each tract
+    hist = tract_intensity_histogram(tracts_gdf["GEOID"].to_numpy(), tract_idx, values, overlap_area)
+    np.savez(os.path.join(os.path.dirname(GPKG_PATH), HISTOGRAM_NAME), **hist)
+    return result
 
 
-def shakemap_into_census_geo(eventdir):
+def shakemap_into_census_geo(eventdir, bbox_filter=True, write_clip=False, use_store=True, pga_gdf=None,
+                             keep_in_memory=False):
     """
-    Process a ShakeMap event by clipping its data to census tracts and computing tract-level statistics.
+    Process a ShakeMap event by computing tract-level intensity statistics.
 
     This function performs the following steps:
-    1. Loads the PGA ShakeMap shapefile from a given event directory.
-    2. Loads the nationwide 2019 Census Tract geometries.
-    3. Clips the ShakeMap layer to tract boundaries.
-    4. Computes max, min, and mean ShakeMap intensity values for each tract.
-    5. Saves both outputs to a GeoPackage in the event directory.
+    1. Loads the PGA ShakeMap shapefile from a given event directory
+       (unless an in-memory PGA layer is passed as `pga_gdf`).
+    2. Loads the 2019 Census Tract geometries (only those within the ShakeMap
+       extent when `bbox_filter` is True, otherwise the whole country), from
+       the GeoParquet tract store when it has been built.
+    3. Computes max, min, mean and area-weighted mean ShakeMap intensity values for each tract.
+    4. Optionally clips the ShakeMap layer to tract boundaries (`write_clip`).
+    5. Saves the outputs to a GeoPackage in the event directory.
 
     --Parameters
     eventdir : str
         Path to the directory containing ShakeMap shapefiles (mi, pga, pgv)
         and where output GeoPackage will be saved.
+    bbox_filter : bool, default True
+        Read only the tracts intersecting the PGA ShakeMap extent using the
+        GeoPackage spatial index. Set to False to load the nationwide layer.
+    write_clip : bool, default False
+        Also build and save the ShakeMap geometries clipped to tract boundaries.
+        This is an expensive overlay that the damage model does not need.
+    use_store : bool, default True
+        Read tracts from the state-partitioned GeoParquet store
+        (see `o2_tract_store.build_tract_store`) when it exists, instead of the
+        GeoPackage. Only applies when `bbox_filter` is True.
+    pga_gdf : GeoDataFrame, optional
+        PGA layer already loaded in memory (see `o1_getshakemap.load_shakemap_layers`).
+        When given, nothing is read from the event directory.
+    keep_in_memory : bool, default False
+        Keep the tract store partitions in memory between calls (for a
+        long-running process, see `o2_tract_store.read_tracts_from_store`).
     --Returns
     None
         All outputs are written to disk.
@@ -190,32 +384,43 @@ def shakemap_into_census_geo(eventdir):
     >>> shakemap_into_census_geo(eventdir = "./Data/Shakemap/us70006vll")
 
     # Outputs:
+    # - tract_intensity_hist.npz: area fraction of each PGA band per tract
     # - eqmodel_outputs.gpkg
+    #     - 'tract_shakemap_pga': max, min, mean and weighted mean PGA values per tract
     #     - 'shakemap_tractclip_pga': ShakeMap geometries clipped to census tracts
-    #     - 'tract_shakemap_pga': max, min, and mean PGA values per tract
+    #       (only when write_clip=True)
     """
     # Load ShakeMap shapefiles (only PGA used here)
-    _, _, pga_path = get_shakemap_files(eventdir)
-    try:
-        pga_gdf = gpd.read_file(pga_path)
-    except DataSourceError:
-        print("\n\n\n ============= USER MESSAGE ========================")
-        print(f"Failed to read shapefile at {pga_path}: file not found - please check that shakemap is available on USGS")
-        print("=====================================\n\n\n")
-        raise ValueError
+    if pga_gdf is None:
+        _, _, pga_path = get_shakemap_files(eventdir)
+        try:
+            pga_gdf = gpd.read_file(pga_path)
+        except DataSourceError:
+            print("\n\n\n ============= USER MESSAGE ========================")
+            print(f"Failed to read shapefile at {pga_path}: file not found - please check that shakemap is available on USGS")
+            print("=====================================\n\n\n")
+            raise ValueError
 
     # Load Census Tract geometries
     data_dir = os.path.join(os.getcwd(), "Data")
     tracts_path = os.path.join(data_dir, "merged_shapefile", "Nationwide_Tracts.gpkg")
-    tracts_gdf = gpd.read_file(tracts_path)
+    pga_gdf = to_wgs84(pga_gdf)
+    if bbox_filter and use_store and tract_store_exists(TRACT_STORE_DIR):
+        tracts_gdf = read_tracts_from_store(pga_gdf.total_bounds, TRACT_STORE_DIR, keep_in_memory=keep_in_memory)
+    elif bbox_filter:
+        tracts_gdf = load_tracts_for_extent(tracts_path, pga_gdf)
+    else:
+        tracts_gdf = to_wgs84(gpd.read_file(tracts_path))
 
     # Define output GeoPackage path
+    os.makedirs(eventdir, exist_ok=True)
     gpkg_path = os.path.join(eventdir, "eqmodel_outputs.gpkg")
 
-    # Clip ShakeMap to tract boundaries
-    clipped = clip_shakemap_to_tracts(pga_gdf, tracts_gdf, "shakemap_tractclip_pga", gpkg_path)
-
     # Compute and save tract-level summary statistics
-    calculate_shakemap_statistics(clipped, tracts_gdf, "tract_shakemap_pga", gpkg_path)
+    calculate_shakemap_statistics(pga_gdf, tracts_gdf, "tract_shakemap_pga", gpkg_path)
+
+    # Clip ShakeMap to tract boundaries (only on request)
+    if write_clip:
+        clip_shakemap_to_tracts(pga_gdf, tracts_gdf, "shakemap_tractclip_pga", gpkg_path)
 
     return None
\ No newline at end of file
@@ -3,33 +3,114 @@ Download and merge 2024 TIGER/Line Census Tract shapefiles into a single GeoPack
 
 This script:
 - Scrapes ZIP file links from the 2024 Census Tract TIGER/Line directory
-- Downloads and extracts all shapefiles
-- Merges them into a nationwide GeoPackage for spatial analysis
+- Downloads all ZIPs concurrently (resumable, size-verified) and extracts the shapefiles
+- Merges them into a nationwide GeoPackage for spatial analysis, reading states
+  on a process pool and appending each one to the output as it arrives
 - Cleans up intermediate ZIPs and extracted files
 """
 
 import os
 import glob
 import zipfile
-import requests
-import pandas as pd
-import geopandas as gpd
+import pyogrio
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
+from WorkingScripts.downloader import make_session, download_many
 
 # Base URL to the 2024 Census Tract TIGER/Line shapefiles
 BASE_URL = "https://www2.census.gov/geo/tiger/TIGER2024/TRACT/"
 
-def download_census():
+def read_tract_shapefile(shp):
+    """
+    Read one state's tract shapefile through pyogrio's Arrow reader.
+
+    Parameters
+    ----------
+    shp : str
+        Path to the shapefile.
+
+    Returns
+    -------
+    GeoDataFrame
+    """
+    return pyogrio.read_dataframe(shp, use_arrow=True)
+
+
+def merge_shapefiles(shapefiles, output_gpkg, layer="tracts", max_workers=None):
+    """
+    Stream shapefiles into a single GeoPackage layer, one state at a time.
+
+    Shapefiles are read on a process pool, with at most `max_workers` reads in
+    flight, and each result is appended to the output layer as soon as it is
+    next in order, so peak memory is bounded by a few states rather than the
+    whole country. The layer is written to a temporary GeoPackage that is only
+    moved to `output_gpkg` once every state has been appended, so an interrupted
+    merge never leaves a file that looks complete.
+
+    Parameters
+    ----------
+    shapefiles : list of str
+        Paths to the state shapefiles.
+    output_gpkg : str
+        Path of the merged GeoPackage.
+    layer : str
+        Output layer name.
+    max_workers : int, optional
+        Number of reader processes (defaults to the CPU count).
+
+    Returns
+    -------
+    str
+        `output_gpkg`.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    partial_gpkg = output_gpkg.replace(".gpkg", ".partial.gpkg")
+    if os.path.exists(partial_gpkg):
+        os.remove(partial_gpkg)
+
+    crs = None
+    remaining = iter(shapefiles)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(executor.submit(read_tract_shapefile, shp) for shp in islice(remaining, max_workers))
+        while pending:
+            gdf = pending.popleft().result()
+            next_shp = next(remaining, None)
+            if next_shp is not None:
+                pending.append(executor.submit(read_tract_shapefile, next_shp))
+
+            if crs is None:
+                crs = gdf.crs
+            elif gdf.crs != crs:
+                gdf = gdf.to_crs(crs)
+            pyogrio.write_dataframe(
+                gdf, partial_gpkg, layer=layer, driver="GPKG",
+                promote_to_multi=True, append=os.path.exists(partial_gpkg)
+            )
+            del gdf
+
+    os.replace(partial_gpkg, output_gpkg)
+    return output_gpkg
+
+
+def download_census(max_workers=8):
     """
     Download, extract, and merge 2024 Census Tract shapefiles into a single GeoPackage.
 
     If the output GeoPackage already exists, the function does nothing.
     Otherwise, it:
-    - Scrapes ZIP links from the Census TIGER/Line site (if ZIPs not already present)
-    - Downloads and extracts the shapefiles
+    - Scrapes ZIP links from the Census TIGER/Line site
+    - Downloads the ZIPs on a bounded thread pool, resuming any partial files
+      left by an interrupted run, and extracts the shapefiles
     - Merges them into one GeoPackage layer ("tracts")
     - Deletes all intermediate ZIPs and shapefiles
 
+    Parameters
+    ----------
+    max_workers : int, default 8
+        Number of concurrent ZIP downloads and shapefile reader processes.
+
     Returns
     -------
     None
@@ -54,32 +135,24 @@ def download_census():
     if not os.path.isfile(output_gpkg):
         print(f"No existing GeoPackage found at {output_gpkg}.")
 
-        zip_files = glob.glob(os.path.join(download_folder, "*.zip"))
-        if zip_files:
-            print(f"Found {len(zip_files)} existing ZIP files in {download_folder}. Skipping download.")
-        else:
-            # Step 1: Scrape ZIP file links
-            print(f"Connecting to {BASE_URL}...")
-            response = requests.get(BASE_URL)
-            if response.status_code != 200:
-                raise ValueError(f"Failed to access {BASE_URL} (HTTP {response.status_code})")
-
-            soup = BeautifulSoup(response.text, "html.parser")
-            zip_links = [a['href'] for a in soup.find_all('a', href=True) if a['href'].endswith('.zip')]
-            print(f"Found {len(zip_links)} ZIP files. Starting download...")
-
-            # Step 2: Download ZIP files
-            for zip_file in zip_links:
-                file_url = BASE_URL + zip_file
-                local_path = os.path.join(download_folder, zip_file)
-
-                file_response = requests.get(file_url, stream=True)
-                if file_response.status_code == 200:
-                    with open(local_path, 'wb') as f:
-                        for chunk in file_response.iter_content(chunk_size=1024):
-                            f.write(chunk)
-                else:
-                    raise ValueError(f"Failed to download {zip_file} (HTTP {file_response.status_code})")
+        # Step 1: Scrape ZIP file links
+        print(f"Connecting to {BASE_URL}...")
+        session = make_session(pool_size=max_workers)
+        response = session.get(BASE_URL, timeout=30)
+        if response.status_code != 200:
+            raise ValueError(f"Failed to access {BASE_URL} (HTTP {response.status_code})")
+
+        soup = BeautifulSoup(response.text, "html.parser")
+        zip_links = [a['href'] for a in soup.find_all('a', href=True) if a['href'].endswith('.zip')]
+        print(f"Found {len(zip_links)} ZIP files. Starting download...")
+
+        # Step 2: Download ZIP files (complete files are skipped, partial ones
+        # are resumed)
+        jobs = [
+            {"url": BASE_URL + zip_file, "dest": os.path.join(download_folder, zip_file)}
+            for zip_file in zip_links
+        ]
+        download_many(jobs, max_workers=max_workers, session=session)
 
         # Step 3: Extract ZIP files
         print("Extracting ZIP files...")
@@ -94,13 +167,7 @@ def download_census():
         if not shapefiles:
             raise ValueError("No shapefiles found to merge.")
 
-        gdf_list = []
-        for shp in shapefiles:
-            gdf = gpd.read_file(shp)
-            gdf_list.append(gdf)
-
-        merged_gdf = gpd.GeoDataFrame(pd.concat(gdf_list, ignore_index=True), crs=gdf_list[0].crs)
-        merged_gdf.to_file(output_gpkg, layer="tracts", driver="GPKG")
+        merge_shapefiles(sorted(shapefiles), output_gpkg, layer="tracts", max_workers=max_workers)
         print(f"Saved merged Census Tracts to: {output_gpkg}")
 
     else:
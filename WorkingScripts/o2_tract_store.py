@@ -0,0 +1,218 @@
+"""
+National Census Tract Store (GeoParquet)
+
+This module converts the merged nationwide tract GeoPackage produced by
+`o2_download_census.download_census` into a preprocessed store that is cheap
+to query for every event:
+
+- One GeoParquet file per state (`tracts_{STATEFP}.parquet`), already in
+  EPSG:4326, with an int64 GEOID and per-tract bounding-box columns
+  (minx, miny, maxx, maxy), sorted by GEOID
+- A serialized flat spatial index (`tract_index.npz`) holding the GEOID,
+  state code and bounding box of every tract in the country
+
+At event time, the index is queried with the ShakeMap extent to find which
+state partitions are touched, and only those partitions are read with
+memory-mapped Arrow reads filtered on the bounding-box columns.
+
+Output layout:
+- Data/tract_store/tracts_06.parquet, tracts_41.parquet, ...
+- Data/tract_store/tract_index.npz
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pyogrio
+import geopandas as gpd
+
+from WorkingScripts.stage_cache import warm_load, atomic_write
+
+TRACT_STORE_DIR = os.path.join(os.getcwd(), "Data", "tract_store")
+TRACTS_GPKG = os.path.join(os.getcwd(), "Data", "merged_shapefile", "Nationwide_Tracts.gpkg")
+INDEX_NAME = "tract_index.npz"
+BBOX_COLUMNS = ["minx", "miny", "maxx", "maxy"]
+
+
+def partition_path(store_dir, statefp):
+    """
+    Return the path of the GeoParquet partition for a state.
+
+    Parameters
+    ----------
+    store_dir : str
+        Tract store directory.
+    statefp : int or str
+        State FIPS code (e.g., 6 or '06').
+
+    Returns
+    -------
+    str
+        Path to 'tracts_{STATEFP}.parquet'.
+    """
+    return os.path.join(store_dir, f"tracts_{int(statefp):02d}.parquet")
+
+
+def tract_store_exists(store_dir=TRACT_STORE_DIR):
+    """
+    Check whether a tract store has been built in `store_dir`.
+
+    Returns
+    -------
+    bool
+        True if the serialized spatial index is present.
+    """
+    return os.path.isfile(os.path.join(store_dir, INDEX_NAME))
+
+
+def build_tract_store(gpkg_path=TRACTS_GPKG, store_dir=TRACT_STORE_DIR, overwrite=False):
+    """
+    Write the nationwide tract GeoPackage as state-partitioned GeoParquet.
+
+    Each state is read from the GeoPackage on its own (so peak memory is one
+    state), reprojected to EPSG:4326, given an int64 GEOID and bounding-box
+    columns, sorted by GEOID and written to its own partition. The GEOID,
+    state code and bounds of every tract are collected into the national
+    spatial index, which is written last so an interrupted build is never
+    mistaken for a complete one.
+
+    Parameters
+    ----------
+    gpkg_path : str
+        Path to 'Nationwide_Tracts.gpkg'.
+    store_dir : str
+        Output directory for the partitions and index.
+    overwrite : bool, default False
+        Rebuild even if a store newer than the GeoPackage already exists.
+
+    Returns
+    -------
+    str
+        Path to the tract store directory.
+
+    Raises
+    ------
+    ValueError
+        If the source GeoPackage does not exist.
+
+    Example
+    -------
+    >>> from WorkingScripts.o2_tract_store import build_tract_store
+    >>> build_tract_store()
+    """
+    if not os.path.isfile(gpkg_path):
+        raise ValueError(f"Census tract GeoPackage not found at {gpkg_path}")
+
+    index_path = os.path.join(store_dir, INDEX_NAME)
+    if (not overwrite and os.path.isfile(index_path)
+            and os.path.getmtime(index_path) >= os.path.getmtime(gpkg_path)):
+        print(f"Tract store already up to date at {store_dir}")
+        return store_dir
+
+    os.makedirs(store_dir, exist_ok=True)
+    states = pyogrio.read_dataframe(gpkg_path, columns=["STATEFP"], read_geometry=False)
+    states = sorted(states["STATEFP"].dropna().unique())
+
+    geoids, statefps, bounds = [], [], []
+    for statefp in states:
+        gdf = gpd.read_file(gpkg_path, where=f"STATEFP = '{statefp}'")
+        gdf = gdf.to_crs("EPSG:4326")
+        gdf["GEOID"] = gdf["GEOID"].astype("int64")
+        gdf[BBOX_COLUMNS] = gdf.geometry.bounds.to_numpy()
+        gdf = gdf.sort_values("GEOID").reset_index(drop=True)
+        # Replaced whole, so concurrent event runs never read a partial partition
+        atomic_write(partition_path(store_dir, statefp), lambda f: gdf.to_parquet(f, index=False))
+
+        geoids.append(gdf["GEOID"].to_numpy())
+        statefps.append(np.full(len(gdf), int(statefp), dtype="int16"))
+        bounds.append(gdf[BBOX_COLUMNS].to_numpy(dtype="float64"))
+        print(f"Wrote {len(gdf)} tracts for state {statefp}")
+
+    geoid = np.concatenate(geoids)
+    order = np.argsort(geoid, kind="stable")
+    atomic_write(index_path, lambda f: np.savez(
+        f,
+        geoid=geoid[order],
+        statefp=np.concatenate(statefps)[order],
+        bounds=np.concatenate(bounds)[order],
+    ))
+    print(f"Saved tract store ({len(geoid)} tracts, {len(states)} states) to {store_dir}")
+    return store_dir
+
+
+def load_tract_index(store_dir=TRACT_STORE_DIR):
+    """
+    Load the serialized national tract spatial index.
+
+    Parameters
+    ----------
+    store_dir : str
+        Tract store directory.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        'geoid' (int64, sorted), 'statefp' (int16) and 'bounds' (float64, n x 4).
+    """
+    with np.load(os.path.join(store_dir, INDEX_NAME)) as index:
+        return {key: index[key] for key in index.files}
+
+
+def read_tracts_from_store(bounds, store_dir=TRACT_STORE_DIR, columns=None, keep_in_memory=False):
+    """
+    Read the tracts whose bounding boxes intersect `bounds` from the tract store.
+
+    The national index is filtered with vectorized bounding-box comparisons to
+    find the state partitions the extent touches. Only those partitions are
+    read, memory-mapped, with a row filter on the bounding-box columns so
+    Parquet row groups outside the extent are skipped.
+
+    Parameters
+    ----------
+    bounds : sequence of float
+        (minx, miny, maxx, maxy) in EPSG:4326, e.g. a ShakeMap's total_bounds.
+    store_dir : str
+        Tract store directory.
+    columns : list of str, optional
+        Attribute columns to read in addition to GEOID and geometry.
+    keep_in_memory : bool, default False
+        Keep the index and every partition read in memory for the life of
+        the process (see `stage_cache.warm_load`) and filter them there, so
+        later events in a long-running process read nothing from disk.
+
+    Returns
+    -------
+    GeoDataFrame
+        Candidate tracts in EPSG:4326 with GEOID as an 11-character string.
+    """
+    xmin, ymin, xmax, ymax = [float(b) for b in bounds]
+    if keep_in_memory:
+        index = warm_load(os.path.join(store_dir, INDEX_NAME), lambda path: load_tract_index(store_dir))
+    else:
+        index = load_tract_index(store_dir)
+    tb = index["bounds"]
+    hits = (tb[:, 2] >= xmin) & (tb[:, 0] <= xmax) & (tb[:, 3] >= ymin) & (tb[:, 1] <= ymax)
+    states = np.unique(index["statefp"][hits])
+
+    read_cols = ["GEOID", "geometry"] + [c for c in (columns or []) if c not in ("GEOID", "geometry")]
+    filters = [("maxx", ">=", xmin), ("minx", "<=", xmax), ("maxy", ">=", ymin), ("miny", "<=", ymax)]
+    if keep_in_memory:
+        parts = []
+        for statefp in states:
+            partition = warm_load(partition_path(store_dir, statefp), gpd.read_parquet)
+            inside = ((partition["maxx"] >= xmin) & (partition["minx"] <= xmax)
+                      & (partition["maxy"] >= ymin) & (partition["miny"] <= ymax))
+            parts.append(partition.loc[inside, read_cols])
+    else:
+        parts = [
+            gpd.read_parquet(partition_path(store_dir, statefp), columns=read_cols,
+                             filters=filters, memory_map=True)
+            for statefp in states
+        ]
+    if not parts:
+        return gpd.GeoDataFrame(columns=read_cols, geometry="geometry", crs="EPSG:4326")
+
+    tracts = gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), geometry="geometry", crs=parts[0].crs)
+    tracts["GEOID"] = tracts["GEOID"].astype(str).str.zfill(11)
+    print(f"Loaded {len(tracts)} census tracts from {len(states)} state partition(s)")
+    return tracts
@@ -7,11 +7,17 @@ This module:
 - Merges these datasets to estimate building counts by structural type per tract
 - Outputs merged results for downstream damage estimation
 
+Per-tract exposure (building counts and structural type counts) is kept in a
+GEOID-indexed columnar store (see `o3_exposure_store`), built from the national
+tables once and refreshed when they change, so each event gathers only its own
+tracts instead of re-reading and re-deriving the national tables.
+
 Main Functions:
 - read_event_data
 - read_building_count_by_tract
 - get_building_stock_data
 - count_building_proportion
+- build_exposure_store
 - save_to_geopackage
 - building_clip_analysis
 """
@@ -21,6 +27,14 @@ import numpy as np
 import pandas as pd
 import geopandas as gpd
 
+from WorkingScripts.o3_exposure_store import (
+    EXPOSURE_STORE_DIR, COLUMNS_NAME, exposure_store_is_current, write_exposure_store,
+    load_exposure_store, gather_exposure
+)
+
+BUILDING_COUNT_CSV = os.path.join(os.getcwd(), 'Data', 'building_data_csv', "aggregated_building_data.csv")
+BUILDING_STOCK_CSV = os.path.join(os.getcwd(), 'Tables', 'Building_Percentages_Per_Tract_ALLSTATES.csv')
+
 
 def read_event_data(eventid):
     """
@@ -40,9 +54,11 @@ def read_event_data(eventid):
     gpkg_path = os.path.join(event_dir, "eqmodel_outputs.gpkg")
 
     gdf = gpd.read_file(gpkg_path, layer="tract_shakemap_pga")
-    cols = gdf.columns
-    gdf = gdf[[cols[0], cols[1], cols[2], cols[3], cols[-1]]]
-    return gdf.loc[gdf[cols[1]].notna()]
+    cols = ["GEOID", "max_intensity", "min_intensity", "mean_intensity"]
+    if "weighted_mean_intensity" in gdf.columns:
+        cols.append("weighted_mean_intensity")
+    gdf = gdf[cols + [gdf.geometry.name]]
+    return gdf.loc[gdf["max_intensity"].notna()]
 
 
 def read_building_count_by_tract():
@@ -54,7 +70,7 @@ def read_building_count_by_tract():
     DataFrame
         Building counts with CENSUSCODE as string.
     """
-    csv_path = os.path.join(os.getcwd(), 'Data', 'building_data_csv', "aggregated_building_data.csv")
+    csv_path = BUILDING_COUNT_CSV
     if not os.path.exists(csv_path):
         raise ValueError("CSV file for building count data is not available.")
 
@@ -72,7 +88,7 @@ def get_building_stock_data():
     DataFrame
         Percent share of each building type + total building count per tract.
     """
-    path = os.path.join(os.getcwd(), 'Tables', 'Building_Percentages_Per_Tract_ALLSTATES.csv')
+    path = BUILDING_STOCK_CSV
 
     cols = [
         'W1', 'W2', 'S1L', 'S1M', 'S1H', 'S2L', 'S2M', 'S2H', 'S3', 'S4L', 'S4M', 'S4H',
@@ -119,6 +135,35 @@ def count_building_proportion(building_count, building_stock):
 
 
 
+def build_exposure_store(store_dir=EXPOSURE_STORE_DIR, overwrite=False):
+    """
+    Precompute per-tract structural counts for all tracts into the exposure store.
+
+    Runs the same merge as the CSV-based path (`count_building_proportion` on
+    the national building count and building stock tables) once, and writes
+    the result as a GEOID-indexed float32 matrix. Skipped if the store is
+    newer than both tables.
+
+    Parameters
+    ----------
+    store_dir : str
+        Exposure store directory.
+    overwrite : bool, default False
+        Rebuild even if the store is current.
+
+    Returns
+    -------
+    str
+        Path to the exposure store directory.
+    """
+    sources = [BUILDING_COUNT_CSV, BUILDING_STOCK_CSV]
+    if not overwrite and exposure_store_is_current(sources, store_dir):
+        return store_dir
+
+    exposure = count_building_proportion(read_building_count_by_tract(), get_building_stock_data())
+    return write_exposure_store(exposure, sources, store_dir)
+
+
 def save_to_geopackage(gdf, eventid, layer_name):
     """
     Save GeoDataFrame to a GeoPackage under the given event directory and layer name.
@@ -134,7 +179,7 @@ def save_to_geopackage(gdf, eventid, layer_name):
     print(f"Saved {layer_name} to {gpkg_path} (overwritten).")
 
 
-def building_clip_analysis(eventid):
+def building_clip_analysis(eventid, use_store=True):
     """
     Merge earthquake ShakeMap intensity data with building stock and count estimates by tract.
 
@@ -149,10 +194,18 @@ def building_clip_analysis(eventid):
     - Estimated building counts by structural type (W1, S1L, etc.)
     - Total buildings per tract
 
+    With `use_store`, steps 2-3 are replaced by a lookup of the event's tracts
+    in the exposure store, which returns the same values. The store is built
+    here only if it does not exist yet; `main` refreshes it once before the
+    event is processed (see `build_exposure_store`).
+
     Parameters
     ----------
     eventid : str
         USGS event ID (used to locate event folder and GeoPackage).
+    use_store : bool, default True
+        Gather exposure from the GEOID-indexed exposure store instead of
+        re-deriving it from the national CSV tables.
 
     Returns
     -------
@@ -172,19 +225,29 @@ def building_clip_analysis(eventid):
     # 1. Read the event data
     eventdata = read_event_data(eventid)
 
-    # 2. Read the building count data
-    building_count = read_building_count_by_tract()
-
-    # 3. Read the building stock data
-    building_stock = get_building_stock_data()
-
-    # 4. Merge the building count and building stock data
-    df_output = count_building_proportion(building_count, building_stock)
-
-    # 5. Merge the event data and the merged building count and building stock data
-    final_output = pd.merge(eventdata, df_output, left_on='GEOID', right_on='CENSUSCODE', how='left')
-    final_output.ffill(inplace=True)
-    final_output.drop(columns=['CENSUSCODE'], axis=1, inplace=True)
+    if use_store:
+        # 2-4. Gather the precomputed building estimates of the event's tracts
+        if not os.path.isfile(os.path.join(EXPOSURE_STORE_DIR, COLUMNS_NAME)):
+            build_exposure_store()
+        exposure = gather_exposure(eventdata["GEOID"], load_exposure_store())
+
+        # 5. Attach them to the event data
+        final_output = pd.concat([eventdata.reset_index(drop=True), exposure], axis=1)
+        final_output.ffill(inplace=True)
+    else:
+        # 2. Read the building count data
+        building_count = read_building_count_by_tract()
+
+        # 3. Read the building stock data
+        building_stock = get_building_stock_data()
+
+        # 4. Merge the building count and building stock data
+        df_output = count_building_proportion(building_count, building_stock)
+
+        # 5. Merge the event data and the merged building count and building stock data
+        final_output = pd.merge(eventdata, df_output, left_on='GEOID', right_on='CENSUSCODE', how='left')
+        final_output.ffill(inplace=True)
+        final_output.drop(columns=['CENSUSCODE'], axis=1, inplace=True)
     
     print(f"Building clip analysis completed for event ID: {eventid}")
     
@@ -0,0 +1,164 @@
+"""
+Tract Building Exposure Store
+
+This module holds the national per-tract building exposure (building counts by
+occupancy and the estimated count of each of the 36 Hazus structural types)
+in a columnar, memory-mappable form, so each event reads only the tracts it
+touches instead of parsing the national CSV tables:
+
+- `exposure_values.npy`: float32 matrix (tracts x columns), memory-mapped on load
+- `exposure_geoid.npy`: sorted int64 GEOID of each matrix row
+- `exposure_columns.json`: column names, their original dtypes and the
+  modification times of the source tables the store was built from
+
+Rows are gathered for an event with a binary search of its GEOIDs in the
+sorted index (`gather_exposure`, see `tract_index.tract_rows`). The store is written from the output of
+`o3_clip_eventdata_buildingstocks.count_building_proportion` (see
+`build_exposure_store` there), so gathered values are identical to the ones
+the CSV-based path computes.
+
+Output layout:
+- Data/exposure_store/exposure_values.npy
+- Data/exposure_store/exposure_geoid.npy
+- Data/exposure_store/exposure_columns.json
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from WorkingScripts.tract_index import tract_rows
+from WorkingScripts.stage_cache import atomic_write
+
+EXPOSURE_STORE_DIR = os.path.join(os.getcwd(), "Data", "exposure_store")
+VALUES_NAME = "exposure_values.npy"
+GEOID_NAME = "exposure_geoid.npy"
+COLUMNS_NAME = "exposure_columns.json"
+
+
+def exposure_store_is_current(source_paths, store_dir=EXPOSURE_STORE_DIR):
+    """
+    Check whether the exposure store exists and is newer than its source tables.
+
+    Parameters
+    ----------
+    source_paths : list of str
+        Paths of the CSV tables the store is built from.
+    store_dir : str
+        Exposure store directory.
+
+    Returns
+    -------
+    bool
+        True if the store was built from the current versions of `source_paths`.
+    """
+    columns_path = os.path.join(store_dir, COLUMNS_NAME)
+    if not os.path.isfile(columns_path):
+        return False
+    with open(columns_path, "r") as f:
+        sources = json.load(f).get("sources", {})
+    return all(
+        os.path.isfile(path) and sources.get(os.path.basename(path)) == os.path.getmtime(path)
+        for path in source_paths
+    )
+
+
+def write_exposure_store(exposure, source_paths, store_dir=EXPOSURE_STORE_DIR, geoid_column="CENSUSCODE"):
+    """
+    Write per-tract exposure as a GEOID-sorted float32 matrix.
+
+    Parameters
+    ----------
+    exposure : DataFrame
+        One row per tract: `geoid_column` plus numeric exposure columns.
+    source_paths : list of str
+        Source tables, recorded for `exposure_store_is_current`.
+    store_dir : str
+        Output directory.
+    geoid_column : str
+        Column holding the 11-character tract GEOID.
+
+    Returns
+    -------
+    str
+        Path to the exposure store directory.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    geoid = exposure[geoid_column].astype("int64").to_numpy()
+    order = np.argsort(geoid, kind="stable")
+    geoid = geoid[order]
+    # A tract listed twice keeps its first row, as a GEOID lookup would
+    keep = np.ones(len(geoid), dtype=bool)
+    keep[1:] = geoid[1:] != geoid[:-1]
+
+    values = exposure.drop(columns=[geoid_column])
+    columns = list(values.columns)
+    matrix = values.to_numpy(dtype="float32")[order][keep]
+
+    # Each file is replaced whole, so a run that has the previous store
+    # memory-mapped keeps reading the previous values
+    atomic_write(os.path.join(store_dir, VALUES_NAME), lambda f: np.save(f, matrix))
+    atomic_write(os.path.join(store_dir, GEOID_NAME), lambda f: np.save(f, geoid[keep]))
+    # Written last so an interrupted build is never mistaken for a complete one
+    meta = {
+        "columns": columns,
+        "dtypes": {col: str(values[col].dtype) for col in columns},
+        "sources": {os.path.basename(path): os.path.getmtime(path) for path in source_paths},
+    }
+    atomic_write(os.path.join(store_dir, COLUMNS_NAME), lambda f: json.dump(meta, f, indent=2), mode="w")
+    print(f"Saved exposure store ({matrix.shape[0]} tracts, {matrix.shape[1]} columns) to {store_dir}")
+    return store_dir
+
+
+def load_exposure_store(store_dir=EXPOSURE_STORE_DIR):
+    """
+    Open the exposure store, memory-mapping the value matrix.
+
+    Returns
+    -------
+    dict
+        'geoid' (int64, sorted), 'values' (float32 memmap, tracts x columns),
+        'columns' (list of str) and 'dtypes' (column name to dtype string).
+    """
+    with open(os.path.join(store_dir, COLUMNS_NAME), "r") as f:
+        meta = json.load(f)
+    return {
+        "geoid": np.load(os.path.join(store_dir, GEOID_NAME)),
+        "values": np.load(os.path.join(store_dir, VALUES_NAME), mmap_mode="r"),
+        "columns": meta["columns"],
+        "dtypes": meta["dtypes"],
+    }
+
+
+def gather_exposure(geoids, store):
+    """
+    Gather the exposure rows of the given tracts from the store.
+
+    Parameters
+    ----------
+    geoids : array-like
+        Tract GEOIDs (strings or integers), in the order of the output rows.
+    store : dict
+        Output of `load_exposure_store`.
+
+    Returns
+    -------
+    DataFrame
+        One row per input GEOID with the store's columns. Tracts missing from
+        the store are all-NaN rows.
+    """
+    rows = tract_rows(store["geoid"], geoids)
+    found = rows >= 0
+
+    values = np.full((len(rows), len(store["columns"])), np.nan)
+    values[found] = store["values"][rows[found]]
+    df = pd.DataFrame(values, columns=store["columns"])
+
+    # Columns that were integers in the source tables come back as integers
+    # when every requested tract was found
+    if found.all():
+        for col, dtype in store["dtypes"].items():
+            if dtype.startswith("int"):
+                df[col] = df[col].astype(dtype)
+    return df
@@ -7,22 +7,62 @@ state-level building footprint data from the U.S. Federal GeoPlatform
 (USA_Structures). It supports:
 
 - Scraping state-level GDB download links
-- Downloading and extracting ZIP archives
-- Reading GDB files and selecting relevant columns
-- Remapping occupancy classifications
-- Aggregating and pivoting building counts by census tract
+- Downloading (resumable, size-verified) and extracting ZIP archives
+- Reading GDB files and selecting relevant columns (in full, or streamed in
+  geometry-free record batches with bounded memory)
+- Remapping occupancy classifications to integer codes (vectorized)
+- Counting buildings by census tract and occupancy in a single bincount pass
+- Processing states in parallel on a process pool, isolating per-state failures
 - Producing a unified CSV of building data across all states
+- Tracking per-state source and output hashes in a manifest, so a rebuild only
+  re-aggregates states whose source changed and patches the national CSV in place
 """
 
 import os
+import re
+import json
 import time
 import zipfile
 import requests
 import glob
 import pandas as pd
 import numpy as np
+import pyogrio
 import geopandas as gpd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from bs4 import BeautifulSoup
+from WorkingScripts.downloader import make_session, download_file, file_sha256, remote_fingerprint
+
+# Attribute columns needed to count buildings per tract and occupancy
+COUNT_COLUMNS = ["BUILD_ID", "OCC_CLS", "PRIM_OCC", "CENSUSCODE"]
+# Records per Arrow batch when streaming a state GDB
+BATCH_SIZE = 250_000
+# Occupancy categories (sorted, so integer codes follow groupby order)
+OCC_CLS_LABELS = ["OTHER", "RESIDENTIAL"]
+PRIM_OCC_LABELS = ["MULTI FAMILY", "OTHER", "SINGLE FAMILY"]
+COUNT_COMBOS = [f"{occ_cls}_{prim_occ}" for occ_cls in OCC_CLS_LABELS for prim_occ in PRIM_OCC_LABELS]
+AGGREGATED_CSV = "aggregated_building_data.csv"
+MANIFEST_NAME = "building_manifest.json"
+STATE_CSV_PATTERN = re.compile(r"^([A-Z]{2})_building_data\.csv$")
+
+# Full mapping of area names to abbreviations
+STATE_ABBREVIATIONS = {
+    "Alabama": "AL", "Alaska": "AK", "American Samoa": "AS", "Arizona": "AZ",
+    "Arkansas": "AR", "California": "CA", "Colorado": "CO", "Connecticut": "CT",
+    "Delaware": "DE", "D.C.": "DC", "District of Columbia": "DC", "Guam": "GU",
+    "Florida": "FL", "Georgia": "GA", "Hawaii": "HI", "Idaho": "ID",
+    "Illinois": "IL", "Indiana": "IN", "Iowa": "IA", "Kansas": "KS",
+    "Kentucky": "KY", "Louisiana": "LA", "Maine": "ME", "Maryland": "MD",
+    "Massachusetts": "MA", "Michigan": "MI", "Minnesota": "MN", "Missouri": "MO",
+    "Mississippi": "MS", "Montana": "MT", "Nebraska": "NE", "Nevada": "NV",
+    "New Hampshire": "NH", "New Jersey": "NJ", "New Mexico": "NM", "New York": "NY",
+    "North Carolina": "NC", "North Dakota": "ND", "Northern Mariana Islands": "MP",
+    "Ohio": "OH", "Oklahoma": "OK", "Oregon": "OR", "Pennsylvania": "PA",
+    "Puerto Rico": "PR", "Rhode Island": "RI", "South Carolina": "SC",
+    "South Dakota": "SD", "Tennessee": "TN", "Texas": "TX", "Utah": "UT",
+    "Vermont": "VT", "Virgin Islands": "VI", "Virginia": "VA", "Washington": "WA",
+    "West Virginia": "WV", "Wisconsin": "WI", "Wyoming": "WY"
+}
 
 
 def make_data_path():
@@ -95,16 +135,27 @@ def fetch_state_links():
     return deliverable_links
 
 
-def download_and_extract_zip(state_name, state_links):
+def download_and_extract_zip(state_name, state_links, session=None):
     """
     Download and extract a ZIP archive of building data for a given state.
 
+    The archive is fetched with `downloader.download_file`, so an interrupted
+    download resumes from the bytes already on disk and the file size is
+    verified before extraction.
+
     Parameters
     ----------
     state_name : str
         Name of the state (must match key in `state_links`).
     state_links : dict
         Dictionary mapping state names to ZIP URLs (from `fetch_state_links()`).
+    session : requests.Session, optional
+        Pooled HTTP session shared across downloads.
+
+    Returns
+    -------
+    str
+        sha256 hex digest of the downloaded archive.
 
     Raises
     ------
@@ -121,20 +172,15 @@ def download_and_extract_zip(state_name, state_links):
     zip_path = os.path.join(output_dir, f"{state_name}_Structures.zip")
 
     print(f"Downloading {state_name} ZIP from {url}...")
-    response = requests.get(url, stream=True)
-
-    if response.status_code == 200:
-        with open(zip_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(output_dir)
-        # rmeove zip file once complete
-        os.remove(zip_path)
-        print(f"Extracted and cleaned up ZIP for {state_name}")
-    else:
-        raise ValueError(f"Failed to download ZIP for {state_name}. HTTP {response.status_code}")
+    download_file(url, zip_path, session=session)
+    source_sha256 = file_sha256(zip_path)
+
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        zip_ref.extractall(output_dir)
+    # rmeove zip file once complete
+    os.remove(zip_path)
+    print(f"Extracted and cleaned up ZIP for {state_name}")
+    return source_sha256
 
 
 def gdb_path_by_state(stateid):
@@ -211,6 +257,37 @@ def read_building_data(stateid):
         return 'gdb', gdb_df
 
 
+def occupancy_codes(gdf):
+    """
+    Encode occupancy class and primary occupancy as small integer codes.
+
+    OCC_CLS is coded by position in `OCC_CLS_LABELS` ('Residential' -> RESIDENTIAL,
+    anything else -> OTHER) and PRIM_OCC by position in `PRIM_OCC_LABELS`
+    ('Single Family Dwelling' -> SINGLE FAMILY, 'Multi - Family Dwelling' ->
+    MULTI FAMILY, anything else -> OTHER), with vectorized comparisons only.
+
+    Parameters
+    ----------
+    gdf : DataFrame
+        Building records with 'OCC_CLS' and 'PRIM_OCC' columns.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (occ_code, prim_code) as int8 arrays.
+    """
+    occ_cls = gdf["OCC_CLS"].to_numpy()
+    prim_occ = gdf["PRIM_OCC"].to_numpy()
+    occ_code = np.where(occ_cls == "Residential", OCC_CLS_LABELS.index("RESIDENTIAL"),
+                        OCC_CLS_LABELS.index("OTHER")).astype("int8")
+    prim_code = np.select(
+        [prim_occ == "Single Family Dwelling", prim_occ == "Multi - Family Dwelling"],
+        [PRIM_OCC_LABELS.index("SINGLE FAMILY"), PRIM_OCC_LABELS.index("MULTI FAMILY")],
+        PRIM_OCC_LABELS.index("OTHER"),
+    ).astype("int8")
+    return occ_code, prim_code
+
+
 def remap_occupancy_classes(gdf):
     """
     Remap occupancy class and primary occupancy values in building data.
@@ -219,34 +296,84 @@ def remap_occupancy_classes(gdf):
     ----------
     gdf : GeoDataFrame
         Raw building data read from a state's GDB file, containing at least:
-        'BUILD_ID', 'OCC_CLS', 'PRIM_OCC', 'CENSUSCODE', 'LONGITUDE', 'LATITUDE'.
+        'BUILD_ID', 'OCC_CLS', 'PRIM_OCC', 'CENSUSCODE' (and optionally
+        'LONGITUDE', 'LATITUDE').
 
     Returns
     -------
     GeoDataFrame
-        A simplified and remapped building dataset with standardized occupancy labels.
+        A simplified and remapped building dataset with standardized occupancy
+        labels, stored as categoricals.
     """
-    # Select relevant columns
-    building_data = gdf[["BUILD_ID", "OCC_CLS", "PRIM_OCC", "CENSUSCODE", "LONGITUDE", "LATITUDE"]].copy()
+    # Select relevant columns (coordinates are kept when present)
+    cols = [col for col in COUNT_COLUMNS + ["LONGITUDE", "LATITUDE"] if col in gdf.columns]
+    building_data = gdf[cols].copy()
+
+    # Remap OCC_CLS (if not Residential, other) and PRIM_OCC
+    occ_code, prim_code = occupancy_codes(building_data)
+    building_data["OCC_CLS"] = pd.Categorical.from_codes(occ_code, OCC_CLS_LABELS)
+    building_data["PRIM_OCC"] = pd.Categorical.from_codes(prim_code, PRIM_OCC_LABELS)
 
-    # Remap OCC_CLS (if not Residential, other)
-    building_data["OCC_CLS"] = building_data["OCC_CLS"].apply(
-    lambda x: "RESIDENTIAL" if x == "Residential" else "OTHER"
+    return building_data
+
+
+def count_buildings_by_tract(gdf):
+    """
+    Count buildings per tract and occupancy combination in one bincount pass.
+
+    Each record is assigned a single integer key from its tract code and its
+    OCC_CLS / PRIM_OCC codes, and `np.bincount` counts all keys at once. Records
+    with a missing CENSUSCODE or BUILD_ID are not counted, as with a groupby count.
+
+    Parameters
+    ----------
+    gdf : DataFrame
+        Building records with 'BUILD_ID', 'OCC_CLS', 'PRIM_OCC' and 'CENSUSCODE'.
+
+    Returns
+    -------
+    DataFrame
+        One row per CENSUSCODE (sorted index) and one int64 column per
+        '{OCC_CLS}_{PRIM_OCC}' combination in `COUNT_COMBOS`.
+    """
+    tract_code, tracts = pd.factorize(gdf["CENSUSCODE"], sort=True)
+    occ_code, prim_code = occupancy_codes(gdf)
+    n_prim = len(PRIM_OCC_LABELS)
+
+    valid = (tract_code >= 0) & gdf["BUILD_ID"].notna().to_numpy()
+    key = (tract_code.astype("int64") * len(OCC_CLS_LABELS) + occ_code) * n_prim + prim_code
+    counts = np.bincount(key[valid], minlength=len(tracts) * len(COUNT_COMBOS))
+
+    return pd.DataFrame(
+        counts.reshape(len(tracts), len(COUNT_COMBOS)),
+        index=pd.Index(tracts, name="CENSUSCODE"),
+        columns=COUNT_COMBOS,
     )
 
-    # Remap PRIM_OCC
-    prim_occ_mapping = {
-        val: "OTHER"
-        for val in building_data["PRIM_OCC"].unique()
-        if val not in ["Single Family Dwelling", "Multi - Family Dwelling"]
-    }
-    prim_occ_mapping.update({
-        "Single Family Dwelling": "SINGLE FAMILY",
-        "Multi - Family Dwelling": "MULTI FAMILY"
-    })
-    building_data["PRIM_OCC"] = building_data["PRIM_OCC"].map(prim_occ_mapping)
 
-    return building_data
+def counts_to_long(tract_counts):
+    """
+    Convert per-tract combination counts to one row per non-empty combination.
+
+    Parameters
+    ----------
+    tract_counts : DataFrame
+        Output of `count_buildings_by_tract`.
+
+    Returns
+    -------
+    DataFrame
+        Columns CENSUSCODE, OCC_CLS, PRIM_OCC, COUNT, sorted by the first three.
+    """
+    counts = tract_counts.to_numpy()
+    row, combo = np.nonzero(counts)
+    n_prim = len(PRIM_OCC_LABELS)
+    return pd.DataFrame({
+        "CENSUSCODE": tract_counts.index.to_numpy()[row],
+        "OCC_CLS": np.asarray(OCC_CLS_LABELS, dtype=object)[combo // n_prim],
+        "PRIM_OCC": np.asarray(PRIM_OCC_LABELS, dtype=object)[combo % n_prim],
+        "COUNT": counts[row, combo].astype("int64"),
+    })
 
 
 def aggregate_building_counts(gdf):
@@ -264,17 +391,97 @@ def aggregate_building_counts(gdf):
         Aggregated building counts by CENSUSCODE, OCC_CLS, and PRIM_OCC,
         with one row per unique combination and a 'COUNT' column.
     """
-    # Standardize occupancy classes and keep relevant columns
-    building_data = remap_occupancy_classes(gdf)
+    return counts_to_long(count_buildings_by_tract(gdf))
 
-    # Group by tract ID, occupancy class, and primary occupancy
-    grouped = (
-        building_data
-        .groupby(["CENSUSCODE", "OCC_CLS", "PRIM_OCC"])
-        .agg(COUNT=("BUILD_ID", "count"))
-        .reset_index()
-    )
-    return grouped
+
+def stream_building_counts_by_tract(gdb_path, batch_size=BATCH_SIZE):
+    """
+    Count buildings per tract from a state GDB without loading it into memory.
+
+    The GDB is read through pyogrio's Arrow stream in record batches holding
+    only the columns needed for counting and no geometry. Each batch is counted
+    with `count_buildings_by_tract` and folded into a running total, so memory
+    stays at roughly one batch regardless of the size of the state.
+
+    Parameters
+    ----------
+    gdb_path : str
+        Path to the state's .gdb (see `gdb_path_by_state`).
+    batch_size : int
+        Number of records per batch.
+
+    Returns
+    -------
+    DataFrame
+        Same layout as `count_buildings_by_tract`.
+    """
+    totals = None
+    print(f"Streaming {gdb_path} in batches of {batch_size}")
+    with pyogrio.open_arrow(gdb_path, columns=COUNT_COLUMNS, read_geometry=False,
+                            batch_size=batch_size, use_pyarrow=True) as (_, reader):
+        for batch in reader:
+            counts = count_buildings_by_tract(batch.to_pandas())
+            totals = counts if totals is None else totals.add(counts, fill_value=0)
+
+    if totals is None:
+        return pd.DataFrame(columns=COUNT_COMBOS, index=pd.Index([], name="CENSUSCODE"), dtype="int64")
+    return totals.astype("int64").sort_index()
+
+
+def aggregate_building_counts_streaming(gdb_path, batch_size=BATCH_SIZE):
+    """
+    Aggregate building counts from a state GDB in bounded memory.
+
+    Parameters
+    ----------
+    gdb_path : str
+        Path to the state's .gdb (see `gdb_path_by_state`).
+    batch_size : int
+        Number of records per batch.
+
+    Returns
+    -------
+    DataFrame
+        Same layout as `aggregate_building_counts`: one row per
+        CENSUSCODE / OCC_CLS / PRIM_OCC combination with a 'COUNT' column.
+    """
+    return counts_to_long(stream_building_counts_by_tract(gdb_path, batch_size))
+
+
+def counts_to_pivot(tract_counts):
+    """
+    Build the per-state wide table directly from per-tract combination counts.
+
+    Produces the same layout as `pivot_building_data` (combinations that occur
+    in the state, the expected residential / other columns, TOTAL_RESIDENTIAL
+    and TOTAL_BUILDING) without a long-format pivot.
+
+    Parameters
+    ----------
+    tract_counts : DataFrame
+        Output of `count_buildings_by_tract` or `stream_building_counts_by_tract`.
+
+    Returns
+    -------
+    DataFrame
+        One row per CENSUSCODE.
+    """
+    present = [col for col in COUNT_COMBOS if tract_counts[col].any()]
+    df_pivot = tract_counts[present].reset_index()
+
+    residential_cols = [
+        "RESIDENTIAL_SINGLE FAMILY",
+        "RESIDENTIAL_MULTI FAMILY",
+        "RESIDENTIAL_OTHER"]
+    other_col = "OTHER_OTHER"
+
+    for col in residential_cols + [other_col]:
+        if col not in df_pivot.columns:
+            df_pivot[col] = 0
+
+    df_pivot["TOTAL_RESIDENTIAL"] = df_pivot[residential_cols].sum(axis=1)
+    df_pivot["TOTAL_BUILDING"] = df_pivot["TOTAL_RESIDENTIAL"] + df_pivot[other_col]
+    return df_pivot
 
 
 def pivot_building_data(count_building_data):
@@ -327,38 +534,80 @@ def pivot_building_data(count_building_data):
     return df_pivot
 
 
-def aggregate_building_data():
+def read_building_manifest(csv_dir):
     """
-    Aggregate building data across all states and save to a single CSV file.
+    Read the per-state building data manifest.
 
-    This function reads all per-state building data CSVs in the 
-    'Data/building_data_csv' directory, adds state identifiers, 
-    calculates total building counts per row, and outputs a combined 
-    'aggregated_building_data.csv'.
+    Parameters
+    ----------
+    csv_dir : str
+        The 'Data/building_data_csv' directory.
 
     Returns
     -------
-    None
-        Writes output to disk.
+    dict
+        Mapping of state ID to its recorded source fingerprint, source archive
+        sha256, CSV sha256 and row count. Empty if no manifest exists.
     """
-    csv_dir = os.path.join(os.path.dirname(os.getcwd()), "Data", "building_data_csv")
-    csv_files = [f for f in os.listdir(csv_dir) if f.endswith(".csv")]
+    manifest_path = os.path.join(csv_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
 
-    dfs = []
-    for file in csv_files:
-        df = pd.read_csv(os.path.join(csv_dir, file))
-        stateid = file.split("_")[0]
-        df["STATE_ID"] = stateid
-        dfs.append(df)
 
-    if not dfs:
-        print("No building data CSVs found to aggregate.")
-        raise ValueError
+def write_building_manifest(manifest, csv_dir):
+    """
+    Atomically write the per-state building data manifest.
+    """
+    manifest_path = os.path.join(csv_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
 
-    building_data = pd.concat(dfs, ignore_index=True)
+
+def state_csv_files(csv_dir):
+    """
+    List the per-state '{STATE_ID}_building_data.csv' files in `csv_dir`.
+
+    Returns
+    -------
+    dict
+        Mapping of state ID to file name (the national CSV is excluded).
+    """
+    files = {}
+    for file in sorted(os.listdir(csv_dir)):
+        match = STATE_CSV_PATTERN.match(file)
+        if match:
+            files[match.group(1)] = file
+    return files
+
+
+def prepare_state_building_data(df, stateid):
+    """
+    Shape one state's building counts into national table rows.
+
+    Adds the state identifier, drops the irrelevant 'OTHER_SINGLE FAMILY' column,
+    ensures the residential / other columns exist and computes
+    'TOTAL_BUILDING_COUNT'.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Content of a '{STATE_ID}_building_data.csv' file.
+    stateid : str
+        Two-letter state abbreviation.
+
+    Returns
+    -------
+    DataFrame
+    """
+    df = df.copy()
+    df["STATE_ID"] = stateid
 
     # Drop known irrelevant column if it exists
-    building_data = building_data.drop(columns=["OTHER_SINGLE FAMILY"], errors="ignore")
+    df = df.drop(columns=["OTHER_SINGLE FAMILY"], errors="ignore")
 
     # Ensure required columns exist
     for col in [
@@ -367,25 +616,151 @@ def aggregate_building_data():
         "RESIDENTIAL_OTHER", 
         "RESIDENTIAL_SINGLE FAMILY"
     ]:
-        if col not in building_data.columns:
-            building_data[col] = 0
+        if col not in df.columns:
+            df[col] = 0
 
     # Compute total building count
-    building_data["TOTAL_BUILDING_COUNT"] = (
-        building_data["OTHER_OTHER"] +
-        building_data["RESIDENTIAL_MULTI FAMILY"] +
-        building_data["RESIDENTIAL_OTHER"] +
-        building_data["RESIDENTIAL_SINGLE FAMILY"]
+    df["TOTAL_BUILDING_COUNT"] = (
+        df["OTHER_OTHER"] +
+        df["RESIDENTIAL_MULTI FAMILY"] +
+        df["RESIDENTIAL_OTHER"] +
+        df["RESIDENTIAL_SINGLE FAMILY"]
     )
+    return df
+
+
+def aggregate_building_data(changed_states=None):
+    """
+    Aggregate building data across all states and save to a single CSV file.
+
+    This function reads the per-state building data CSVs in the 
+    'Data/building_data_csv' directory, adds state identifiers, 
+    calculates total building counts per row, and outputs a combined 
+    'aggregated_building_data.csv'.
+
+    When `changed_states` is given and the national CSV already exists, only
+    those states are re-read: their rows are replaced in the existing national
+    table instead of rebuilding it from every state file.
+
+    Parameters
+    ----------
+    changed_states : iterable of str, optional
+        State IDs whose CSVs changed. None rebuilds from every state CSV.
+
+    Returns
+    -------
+    None
+        Writes output to disk.
+    """
+    csv_dir = os.path.join(os.getcwd(), "Data", "building_data_csv")
+    output_path = os.path.join(csv_dir, AGGREGATED_CSV)
+    csv_files = state_csv_files(csv_dir)
+
+    if changed_states is not None and os.path.isfile(output_path):
+        changed_states = set(changed_states)
+        if not changed_states:
+            print("No state building data changed; national CSV is up to date.")
+            return None
+        building_data = pd.read_csv(output_path, dtype={"STATE_ID": str})
+        building_data = building_data[~building_data["STATE_ID"].isin(changed_states)]
+        dfs = [building_data] + [
+            prepare_state_building_data(pd.read_csv(os.path.join(csv_dir, csv_files[stateid])), stateid)
+            for stateid in sorted(changed_states) if stateid in csv_files
+        ]
+        print(f"Patching national building data for: {', '.join(sorted(changed_states))}")
+    else:
+        dfs = [
+            prepare_state_building_data(pd.read_csv(os.path.join(csv_dir, file)), stateid)
+            for stateid, file in csv_files.items()
+        ]
+
+    if not dfs:
+        print("No building data CSVs found to aggregate.")
+        raise ValueError
+
+    building_data = pd.concat(dfs, ignore_index=True)
 
     # Save to file
-    output_path = os.path.join(csv_dir, "aggregated_building_data.csv")
     building_data.to_csv(output_path, index=False)
     print(f"Saved aggregated building data to {output_path}")
     return None
 
 
-def o3_get_building_structures():
+def process_state(state_name, stateid, url, streaming=True, batch_size=BATCH_SIZE, source_sha256=None):
+    """
+    Download, extract, aggregate and save the building counts of one state.
+
+    Runs in a worker process of `o3_get_building_structures`, so each state's
+    download, extraction and aggregation proceed independently of the others.
+    If the downloaded archive has the same sha256 as `source_sha256` (the one
+    recorded in the manifest) and the state CSV exists, the aggregation is skipped.
+
+    Parameters
+    ----------
+    state_name : str
+        Name of the state as listed on the USA_Structures page.
+    stateid : str
+        Two-letter state abbreviation.
+    url : str
+        URL of the state's GDB ZIP archive.
+    streaming : bool
+        Use `aggregate_building_counts_streaming` to read the GDB.
+    batch_size : int
+        Records per batch in streaming mode.
+    source_sha256 : str, optional
+        sha256 of the archive the existing state CSV was built from.
+
+    Returns
+    -------
+    dict
+        'csv_path', 'source_sha256' of the downloaded archive and 'rebuilt'
+        (False if the archive was unchanged and the CSV was kept).
+    """
+    csv_dir = os.path.join(os.getcwd(), "Data", "building_data_csv")
+    output_path = os.path.join(csv_dir, f"{stateid}_building_data.csv")
+
+    new_sha256 = download_and_extract_zip(state_name, {state_name: url})
+    if new_sha256 == source_sha256 and os.path.isfile(output_path):
+        print(f"{state_name} ({stateid}): source archive unchanged, keeping {output_path}")
+        return {"csv_path": output_path, "source_sha256": new_sha256, "rebuilt": False}
+
+    if streaming:
+        tract_counts = stream_building_counts_by_tract(gdb_path_by_state(stateid), batch_size)
+    else:
+        # Read the GDB itself: `read_building_data` returns no records when the
+        # state CSV being rebuilt already exists
+        gdb_path = gdb_path_by_state(stateid)
+        print(f"Reading {gdb_path}")
+        gdf = gpd.read_file(gdb_path, columns=COUNT_COLUMNS, ignore_geometry=True)
+        tract_counts = count_buildings_by_tract(gdf)
+    df_pivot = counts_to_pivot(tract_counts)
+
+    df_pivot.to_csv(output_path, index=False)
+    print(f"{state_name} ({stateid}): saved {output_path}")
+    return {"csv_path": output_path, "source_sha256": new_sha256, "rebuilt": True}
+
+
+def manifest_entry(csv_path, state_name, fingerprint, source_sha256):
+    """
+    Build the manifest record of a state CSV.
+
+    Returns
+    -------
+    dict
+        'state_name', remote 'fingerprint', 'source_sha256', 'csv_sha256' and 'rows'.
+    """
+    with open(csv_path, "rb") as f:
+        rows = max(sum(1 for _ in f) - 1, 0)
+    return {
+        "state_name": state_name,
+        "fingerprint": fingerprint,
+        "source_sha256": source_sha256,
+        "csv_sha256": file_sha256(csv_path),
+        "rows": rows,
+    }
+
+
+def o3_get_building_structures(max_workers=4, streaming=True, batch_size=BATCH_SIZE, states=None, force=False):
     """
     Download, extract, process, and aggregate building footprint data for all U.S. states and territories.
 
@@ -398,93 +773,125 @@ def o3_get_building_structures():
     - Saving per-state CSVs
     - Merging all state files into a single nationwide CSV (`aggregated_building_data.csv`)
 
-    if a state's processed CSV already exists, it will skip reprocessing that state. 
-    Intermediate GDB and CSV files are saved under the `Data/` directory.
+    States are processed on a process pool (`process_state`), so one state's
+    download overlaps with another's extraction and aggregation. A failure in
+    one state is reported and does not stop the others; the nationwide CSV is
+    built from every state that succeeded.
+
+    Rebuilds are incremental. 'Data/building_data_csv/building_manifest.json'
+    records, for every state, the remote archive fingerprint (ETag,
+    Last-Modified, Content-Length from a HEAD request), the archive sha256, and
+    the sha256 and row count of the state CSV. A state whose CSV exists and whose
+    remote fingerprint is unchanged is skipped without downloading; a
+    re-downloaded archive with an unchanged sha256 is not re-aggregated. Only
+    states whose CSV content changed are replaced in the nationwide CSV, which
+    is patched in place rather than rebuilt from every state. State CSVs from
+    before the manifest existed are adopted as-is on the first run.
+
+    Parameters
+    ----------
+    max_workers : int, default 4
+        Number of states processed in parallel.
+    streaming : bool, default True
+        Aggregate each GDB from geometry-free record batches
+        (`aggregate_building_counts_streaming`) instead of loading the whole
+        state into a GeoDataFrame.
+    batch_size : int
+        Records per batch in streaming mode.
+    states : list of str, optional
+        Only check these state IDs (e.g., ['CA']). All states when None.
+    force : bool, default False
+        Re-download and re-aggregate the selected states even if unchanged.
 
     Returns
     -------
-    None
-        Outputs are written to disk.
+    dict
+        Mapping of state name to error message for every state that failed
+        (empty if all succeeded). Outputs are written to disk.
 
     Example
     -------
     >>> from WorkingScripts.o3_building_module import o3_get_building_structures
-    >>> o3_get_building_structures()
+    >>> failures = o3_get_building_structures(max_workers=8)
+    >>> failures = o3_get_building_structures(states=["CA"], force=True)  # refresh one state
 
     # Outputs:
     # - Data/building_data_csv/{STATE_ID}_building_data.csv for each state/territory
     # - Data/building_data_gdb/{STATE}_Structures.gdb folders (raw GDBs)
     # - Data/building_data_csv/aggregated_building_data.csv (final merged file)
+    # - Data/building_data_csv/building_manifest.json (per-state hashes and row counts)
     """
-    # Full mapping of area names to abbreviations
-    STATE_ABBREVIATIONS = {
-        "Alabama": "AL", "Alaska": "AK", "American Samoa": "AS", "Arizona": "AZ",
-        "Arkansas": "AR", "California": "CA", "Colorado": "CO", "Connecticut": "CT",
-        "Delaware": "DE", "D.C.": "DC", "District of Columbia": "DC", "Guam": "GU",
-        "Florida": "FL", "Georgia": "GA", "Hawaii": "HI", "Idaho": "ID",
-        "Illinois": "IL", "Indiana": "IN", "Iowa": "IA", "Kansas": "KS",
-        "Kentucky": "KY", "Louisiana": "LA", "Maine": "ME", "Maryland": "MD",
-        "Massachusetts": "MA", "Michigan": "MI", "Minnesota": "MN", "Missouri": "MO",
-        "Mississippi": "MS", "Montana": "MT", "Nebraska": "NE", "Nevada": "NV",
-        "New Hampshire": "NH", "New Jersey": "NJ", "New Mexico": "NM", "New York": "NY",
-        "North Carolina": "NC", "North Dakota": "ND", "Northern Mariana Islands": "MP",
-        "Ohio": "OH", "Oklahoma": "OK", "Oregon": "OR", "Pennsylvania": "PA",
-        "Puerto Rico": "PR", "Rhode Island": "RI", "South Carolina": "SC",
-        "South Dakota": "SD", "Tennessee": "TN", "Texas": "TX", "Utah": "UT",
-        "Vermont": "VT", "Virgin Islands": "VI", "Virginia": "VA", "Washington": "WA",
-        "West Virginia": "WV", "Wisconsin": "WI", "Wyoming": "WY"
-    }
-
     # print("Fetching state/territory download links...")
     state_links = fetch_state_links()
 
     csv_dir = os.path.join(os.getcwd(), "Data", "building_data_csv")
     os.makedirs(csv_dir, exist_ok=True)
+    manifest = read_building_manifest(csv_dir)
 
-    # print("Checking and processing available states...")
+    # One candidate per state abbreviation
+    candidates = {}
     for state_name, url in state_links.items():
         stateid = STATE_ABBREVIATIONS.get(state_name)
-        if not stateid:
+        if not stateid or stateid in candidates.values():
             # print(f"Skipping unknown or unmapped area: {state_name}")
             continue
-
-        csv_path = os.path.join(csv_dir, f"{stateid}_building_data.csv")
-        if os.path.exists(csv_path):
-            # print(f"{state_name} ({stateid}): CSV already exists, skipping.")
+        if states is not None and stateid not in states:
             continue
+        candidates[state_name] = stateid
 
-        try:
-            download_and_extract_zip(state_name, state_links)
-        except Exception as e:
-            # print(f"{state_name}: Failed to download or extract. Error: {e}")
-            raise ValueError
-
-    # print("Reading and processing GDBs...")
-    for state_name in state_links.keys():
-        stateid = STATE_ABBREVIATIONS.get(state_name)
-        if not stateid:
-            continue
+    session = make_session(pool_size=max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fingerprints = dict(zip(
+            candidates,
+            executor.map(lambda name: remote_fingerprint(state_links[name], session=session), candidates),
+        ))
 
+    jobs = {}
+    for state_name, stateid in candidates.items():
         csv_path = os.path.join(csv_dir, f"{stateid}_building_data.csv")
-        if os.path.exists(csv_path):
-            # print(f"{state_name} ({stateid}): CSV already exists, skipping.")
-            continue
-
-        # print(f"Processing {state_name} ({stateid})...")
-        filetype, gdf = read_building_data(stateid)
-
-        if filetype == 'csv':
-            # print("CSV exists. Skipping.")
-            continue
-
-        count_building_data = aggregate_building_counts(gdf)
-        df_pivot = pivot_building_data(count_building_data)
-
-        output_path = os.path.join(csv_dir, f"{stateid}_building_data.csv")
-        df_pivot.to_csv(output_path, index=False)
-        # print(f"Saved: {output_path}")
-
-    print("Combining all state CSVs into nationwide dataset...")
-    aggregate_building_data()
+        entry = manifest.get(stateid)
+        fingerprint = fingerprints[state_name]
+        if os.path.exists(csv_path) and not force:
+            if entry is None:
+                # CSV from before the manifest: adopt it as built from the current source
+                manifest[stateid] = manifest_entry(csv_path, state_name, fingerprint, None)
+                continue
+            if fingerprint is None or entry.get("fingerprint") == fingerprint:
+                # print(f"{state_name} ({stateid}): source unchanged, skipping.")
+                continue
+        jobs[state_name] = stateid
+
+    failures, changed = {}, set()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                process_state, state_name, stateid, state_links[state_name], streaming, batch_size,
+                None if force else manifest.get(stateid, {}).get("source_sha256"),
+            ): state_name
+            for state_name, stateid in jobs.items()
+        }
+        for future in as_completed(futures):
+            state_name = futures[future]
+            stateid = jobs[state_name]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{state_name}: failed to download or process. Error: {e}")
+                failures[state_name] = str(e)
+                continue
+
+            previous = manifest.get(stateid, {})
+            entry = manifest_entry(result["csv_path"], state_name, fingerprints[state_name], result["source_sha256"])
+            if entry["csv_sha256"] != previous.get("csv_sha256"):
+                changed.add(stateid)
+            manifest[stateid] = entry
+
+    write_building_manifest(manifest, csv_dir)
+
+    print("Updating nationwide dataset...")
+    aggregate_building_data(changed_states=changed)
     print("Aggregation complete.")
 
+    if failures:
+        print(f"{len(failures)} of {len(jobs)} states failed: {', '.join(sorted(failures))}")
+    return failures
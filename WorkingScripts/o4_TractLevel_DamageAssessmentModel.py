@@ -6,6 +6,19 @@ using fragility functions and peak ground acceleration (PGA) values.
 
 Main components:
 - `read_damage_functions`: Loads fragility curves for various building types and seismic code levels.
+- `compile_fragility_tables`: Compiled fragility artifact. Every fragility curve tabulated
+  on a fine log-PGA grid, cached as a versioned `.npz` that is rebuilt when the CSV changes.
+- `compile_fragility`: Packs the fragility parameters into (building types x damage states)
+  median and beta arrays.
+- `damage_state_counts`: Tensor fragility engine. Evaluates every tract, building type and
+  damage state in one broadcast and reduces to exclusive damage counts per tract.
+- `tract_damage_curves`: Tabulates each tract's expected damage counts as a function of
+  intensity, for fast evaluation at many sampled intensities.
+- `histogram_damage_counts`: Integrates the fragility curves over each tract's
+  area-weighted intensity histogram (from o2) with one sparse product.
+- `tract_code_weights`: Expands national, per-state or per-tract seismic code level shares
+  into (tracts x types x codes) weights, so each building type can be a mix of
+  HC/MC/LC/PC instead of only its highest code level.
 - `build_damage_estimates`: Combines tract-level hazard intensity with building inventory
   to estimate the probability and count of buildings experiencing slight, moderate, extensive,
   and complete damage.
@@ -34,17 +47,65 @@ Those columns were followed by the beta columns (BetaSlight, BetaModerate, BetaE
 Those are lognormal standard deviations (used to compute confidence intervals or model uncertainty).
 Small beta means this certain type of building has similar falling threshold (smaller uncertainty)
 
+
+# Interpolation mode:
+
+With mode="interp", probabilities are read from the compiled tables by linear
+interpolation in ln(PGA) instead of evaluating log and normal CDF. Each curve
+is P(x) = Phi((x - ln(median)) / beta) with x = ln(PGA); its second derivative
+is bounded by phi(1) / beta^2 = 0.242 / beta^2, so the interpolation error on a
+grid of step h is at most
+
+    h^2 / 8 * 0.242 / beta^2
+
+i.e. about 2e-6 for the default step h = 0.005 and the smallest beta in the
+table (0.64). PGA outside the grid (1e-4 g to 100 g) takes the edge value,
+where every curve is within 1e-6 of 0 or 1.
 """
 
 
 import os
+import hashlib
 import geopandas as gpd
 import pandas as pd
-from scipy.stats import norm
+from scipy.special import ndtr
+from scipy.sparse import csr_matrix
 import numpy as np
 import time
 
-def read_damage_functions():
+from WorkingScripts.tract_index import tract_rows
+from WorkingScripts.stage_cache import atomic_write
+
+# Labels for each damage level, in the order of the median/beta columns
+DAMAGE_STATES = ['slight', 'mod', 'ext', 'comp']
+TOTAL_DAMAGE_COLUMNS = [
+    'Total_Num_Building_Slight',
+    'Total_Num_Building_Moderate',
+    'Total_Num_Building_Extensive',
+    'Total_Num_Building_Complete'
+]
+# Seismic code levels, from most to least resistant
+CODE_LEVELS = ["HC", "MC", "LC", "PC"]
+# Tracts evaluated per block of the (tracts x types x states) tensor
+CHUNK_SIZE = 50_000
+# Tracts per block when tabulating damage curves (see `evaluate_damage_curves`)
+CURVE_CHUNK_SIZE = 256
+
+FRAGILITY_CSV = os.path.join(os.getcwd(), "Tables", "DamageFunctionVariables.csv")
+FRAGILITY_CACHE = os.path.join(os.getcwd(), "Data", "fragility_cache", "fragility_tables.npz")
+# Bump when the layout of the compiled tables changes
+FRAGILITY_CACHE_VERSION = 1
+# ln(PGA) grid of the compiled tables: 1e-4 g to 100 g
+LOG_PGA_MIN = np.log(1e-4)
+LOG_PGA_MAX = np.log(100.0)
+LOG_PGA_STEP = 0.005
+# Maximum of |z * phi(z)|, bounds the curvature of a lognormal fragility curve
+MAX_CURVATURE = 0.242
+
+# Compiled fragility tables already loaded in this process, by cache path
+_COMPILED = {}
+
+def read_damage_functions(path=FRAGILITY_CSV):
     """
     Load damage function variable table from CSV and extract column metadata.
 
@@ -53,7 +114,6 @@ def read_damage_functions():
     tuple
         (DataFrame with all values, list of building types, list of median columns, list of beta columns)
     """
-    path = os.path.join(os.getcwd(), "Tables", "DamageFunctionVariables.csv")
     df = pd.read_csv(path).drop(columns=["Unnamed: 0"], errors="ignore")
 
     median_columns = [col for col in df.columns if col.lower().startswith("median")]
@@ -63,7 +123,687 @@ def read_damage_functions():
     return df, building_types, median_columns, beta_columns
 
 
-def build_damage_estimates(event_results, intensity_metric):
+def interpolation_error_bound(betas, step=LOG_PGA_STEP):
+    """
+    Upper bound on the error of interpolated fragility probabilities.
+
+    Parameters
+    ----------
+    betas : array-like
+        Lognormal standard deviations of the curves.
+    step : float
+        Grid step in ln(PGA).
+
+    Returns
+    -------
+    float
+        h^2 / 8 * 0.242 / min(beta)^2.
+    """
+    return step ** 2 / 8 * MAX_CURVATURE / np.min(betas) ** 2
+
+
+def compile_fragility_tables(csv_path=FRAGILITY_CSV, cache_path=FRAGILITY_CACHE, step=LOG_PGA_STEP):
+    """
+    Load the compiled fragility artifact, building it if missing or stale.
+
+    Every row of the damage function table (building type x code level) is
+    tabulated for each damage state on a uniform ln(PGA) grid. The artifact is
+    saved as a `.npz` holding the sha256 of the CSV it was compiled from, the
+    cache version and the grid step and range; it is recompiled when any of
+    them differs. Loaded artifacts are kept in memory for the rest of the process.
+
+    Parameters
+    ----------
+    csv_path : str
+        Path to 'DamageFunctionVariables.csv'.
+    cache_path : str
+        Path of the compiled '.npz'.
+    step : float
+        Grid step in ln(PGA).
+
+    Returns
+    -------
+    dict
+        'bldg_type', 'code' (per row), 'median_columns', 'beta_columns',
+        'medians', 'betas' (rows x states), 'log_grid' (grid,),
+        'tables' (rows x states x grid) and 'error_bound'.
+    """
+    with open(csv_path, "rb") as f:
+        csv_sha256 = hashlib.sha256(f.read()).hexdigest()
+    key = (csv_sha256, FRAGILITY_CACHE_VERSION, step, LOG_PGA_MIN, LOG_PGA_MAX)
+
+    compiled = _COMPILED.get(cache_path)
+    if compiled is not None and compiled["key"] == key:
+        return compiled
+
+    compiled = None
+    if os.path.isfile(cache_path):
+        with np.load(cache_path) as cache:
+            cached = {name: cache[name] for name in cache.files}
+        cached_key = (str(cached["csv_sha256"]), int(cached["version"]), float(cached["step"]),
+                      float(cached["log_grid"][0]), float(cached.get("grid_max", np.nan)))
+        if cached_key == key:
+            compiled = cached
+
+    if compiled is None:
+        df, _, median_columns, beta_columns = read_damage_functions(csv_path)
+        medians = df[median_columns].to_numpy(dtype="float64")
+        betas = df[beta_columns].to_numpy(dtype="float64")
+        log_grid = np.arange(LOG_PGA_MIN, LOG_PGA_MAX + step / 2, step)
+        tables = ndtr((log_grid - np.log(medians)[..., None]) / betas[..., None])
+
+        compiled = {
+            "bldg_type": df["BLDG_TYPE"].to_numpy(dtype=str),
+            "code": df["BUILDINGCO"].to_numpy(dtype=str),
+            "median_columns": np.array(median_columns),
+            "beta_columns": np.array(beta_columns),
+            "medians": medians,
+            "betas": betas,
+            "log_grid": log_grid,
+            "tables": tables,
+        }
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Concurrent workers compiling on a cold cache each publish a complete file
+        atomic_write(cache_path, lambda f: np.savez(f, csv_sha256=csv_sha256, version=FRAGILITY_CACHE_VERSION,
+                                                    step=step, grid_max=LOG_PGA_MAX, **compiled))
+        print(f"Compiled fragility tables to {cache_path}")
+
+    compiled["key"] = key
+    compiled["error_bound"] = interpolation_error_bound(compiled["betas"], step)
+    _COMPILED[cache_path] = compiled
+    return compiled
+
+
+def fragility_frame(compiled):
+    """
+    Damage function table of a compiled artifact, as `read_damage_functions` returns it.
+
+    Returns
+    -------
+    tuple
+        (DataFrame with a 'row' column indexing the compiled tables,
+        list of building types, list of median columns, list of beta columns)
+    """
+    median_columns = [str(col) for col in compiled["median_columns"]]
+    beta_columns = [str(col) for col in compiled["beta_columns"]]
+    df = pd.DataFrame({"BLDG_TYPE": compiled["bldg_type"], "BUILDINGCO": compiled["code"]})
+    df[median_columns] = compiled["medians"]
+    df[beta_columns] = compiled["betas"]
+    df["row"] = np.arange(len(df))
+    return df, df["BLDG_TYPE"].unique(), median_columns, beta_columns
+
+
+def interpolate_probabilities(intensity, tables, log_grid):
+    """
+    Damage state probabilities by linear interpolation of compiled tables.
+
+    Parameters
+    ----------
+    intensity : numpy.ndarray
+        Shape (tracts,).
+    tables : numpy.ndarray
+        Shape (types, states, grid) or (types, codes, states, grid), tabulated
+        on `log_grid`.
+    log_grid : numpy.ndarray
+        Uniform ln(PGA) grid.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (tracts,) + tables.shape[:-1]. NaN where the intensity is NaN.
+    """
+    step = log_grid[1] - log_grid[0]
+    missing = np.isnan(intensity)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = np.clip(np.log(np.where(missing, 1.0, intensity)), log_grid[0], log_grid[-1])
+    pos = (x - log_grid[0]) / step
+    i = np.minimum(pos.astype("int64"), len(log_grid) - 2)
+    w = (pos - i).astype(tables.dtype)
+
+    w = w.reshape((-1,) + (1,) * (tables.ndim - 1))
+
+    # Grid-major copy so each tract gathers two contiguous slices
+    by_grid = np.ascontiguousarray(np.moveaxis(tables, -1, 0))
+    probs = by_grid[i]
+    probs *= 1 - w
+    probs += by_grid[i + 1] * w
+    probs[missing] = np.nan
+    return probs
+
+
+def select_code_level(dmgfvarsDF):
+    """
+    Keep one fragility row per building type: its highest seismic code level.
+
+    Assumption 1: Use highest seismic code (e.g., HC > MC > LC > PC)
+
+    Returns
+    -------
+    DataFrame
+        One row per building type, sorted by BLDG_TYPE.
+    """
+    priority_order = {code: i + 1 for i, code in enumerate(CODE_LEVELS)}
+    dmgfvarsDF = dmgfvarsDF.assign(priority=dmgfvarsDF["BUILDINGCO"].map(priority_order))
+    dmgfvarsDF = dmgfvarsDF.sort_values(["BLDG_TYPE", "priority"])
+    return dmgfvarsDF.groupby("BLDG_TYPE").first().reset_index().drop(columns=["priority"])
+
+
+def compile_fragility(dmgfvars, building_types, median_columns, beta_columns, dtype="float64"):
+    """
+    Compile fragility parameters into (building types x damage states) arrays.
+
+    Parameters
+    ----------
+    dmgfvars : DataFrame
+        One row per building type (see `select_code_level`).
+    building_types : sequence of str
+        Building types, in the order of the output rows.
+    median_columns, beta_columns : list of str
+        Median and beta columns, ordered slight, moderate, extensive, complete.
+    dtype : str
+        Output float type.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (medians, betas), each of shape (types, states).
+    """
+    table = dmgfvars.set_index("BLDG_TYPE").loc[list(building_types)]
+    medians = table[median_columns].to_numpy(dtype=dtype)
+    betas = table[beta_columns].to_numpy(dtype=dtype)
+    return medians, betas
+
+
+def compile_code_fragility(dmgfvarsDF, building_types, median_columns, beta_columns, dtype="float64"):
+    """
+    Compile fragility parameters of every code level into (types x codes x states) arrays.
+
+    Parameters
+    ----------
+    dmgfvarsDF : DataFrame
+        Full damage function table, one row per building type and code level.
+    building_types : sequence of str
+        Building types, in the order of the output rows.
+    median_columns, beta_columns : list of str
+        Median and beta columns, ordered slight, moderate, extensive, complete.
+    dtype : str
+        Output float type.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (medians, betas) of shape (types, codes, states), NaN where a building
+        type has no curve for a code level, and the (types, codes) index of each
+        curve in the table (-1 where missing). Codes follow `CODE_LEVELS`.
+    """
+    type_pos = {bldg_type: i for i, bldg_type in enumerate(building_types)}
+    code_pos = {code: i for i, code in enumerate(CODE_LEVELS)}
+    shape = (len(building_types), len(CODE_LEVELS), len(median_columns))
+    medians = np.full(shape, np.nan, dtype=dtype)
+    betas = np.full(shape, np.nan, dtype=dtype)
+    rows = np.full(shape[:2], -1, dtype="int64")
+
+    known = dmgfvarsDF["BLDG_TYPE"].isin(type_pos) & dmgfvarsDF["BUILDINGCO"].isin(code_pos)
+    table = dmgfvarsDF.loc[known]
+    t = table["BLDG_TYPE"].map(type_pos).to_numpy()
+    c = table["BUILDINGCO"].map(code_pos).to_numpy()
+    medians[t, c] = table[median_columns].to_numpy(dtype=dtype)
+    betas[t, c] = table[beta_columns].to_numpy(dtype=dtype)
+    rows[t, c] = table["row"].to_numpy() if "row" in table else table.index.to_numpy()
+    return medians, betas, rows
+
+
+def tract_code_weights(geoids, weights, building_types):
+    """
+    Expand seismic code level shares into per-tract, per-type weights.
+
+    Parameters
+    ----------
+    geoids : array-like
+        11-character tract GEOIDs, in the order of the output rows.
+    weights : dict or DataFrame
+        Share of buildings designed to each code level (columns or keys among
+        HC, MC, LC, PC; missing levels count as 0). Either
+        - a dict such as {"HC": 0.2, "MC": 0.5, "LC": 0.3} applied everywhere,
+        - a DataFrame keyed by 'STATEFP' (2-digit state code, e.g. built from
+          construction era by state) or 'GEOID' (per tract), optionally with a
+          'BLDG_TYPE' column for shares that differ by building type.
+    building_types : sequence of str
+        Building types, in the order of the output columns.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (tracts, types, codes). NaN for tracts (or types) not covered by
+        `weights`; those fall back to the highest code level.
+    """
+    geoids = pd.Series(np.asarray(geoids)).astype(str).str.zfill(11)
+    n, n_types = len(geoids), len(building_types)
+    if isinstance(weights, dict):
+        shares = np.array([weights.get(code, 0.0) for code in CODE_LEVELS], dtype="float64")
+        return np.broadcast_to(shares, (n, n_types, len(CODE_LEVELS))).copy()
+
+    weights = weights.copy()
+    for code in CODE_LEVELS:
+        if code not in weights:
+            weights[code] = 0.0
+    if "GEOID" in weights:
+        key, tract_keys = "GEOID", geoids
+        weights["GEOID"] = weights["GEOID"].astype(str).str.zfill(11)
+    elif "STATEFP" in weights:
+        key, tract_keys = "STATEFP", geoids.str[:2]
+        weights["STATEFP"] = weights["STATEFP"].astype(str).str.zfill(2)
+    else:
+        raise ValueError("Code level weights need a 'GEOID' or 'STATEFP' column.")
+
+    out = np.full((n, n_types, len(CODE_LEVELS)), np.nan)
+    if "BLDG_TYPE" in weights:
+        for t, bldg_type in enumerate(building_types):
+            by_key = weights.loc[weights["BLDG_TYPE"] == bldg_type].set_index(key)[CODE_LEVELS]
+            out[:, t] = by_key.reindex(tract_keys).to_numpy()
+    else:
+        by_key = weights.set_index(key)[CODE_LEVELS]
+        out[:] = by_key.reindex(tract_keys).to_numpy()[:, None, :]
+    return out
+
+
+def normalize_code_weights(weights, available):
+    """
+    Restrict code weights to the curves that exist and make them sum to 1.
+
+    Weight on a code level a building type has no curve for is redistributed
+    over its other levels. Where nothing is left (no weights given, or only on
+    missing levels) all weight goes to the highest available level, as in
+    Assumption 1.
+
+    Parameters
+    ----------
+    weights : numpy.ndarray
+        Shape (tracts, types, codes), may contain NaN.
+    available : numpy.ndarray of bool
+        Shape (types, codes).
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (tracts, types, codes).
+    """
+    weights = np.where(available, np.nan_to_num(weights, nan=0.0), 0.0)
+    total = weights.sum(axis=-1, keepdims=True)
+    highest = np.zeros(available.shape)
+    highest[np.arange(available.shape[0]), available.argmax(axis=1)] = 1.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, weights / total, highest)
+
+
+def select_fragility(compiled, geoids, code_weights=None):
+    """
+    Pick the fragility curves used for each building type.
+
+    Parameters
+    ----------
+    compiled : dict
+        Output of `compile_fragility_tables`.
+    geoids : array-like
+        Tract GEOIDs, used to expand `code_weights`.
+    code_weights : dict or DataFrame, optional
+        Seismic code level shares (see `tract_code_weights`). When omitted,
+        each type uses its highest code level (Assumption 1).
+
+    Returns
+    -------
+    tuple
+        (building types, medians, betas, rows into the compiled tables,
+        weights). Without `code_weights`: medians/betas (types, states), rows
+        (types,) and weights None. With them: medians/betas (types, codes,
+        states), rows (types, codes) and weights (tracts, types, codes).
+    """
+    dmgfvarsDF, list_bldgtypes, median_columns, beta_columns = fragility_frame(compiled)
+
+    if code_weights is None:
+        # ------------------------------------------------------------------
+        # Assumption 1: Use highest seismic code (e.g., HC > MC > LC > PC)
+        dmgfvars_hc = select_code_level(dmgfvarsDF)
+        medians, betas = compile_fragility(dmgfvars_hc, list_bldgtypes, median_columns, beta_columns)
+        rows = dmgfvars_hc.set_index("BLDG_TYPE").loc[list(list_bldgtypes), "row"].to_numpy()
+        return list_bldgtypes, medians, betas, rows, None
+
+    # ----------------------------------------------------------------------
+    # Mixed inventory: every code level weighted by its share in the tract
+    medians, betas, rows = compile_code_fragility(dmgfvarsDF, list_bldgtypes, median_columns, beta_columns)
+    weights = normalize_code_weights(tract_code_weights(geoids, code_weights, list_bldgtypes), rows >= 0)
+    return list_bldgtypes, medians, betas, rows, weights
+
+
+def exclusive_damage_tables(tables):
+    """
+    Turn compiled exceedance tables into exclusive damage state fractions.
+
+    Parameters
+    ----------
+    tables : numpy.ndarray
+        Exceedance probabilities, shape (..., states, grid).
+
+    Returns
+    -------
+    numpy.ndarray
+        Same shape: fraction of buildings ending in each damage state at each
+        grid intensity (chained over states, then differenced).
+    """
+    exclusive = np.cumprod(tables, axis=-2)
+    exclusive[..., :-1, :] -= exclusive[..., 1:, :]
+    return exclusive
+
+
+def damage_curve_basis(event_results, code_weights=None, compiled=None):
+    """
+    Building counts and exclusive damage fractions forming the tract damage curves.
+
+    Because the building inventory of a tract is fixed, its exclusive damage
+    counts depend on the intensity only: on the compiled ln(PGA) grid they are
+    the product of its building counts and the exclusive fractions of each
+    type (and code level) at each grid point (see `tabulate_damage_curves`).
+
+    Parameters
+    ----------
+    event_results : DataFrame
+        Output of `building_clip_analysis` ('GEOID' and '{TYPE}_COUNT' columns).
+    code_weights : dict or DataFrame, optional
+        Seismic code level shares (see `tract_code_weights`).
+    compiled : dict, optional
+        Output of `compile_fragility_tables` (loaded if omitted).
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (counts of shape (tracts, curves), exclusive fractions of shape
+        (curves, states, grid), ln(PGA) grid), where a curve is a building
+        type, or a (type, code level) pair with `code_weights`.
+    """
+    compiled = compiled or compile_fragility_tables()
+    list_bldgtypes, _, _, rows, weights = select_fragility(compiled, event_results["GEOID"], code_weights)
+    counts = np.nan_to_num(
+        event_results[[f"{bldg_type}_COUNT" for bldg_type in list_bldgtypes]].to_numpy(dtype="float64"), nan=0.0
+    )
+    exclusive = exclusive_damage_tables(compiled["tables"][np.maximum(rows, 0)])
+
+    if weights is not None:
+        n, t, c = weights.shape
+        counts = (counts[..., None] * weights).reshape(n, t * c)
+        exclusive = exclusive.reshape((t * c,) + exclusive.shape[2:])
+    return counts, exclusive, compiled["log_grid"]
+
+
+def tabulate_damage_curves(counts, exclusive, grid=slice(None)):
+    """
+    Expected damage counts of tracts on (part of) the ln(PGA) grid.
+
+    Parameters
+    ----------
+    counts, exclusive : numpy.ndarray
+        Output of `damage_curve_basis`, with `counts` possibly a block of tracts.
+    grid : slice
+        Grid points to tabulate.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (tracts, grid points, states).
+    """
+    curves = np.tensordot(counts, exclusive[..., grid], axes=1)
+    return np.ascontiguousarray(np.swapaxes(curves, 1, 2))
+
+
+def tract_damage_curves(event_results, code_weights=None, compiled=None):
+    """
+    Expected damage counts of each tract as a function of intensity.
+
+    The counts are tabulated on the whole compiled ln(PGA) grid with a single
+    matrix product, after which evaluating a tract at any number of
+    intensities is a linear interpolation. The table takes
+    tracts x grid x states x 8 bytes; use `evaluate_damage_curves` to
+    evaluate large events in bounded memory.
+
+    Parameters
+    ----------
+    event_results : DataFrame
+        Output of `building_clip_analysis` ('GEOID' and '{TYPE}_COUNT' columns).
+    code_weights : dict or DataFrame, optional
+        Seismic code level shares (see `tract_code_weights`).
+    compiled : dict, optional
+        Output of `compile_fragility_tables` (loaded if omitted).
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        (curves of shape (tracts, grid, states), ln(PGA) grid).
+    """
+    counts, exclusive, log_grid = damage_curve_basis(event_results, code_weights, compiled)
+    return tabulate_damage_curves(counts, exclusive), log_grid
+
+
+def interpolate_curves(curves, log_grid, log_intensity):
+    """
+    Evaluate tract damage curves at sampled intensities.
+
+    Parameters
+    ----------
+    curves : numpy.ndarray
+        Shape (tracts, grid, states) (see `tract_damage_curves`).
+    log_grid : numpy.ndarray
+        Uniform ln(PGA) grid of the curves.
+    log_intensity : numpy.ndarray
+        ln(intensity), shape (..., tracts). NaN gives zero damage.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (..., tracts, states).
+    """
+    step = log_grid[1] - log_grid[0]
+    missing = np.isnan(log_intensity)
+    x = np.clip(np.where(missing, log_grid[0], log_intensity), log_grid[0], log_grid[-1])
+    pos = (x - log_grid[0]) / step
+    i = np.minimum(pos.astype("int64"), len(log_grid) - 2)
+    w = (pos - i)[..., None]
+
+    tract = np.arange(curves.shape[0])
+    damage = curves[tract, i] * (1 - w) + curves[tract, i + 1] * w
+    damage[missing] = 0.0
+    return damage
+
+
+def evaluate_damage_curves(counts, exclusive, log_grid, log_intensity, chunk_size=CURVE_CHUNK_SIZE):
+    """
+    Evaluate tract damage curves at sampled intensities in bounded memory.
+
+    Same result as `interpolate_curves` on the full `tract_damage_curves`
+    table, but the curves are tabulated per block of `chunk_size` tracts and
+    only over the grid points bracketing that block's intensities, so memory
+    is at most chunk_size x grid x states x 8 bytes besides the output.
+
+    Parameters
+    ----------
+    counts, exclusive, log_grid : numpy.ndarray
+        Output of `damage_curve_basis`.
+    log_intensity : numpy.ndarray
+        ln(intensity), shape (..., tracts). NaN gives zero damage.
+    chunk_size : int
+        Tracts per block.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (..., tracts, states).
+    """
+    log_intensity = np.asarray(log_intensity, dtype="float64")
+    step = log_grid[1] - log_grid[0]
+    out = np.zeros(log_intensity.shape + (exclusive.shape[1],))
+    for start in range(0, counts.shape[0], chunk_size):
+        block = slice(start, start + chunk_size)
+        x = log_intensity[..., block]
+        if np.isnan(x).all():
+            continue
+        pos = (np.clip(x, log_grid[0], log_grid[-1]) - log_grid[0]) / step
+        lo = max(int(np.nanmin(pos)) - 1, 0)
+        hi = min(int(np.nanmax(pos)) + 3, len(log_grid))
+        grid = slice(lo, max(hi, lo + 2))
+        curves = tabulate_damage_curves(counts[block], exclusive, grid)
+        out[..., block, :] = interpolate_curves(curves, log_grid[grid], x)
+    return out
+
+
+def damage_probabilities(intensity, medians, betas):
+    """
+    Probability of reaching or exceeding each damage state.
+
+    P = Phi(ln(intensity / median) / beta), broadcast over every tract,
+    building type (and code level) and damage state.
+
+    Parameters
+    ----------
+    intensity : numpy.ndarray
+        Shape (tracts,).
+    medians, betas : numpy.ndarray
+        Shape (types, states) or (types, codes, states).
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (tracts,) + medians.shape.
+    """
+    # ln(intensity) - ln(median): one log per tract and per curve, not per element
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_ratio = np.log(intensity).reshape((-1,) + (1,) * medians.ndim) - np.log(medians)
+    return ndtr(log_ratio / betas)
+
+
+def damage_state_counts(intensity, counts, medians, betas, dtype="float64", chunk_size=CHUNK_SIZE,
+                        tables=None, log_grid=None, weights=None):
+    """
+    Exclusive number of damaged buildings per tract and damage state.
+
+    Damage states are chained: the number of buildings reaching a state is the
+    number reaching the previous state times the state's probability (a
+    cumulative product over states). The exclusive count of a state is that
+    number minus the number reaching the next state, summed over building
+    types. Missing counts or intensities contribute nothing to the sums.
+
+    With `weights`, each building type is a mix of code levels: the chain is
+    evaluated for every code level in the same (tracts x types x codes x states)
+    pass and the exclusive counts are weighted by each level's share.
+
+    Tracts are processed in blocks of `chunk_size`, so the peak memory of the
+    (tracts x types x states) tensor is bounded.
+
+    Parameters
+    ----------
+    intensity : array-like
+        Ground motion per tract, shape (tracts,).
+    counts : array-like
+        Building counts, shape (tracts, types).
+    medians, betas : numpy.ndarray
+        Fragility parameters, shape (types, states) (see `compile_fragility`),
+        or (types, codes, states) with `weights` (see `compile_code_fragility`).
+    dtype : str, default 'float64'
+        Float type of the computation; 'float32' halves memory and time.
+    chunk_size : int
+        Tracts per block.
+    tables, log_grid : numpy.ndarray, optional
+        Compiled tables (types x states x grid) of the same curves and their
+        ln(PGA) grid. When given, probabilities are interpolated from the
+        tables (see `interpolate_probabilities`) instead of computed exactly.
+    weights : numpy.ndarray, optional
+        Code level shares, shape (tracts, types, codes), summing to 1 over codes
+        (see `normalize_code_weights`).
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (tracts, states): slight, moderate, extensive, complete counts.
+    """
+    intensity = np.asarray(intensity, dtype=dtype)
+    counts = np.nan_to_num(np.asarray(counts, dtype=dtype), nan=0.0)
+    medians = medians.astype(dtype, copy=False)
+    betas = betas.astype(dtype, copy=False)
+    if tables is not None:
+        tables = tables.astype(dtype, copy=False)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=dtype)
+        # Keep the block size in elements the same with the extra codes axis
+        chunk_size = max(chunk_size // medians.shape[1], 1)
+
+    out = np.empty((len(intensity), medians.shape[-1]), dtype=dtype)
+    for start in range(0, len(intensity), chunk_size):
+        block = slice(start, start + chunk_size)
+        if tables is None:
+            probs = damage_probabilities(intensity[block], medians, betas)
+        else:
+            probs = interpolate_probabilities(intensity[block], tables, log_grid)
+        # Chain the states and difference them in place: reached -> exclusive
+        exclusive = np.cumprod(probs, axis=-1, out=probs)
+        exclusive[..., :-1] -= exclusive[..., 1:]
+        np.copyto(exclusive, 0.0, where=np.isnan(exclusive))
+        if weights is None:
+            out[block] = np.einsum("nt,nts->ns", counts[block], exclusive)
+        else:
+            out[block] = np.einsum("ntc,ntcs->ns", counts[block][..., None] * weights[block], exclusive)
+    return out
+
+
+def histogram_damage_counts(geoids, counts, hist, medians, betas, dtype="float64", chunk_size=CHUNK_SIZE,
+                            tables=None, log_grid=None, weights=None):
+    """
+    Exclusive damage counts per tract integrated over its intensity distribution.
+
+    Each (tract, intensity bin) entry of the histogram is evaluated by
+    `damage_state_counts` with the tract's buildings, and the entries are
+    summed per tract, weighted by their area fractions, in one sparse
+    (tracts x entries) product. A tract with a single bin gets the same
+    counts as the point evaluation at that intensity.
+
+    Parameters
+    ----------
+    geoids : array-like
+        Tract GEOIDs, in the order of `counts`.
+    counts : array-like
+        Building counts, shape (tracts, types).
+    hist : dict of numpy.ndarray
+        Per-tract intensity histogram (see
+        `o2_census_intersect.tract_intensity_histogram`). Tracts missing
+        from it get zero damage.
+    medians, betas, dtype, chunk_size, tables, log_grid, weights
+        As in `damage_state_counts`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (tracts, states): slight, moderate, extensive, complete counts.
+    """
+    rows = tract_rows(hist["geoid"], geoids)
+    found = rows >= 0
+    rows = np.maximum(rows, 0)
+
+    # Expand every tract into its histogram entries (CSR row gather)
+    starts = hist["indptr"][rows]
+    lengths = np.where(found, hist["indptr"][rows + 1] - starts, 0)
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    entry = starts[owner] + np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    entry_counts = damage_state_counts(
+        hist["intensity"][entry], np.asarray(counts)[owner], medians, betas, dtype=dtype,
+        chunk_size=chunk_size, tables=tables, log_grid=log_grid,
+        weights=None if weights is None else np.asarray(weights)[owner]
+    )
+    fractions = csr_matrix(
+        (hist["fraction"][entry], np.arange(len(owner)), np.r_[0, np.cumsum(lengths)]),
+        shape=(len(rows), len(owner))
+    )
+    return np.asarray(fractions @ entry_counts, dtype=dtype)
+
+
+def build_damage_estimates(event_results, intensity_metric, dtype="float64", chunk_size=CHUNK_SIZE, mode="exact",
+                           code_weights=None, intensity_hist=None):
     """
     Estimate earthquake building damage by combining PGA intensity with fragility curves.
 
@@ -71,6 +811,26 @@ def build_damage_estimates(event_results, intensity_metric):
     ----------
     event_results : GeoDataFrame
         Contains census tract-level PGA values and building counts per structural type.
+    intensity_metric : str or list of str
+        Tract statistic to use ('min', 'max', 'mean', ...). With a list, all
+        metrics are evaluated in one stacked pass and every damage column is
+        emitted once per metric, suffixed with '_{metric}'. 'area' integrates
+        the fragility curves over each tract's area-weighted intensity
+        distribution (`intensity_hist`) instead of a single statistic.
+    dtype : str, default 'float64'
+        Float type of the fragility computation ('float32' for large runs).
+    chunk_size : int
+        Tracts evaluated per block.
+    mode : {'exact', 'interp'}, default 'exact'
+        'interp' reads probabilities from the compiled fragility tables, with
+        an error of at most `compile_fragility_tables()['error_bound']`.
+    code_weights : dict or DataFrame, optional
+        Share of buildings at each seismic code level, nationally, per state or
+        per tract (see `tract_code_weights`). When omitted, every building type
+        uses its highest code level (Assumption 1).
+    intensity_hist : dict of numpy.ndarray, optional
+        Per-tract intensity histogram, required by the 'area' metric (see
+        `o2_census_intersect.read_intensity_histogram`).
 
     Returns
     -------
@@ -78,18 +838,18 @@ def build_damage_estimates(event_results, intensity_metric):
         A dataframe with total estimated building damage counts (slight, moderate, extensive, complete)
         for each tract.
     """
-    # Set up labels for each damage level
-    pga_levels = ['slight', 'mod', 'ext', 'comp']
+    if mode not in ("exact", "interp"):
+        raise ValueError(f"Unknown fragility mode: {mode}")
 
-    # Load damage function parameters
-    dmgfvarsDF, list_bldgtypes, median_columns, beta_columns = read_damage_functions()
+    # Load damage function parameters (compiled once, cached on disk)
+    compiled = compile_fragility_tables()
+    list_bldgtypes, medians, betas, rows, weights = select_fragility(compiled, event_results["GEOID"], code_weights)
 
-    # ----------------------------------------------------------------------
-    # Assumption 1: Use highest seismic code (e.g., HC > MC > LC > PC)
-    priority_order = {"HC": 1, "MC": 2, "LC": 3, "PC": 4}
-    dmgfvarsDF["priority"] = dmgfvarsDF["BUILDINGCO"].map(priority_order)
-    dmgfvarsDF = dmgfvarsDF.sort_values(["BLDG_TYPE", "priority"])
-    dmgfvars_hc = dmgfvarsDF.groupby("BLDG_TYPE").first().reset_index().drop(columns=["priority"])
+    tables = None
+    if mode == "interp":
+        # Missing (type, code) curves read row 0 and carry zero weight
+        tables = compiled["tables"][np.maximum(rows, 0)]
+        print(f"Interpolating fragility tables (max error {compiled['error_bound']:.1e})")
 
     # ----------------------------------------------------------------------
     # Estimate total number of buildings per tract
@@ -100,67 +860,45 @@ def build_damage_estimates(event_results, intensity_metric):
         event_results['RESIDENTIAL_SINGLE FAMILY']
     )
 
-    # Step 1: Compute probability of damage by structure and level
-    prob_dict = {}
-
-    # Add check to ensure all building types exist in event_results before looping
-    intensity_metric = "{}_intensity".format(intensity_metric)
-    print("Using {}".format(intensity_metric))
-    for bldg_type in list_bldgtypes:
-        for i in range(len(pga_levels)):
-            # TODO: Replace positional access to beta/median columns with name-matching logic
-            beta = dmgfvars_hc.loc[dmgfvars_hc['BLDG_TYPE'] == bldg_type, beta_columns[i]].item()
-            PGA_median = dmgfvars_hc.loc[dmgfvars_hc['BLDG_TYPE'] == bldg_type, median_columns[i]].item()
-
-            prob_key = f'P_{pga_levels[i]}_{bldg_type}'
-            prob_dict[prob_key] = norm.cdf((1 / beta) * np.log(event_results[intensity_metric] / PGA_median))
-            #prob_dict[prob_key] = norm.cdf((1 / beta) * np.log(event_results['min_intensity'] / PGA_median))
-
-    df = pd.concat([event_results, pd.DataFrame(prob_dict)], axis=1)
-
-    # ----------------------------------------------------------------------
-    # Step 2–3: Estimate exclusive damage counts
-    num_slight, num_moderate, num_extensive, num_complete = {}, {}, {}, {}
-    ex_slight, ex_moderate, ex_extensive, ex_complete = {}, {}, {}, {}
-
-    for bldg_type in list_bldgtypes:
-        bldg_count_col = f"{bldg_type}_COUNT"
-
-        # Cumulative damage counts
-        num_slight[f'numSlight_{bldg_type}'] = df[bldg_count_col] * df[f'P_slight_{bldg_type}']
-        num_moderate[f'numModerate_{bldg_type}'] = num_slight[f'numSlight_{bldg_type}'] * df[f'P_mod_{bldg_type}']
-        num_extensive[f'numExtensive_{bldg_type}'] = num_moderate[f'numModerate_{bldg_type}'] * df[f'P_ext_{bldg_type}']
-        num_complete[f'numComplete_{bldg_type}'] = num_extensive[f'numExtensive_{bldg_type}'] * df[f'P_comp_{bldg_type}']
-
-        # Exclusive counts (subtract from previous level)
-        ex_slight[f'numSlight_{bldg_type}'] = num_slight[f'numSlight_{bldg_type}'] - num_moderate[f'numModerate_{bldg_type}']
-        ex_moderate[f'numModerate_{bldg_type}'] = num_moderate[f'numModerate_{bldg_type}'] - num_extensive[f'numExtensive_{bldg_type}']
-        ex_extensive[f'numExtensive_{bldg_type}'] = num_extensive[f'numExtensive_{bldg_type}'] - num_complete[f'numComplete_{bldg_type}']
-        ex_complete[f'numComplete_{bldg_type}'] = num_complete[f'numComplete_{bldg_type}']
-
-    # Combine all exclusive counts into dataframe
-    df = pd.concat([df, pd.DataFrame({
-        **ex_slight,
-        **ex_moderate,
-        **ex_extensive,
-        **ex_complete
-    })], axis=1)
-
-    # ----------------------------------------------------------------------
-    # Step 4: Total damage count per tract
-    df["Total_Num_Building_Slight"] = df.filter(like="numSlight").sum(axis=1)
-    df["Total_Num_Building_Moderate"] = df.filter(like="numModerate").sum(axis=1)
-    df["Total_Num_Building_Extensive"] = df.filter(like="numExtensive").sum(axis=1)
-    df["Total_Num_Building_Complete"] = df.filter(like="numComplete").sum(axis=1)
+    # Steps 1-4: damage probabilities, exclusive counts and totals per tract
+    # (several metrics are stacked along the tract axis and evaluated together)
+    metrics = [intensity_metric] if isinstance(intensity_metric, str) else list(intensity_metric)
+    point_metrics = [metric for metric in metrics if metric != "area"]
+    intensity_columns = ["{}_intensity".format(metric) for metric in point_metrics]
+    if "area" in metrics:
+        if intensity_hist is None:
+            raise ValueError("The 'area' intensity metric requires an intensity histogram.")
+        intensity_columns.append("area-weighted intensity distribution")
+    print("Using {}".format(", ".join(intensity_columns)))
+    counts = event_results[[f"{bldg_type}_COUNT" for bldg_type in list_bldgtypes]].to_numpy()
+    n_tracts = len(event_results)
+    point_totals = damage_state_counts(
+        event_results[intensity_columns[:len(point_metrics)]].to_numpy().T.ravel(),
+        np.tile(counts, (len(point_metrics), 1)),
+        medians, betas, dtype=dtype, chunk_size=chunk_size,
+        tables=tables, log_grid=compiled["log_grid"],
+        weights=None if weights is None else np.tile(weights, (len(point_metrics), 1, 1))
+    ).reshape(len(point_metrics), n_tracts, medians.shape[-1])
+
+    totals = []
+    for metric in metrics:
+        if metric == "area":
+            totals.append(histogram_damage_counts(
+                event_results["GEOID"], counts, intensity_hist, medians, betas, dtype=dtype,
+                chunk_size=chunk_size, tables=tables, log_grid=compiled["log_grid"], weights=weights
+            ))
+        else:
+            totals.append(point_totals[point_metrics.index(metric)])
 
     # Final output selection
-    df_final = df[[
+    df_final = event_results[[
         'GEOID', 'max_intensity', 'min_intensity', 'mean_intensity', 'geometry',
-        'Total_Num_Building',
-        'Total_Num_Building_Slight',
-        'Total_Num_Building_Moderate',
-        'Total_Num_Building_Extensive',
-        'Total_Num_Building_Complete'
-    ]]
+        'Total_Num_Building'
+    ]].copy()
+    if isinstance(intensity_metric, str):
+        df_final[TOTAL_DAMAGE_COLUMNS] = totals[0].astype("float64")
+    else:
+        for metric, metric_totals in zip(metrics, totals):
+            df_final[[f"{col}_{metric}" for col in TOTAL_DAMAGE_COLUMNS]] = metric_totals.astype("float64")
 
     return df_final
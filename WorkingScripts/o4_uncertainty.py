@@ -0,0 +1,462 @@
+"""
+Monte Carlo Ground-Motion Uncertainty Module
+
+The deterministic pipeline evaluates one intensity per tract. This module
+samples many realizations of tract intensity from ShakeMap uncertainty and
+pushes each one through the fragility (o4), BHI (o5) and SVI scaling steps,
+to report confidence intervals of the number of shelter seekers.
+
+Intensity model:
+- ln(PGA) of a tract is normal around ln(`{metric}_intensity`) with standard
+  deviation `sigma` (natural-log units, as ShakeMap's STDPGA), either one value
+  for the event or one per tract
+- Optionally, the standard normal residuals of different tracts are spatially
+  correlated with an exponential model, rho(h) = exp(-3 h / range), on the
+  distance h between tract centroids (Jayaram & Baker, 2009). The correlation
+  matrix is never formed: each tract residual is conditioned on its nearest
+  preceding tracts only (Vecchia approximation, `correlation_factor`), which
+  gives a sparse triangular factor whose size grows linearly with the number
+  of tracts
+
+Computation:
+- Each tract's expected damage counts are a function of intensity only; they
+  are tabulated per block of tracts over the grid of intensities sampled in a
+  batch (`evaluate_damage_curves`), so a realization costs one interpolation
+  per tract instead of a fragility evaluation per building type, and the
+  tables never span the whole event at once
+- Realizations are split into batches of `batch_size`, which bounds memory,
+  and the batches run on a process pool
+- Every batch draws from its own RNG stream spawned from one `SeedSequence`,
+  so results for a given seed do not depend on the number of workers
+
+Analytic mode:
+- `analytic_shelter` propagates the same lognormal uncertainty in closed form
+  with the delta method: the mean of each tract's damage counts to second
+  order (f + f'' sigma^2 / 2) and their standard deviation to first order
+  (|f'| sigma), with f the tract damage curve in ln(PGA). The BHI factors are
+  linear in the damage counts once the risk level is fixed (taken at the mean
+  counts), so the same derivatives give the spread of shelter seekers. The
+  derivatives are finite differences of the exact fragility evaluation at
+  the tract intensities (`damage_state_counts`). Event totals add tract
+  variances, or use the sparse correlation factor when a correlation range
+  is given. This costs a few array operations per tract
+  and gives normal-approximation error bars without sampling. Jumps between
+  risk levels are not linear and are left out, so when many tracts sit near a
+  risk threshold the Monte Carlo mean and spread are larger.
+
+Example
+-------
+>>> from WorkingScripts.o4_uncertainty import monte_carlo_shelter
+>>> summary, tracts = monte_carlo_shelter(event_results, tract_factors,
+...                                       BLDNG_USABILITY, UL_SEVERITY,
+...                                       n_realizations=10000, seed=42)
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+from scipy.special import ndtri
+from scipy.sparse.linalg import spsolve_triangular
+from concurrent.futures import ProcessPoolExecutor
+
+from WorkingScripts.o4_TractLevel_DamageAssessmentModel import (
+    TOTAL_DAMAGE_COLUMNS, compile_fragility_tables, select_fragility, damage_state_counts,
+    damage_curve_basis, evaluate_damage_curves
+)
+from WorkingScripts.o5_bhi import bhi_factor_arrays, usability_matrix, severity_table
+
+# Typical ShakeMap PGA uncertainty away from stations (natural-log units)
+PGA_SIGMA = 0.6
+# Realizations simulated together in one task
+BATCH_SIZE = 500
+PERCENTILES = (5, 50, 95)
+# Finite-difference step in ln(PGA) for the derivatives of the damage curves
+LOG_STEP = 0.05
+# Nearest preceding tracts each residual is conditioned on (see `correlation_factor`)
+CORRELATION_NEIGHBORS = 60
+# Tracts per block when building the correlation factor
+CORRELATION_BLOCK = 512
+
+# Per-worker state set by `_init_worker`
+_WORKER = {}
+
+
+def shelter_scale(event_results, tract_factors):
+    """
+    Residential share x population x mapped SVI of each tract of `event_results`.
+
+    Tracts missing from `tract_factors` get NaN.
+    """
+    tract_factors = tract_factors.assign(GEOID=tract_factors["GEOID"].astype("int64"))
+    factors = tract_factors.drop_duplicates("GEOID").set_index("GEOID").reindex(
+        event_results["GEOID"].astype("int64")
+    )
+    return (factors["resi_prop"] * factors["population"] * factors["SVI_Value_Mapped"]).to_numpy(dtype="float64")
+
+
+def total_building_count(event_results):
+    """
+    Number of buildings per tract, as in `build_damage_estimates`.
+    """
+    return (
+        event_results['OTHER_OTHER'] +
+        event_results['RESIDENTIAL_MULTI FAMILY'] +
+        event_results['RESIDENTIAL_OTHER'] +
+        event_results['RESIDENTIAL_SINGLE FAMILY']
+    ).to_numpy(dtype="float64")
+
+
+def tract_sigma(event_results, sigma):
+    """
+    Lognormal sigma per tract from a value, an array or a column name.
+    """
+    if isinstance(sigma, str):
+        sigma = event_results[sigma].to_numpy(dtype="float64")
+    return np.broadcast_to(np.asarray(sigma, dtype="float64"), (len(event_results),))
+
+
+def summarize_totals(mean, std, percentiles=PERCENTILES):
+    """
+    One summary row of an event total under a normal approximation.
+    """
+    row = {"mean": mean, "std": std}
+    row.update({f"p{q:g}": mean + std * ndtri(q / 100.0) for q in percentiles})
+    return row
+
+
+def correlation_factor(geometry, correlation_range_km, n_neighbors=CORRELATION_NEIGHBORS):
+    """
+    Sparse factor of the spatial correlation of tract residuals.
+
+    Tracts are ordered west to east and the residual of each one is
+    conditioned on its `n_neighbors` nearest predecessors (Vecchia
+    approximation): z_i = b_i . z_N(i) + d_i e_i with e independent standard
+    normals. In matrix form A z = D e, with A = I - B unit lower triangular
+    and holding at most `n_neighbors` off-diagonal entries per row, so memory
+    and time grow linearly with the number of tracts. The approximation is
+    exact when `n_neighbors` is at least the number of tracts minus one, and
+    close to it for the exponential model since distant tracts add little
+    information once the nearest ones are known.
+
+    Parameters
+    ----------
+    geometry : GeoSeries
+        Tract polygons.
+    correlation_range_km : float
+        Distance at which the correlation falls to about 0.05.
+    n_neighbors : int
+        Conditioning set size.
+
+    Returns
+    -------
+    dict
+        'order' (tract index of each row of A), 'A' (scipy.sparse CSR matrix,
+        tracts x tracts) and 'scale' (diagonal of D), see `correlate` and
+        `correlated_std`.
+    """
+    centroids = geometry.to_crs(geometry.estimate_utm_crs()).centroid
+    xy = np.column_stack([centroids.x.to_numpy(), centroids.y.to_numpy()]) / 1000.0
+    order = np.argsort(xy[:, 0], kind="stable")
+    xy = xy[order]
+    n = len(xy)
+    m = min(n_neighbors, n - 1)
+
+    def corr(dist):
+        return np.exp(-3.0 * dist / correlation_range_km)
+
+    # About half of a tract's nearest tracts precede it in the ordering
+    if m > 0:
+        _, candidates = cKDTree(xy).query(xy, k=min(n, 4 * m + 1))
+    else:
+        candidates = np.zeros((n, 0), dtype="int64")
+
+    rows, cols, values = [np.arange(n)], [np.arange(n)], [np.ones(n)]
+    scale = np.ones(n)
+    for start in range(0, n, CORRELATION_BLOCK):
+        idx = np.arange(start, min(start + CORRELATION_BLOCK, n))
+        cand = candidates[idx]
+        # Keep the nearest candidates that precede the tract
+        before = cand < idx[:, None]
+        first = np.argsort(~before, axis=1, kind="stable")[:, :m]
+        nb = np.take_along_axis(cand, first, axis=1)
+        valid = np.take_along_axis(before, first, axis=1)
+        nb = np.where(valid, nb, idx[:, None])
+
+        # Padding slots are decoupled: unit diagonal, zero correlation
+        pair_mask = valid[:, :, None] & valid[:, None, :]
+        c_nn = np.where(pair_mask, corr(np.linalg.norm(xy[nb][:, :, None] - xy[nb][:, None, :], axis=-1)), 0.0)
+        # Small nugget keeps the systems positive definite for coincident centroids
+        c_nn[:, np.arange(m), np.arange(m)] = 1.0 + 1e-8
+        c_ni = np.where(valid, corr(np.linalg.norm(xy[nb] - xy[idx][:, None, :], axis=-1)), 0.0)
+        b = np.linalg.solve(c_nn, c_ni[..., None])[..., 0]
+        scale[idx] = np.sqrt(np.maximum(1.0 + 1e-8 - (b * c_ni).sum(axis=1), 1e-12))
+
+        rows.append(np.repeat(idx, valid.sum(axis=1)))
+        cols.append(nb[valid])
+        values.append(-b[valid])
+
+    A = sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(n, n)
+    )
+    return {"order": order, "A": A, "scale": scale}
+
+
+def correlate(factor, e):
+    """
+    Spatially correlated residuals from independent standard normals.
+
+    Parameters
+    ----------
+    factor : dict
+        Output of `correlation_factor`.
+    e : numpy.ndarray
+        Independent standard normals, shape (n, tracts).
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (n, tracts).
+    """
+    z_ordered = spsolve_triangular(factor["A"], factor["scale"][:, None] * e.T, lower=True)
+    z = np.empty_like(e)
+    z[:, factor["order"]] = z_ordered.T
+    return z
+
+
+def correlated_std(factor, weights):
+    """
+    Standard deviation of weights . z for correlated residuals z (see `correlate`).
+    """
+    y = spsolve_triangular(factor["A"].T.tocsr(), weights[factor["order"]], lower=False)
+    return np.linalg.norm(factor["scale"] * y)
+
+
+def sample_log_intensity(rng, log_median, sigma, n, factor=None):
+    """
+    Draw `n` realizations of ln(intensity) for every tract.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (n, tracts).
+    """
+    z = rng.standard_normal((n, len(log_median)))
+    if factor is not None:
+        z = correlate(factor, z)
+    return log_median + sigma * z
+
+
+def _init_worker(state):
+    """
+    Store the event arrays shared by all batches in the worker process.
+    """
+    _WORKER.clear()
+    _WORKER.update(state)
+
+
+def _simulate_batch(seed_seq, n):
+    """
+    Simulate `n` realizations and reduce them to totals and per-tract moments.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        'total_low', 'total_high' (n,), and per-tract sums and sums of squares
+        of shelter seekers ('sum_low', 'sumsq_low', 'sum_high', 'sumsq_high').
+    """
+    w = _WORKER
+    rng = np.random.default_rng(seed_seq)
+    log_intensity = sample_log_intensity(rng, w["log_median"], w["sigma"], n, w["factor"])
+    totals = evaluate_damage_curves(w["counts"], w["exclusive"], w["log_grid"], log_intensity)
+    bhi = bhi_factor_arrays(totals, w["total_buildings"], w["bldng_usability"], w["ul_severity"])
+
+    result = {}
+    for bound in ("low", "high"):
+        seekers = np.nan_to_num(bhi[f"BHI_factor_{bound}"] * w["scale"], nan=0.0)
+        result[f"total_{bound}"] = seekers.sum(axis=1)
+        result[f"sum_{bound}"] = seekers.sum(axis=0)
+        result[f"sumsq_{bound}"] = (seekers ** 2).sum(axis=0)
+    return result
+
+
+def monte_carlo_shelter(event_results, tract_factors, bldng_usability, ul_severity,
+                        n_realizations=10000, intensity_metric="min", sigma=PGA_SIGMA,
+                        correlation_range_km=None, seed=None, batch_size=BATCH_SIZE,
+                        max_workers=None, percentiles=PERCENTILES, code_weights=None):
+    """
+    Monte Carlo distribution of shelter seekers under ground-motion uncertainty.
+
+    Parameters
+    ----------
+    event_results : GeoDataFrame
+        Output of `building_clip_analysis` (intensities, building counts by
+        type, geometry).
+    tract_factors : DataFrame
+        Per-tract 'GEOID', 'resi_prop', 'population' and 'SVI_Value_Mapped'
+        (as in the deterministic output). Tracts not listed are left out, like
+        the inner joins of the deterministic pipeline.
+    bldng_usability : dict
+        Structure usability assumptions by damage category.
+    ul_severity : dict
+        Utility loss severity by risk level.
+    n_realizations : int
+        Number of intensity realizations.
+    intensity_metric : str
+        Tract statistic used as the median intensity ('min', 'max', 'mean').
+    sigma : float, array-like or str
+        Lognormal standard deviation of intensity: one value, one per tract, or
+        the name of a column of `event_results` holding it.
+    correlation_range_km : float, optional
+        Range of the exponential spatial correlation of residuals. Residuals
+        are independent between tracts when None.
+    seed : int, optional
+        Seed of the RNG streams.
+    batch_size : int
+        Realizations per task; memory per task is a few times
+        batch_size x tracts x 4 x 8 bytes.
+    max_workers : int, optional
+        Size of the process pool (default: number of CPUs). 1 runs in process.
+    percentiles : sequence of float
+        Percentiles to report.
+    code_weights : dict or DataFrame, optional
+        Seismic code level shares (see o4 `tract_code_weights`).
+
+    Returns
+    -------
+    tuple of DataFrame
+        - Summary with one row per quantity ('shelter_seeking_low',
+          'shelter_seeking_high'), columns 'mean', 'std' and 'p{q}' for each
+          percentile, over realizations of the event total
+        - Per-tract 'GEOID' with mean and std of shelter seekers
+    """
+    with np.errstate(divide="ignore"):
+        log_median = np.log(event_results[f"{intensity_metric}_intensity"].to_numpy(dtype="float64"))
+    counts, exclusive, log_grid = damage_curve_basis(event_results, code_weights)
+
+    state = {
+        "counts": counts,
+        "exclusive": exclusive,
+        "log_grid": log_grid,
+        "log_median": log_median,
+        "sigma": tract_sigma(event_results, sigma),
+        "factor": correlation_factor(event_results.geometry, correlation_range_km) if correlation_range_km else None,
+        "total_buildings": total_building_count(event_results),
+        "scale": shelter_scale(event_results, tract_factors),
+        "bldng_usability": bldng_usability,
+        "ul_severity": ul_severity,
+    }
+
+    sizes = [batch_size] * (n_realizations // batch_size)
+    if n_realizations % batch_size:
+        sizes.append(n_realizations % batch_size)
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    max_workers = max_workers or os.cpu_count()
+    if max_workers == 1 or len(sizes) == 1:
+        _init_worker(state)
+        results = [_simulate_batch(stream, n) for stream, n in zip(streams, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(sizes)),
+                                 initializer=_init_worker, initargs=(state,)) as executor:
+            results = list(executor.map(_simulate_batch, streams, sizes))
+
+    summary, tracts = {}, {"GEOID": event_results["GEOID"].to_numpy()}
+    for bound in ("low", "high"):
+        totals = np.concatenate([r[f"total_{bound}"] for r in results])
+        row = {"mean": totals.mean(), "std": totals.std(ddof=1) if len(totals) > 1 else 0.0}
+        row.update({f"p{q:g}": v for q, v in zip(percentiles, np.percentile(totals, percentiles))})
+        summary[f"shelter_seeking_{bound}"] = row
+
+        mean = sum(r[f"sum_{bound}"] for r in results) / n_realizations
+        sumsq = sum(r[f"sumsq_{bound}"] for r in results) / n_realizations
+        tracts[f"shelter_seeking_{bound}_mean"] = mean
+        tracts[f"shelter_seeking_{bound}_std"] = np.sqrt(np.maximum(sumsq - mean ** 2, 0.0))
+
+    return pd.DataFrame(summary).T, pd.DataFrame(tracts)
+
+
+def analytic_shelter(event_results, tract_factors, bldng_usability, ul_severity,
+                     intensity_metric="min", sigma=PGA_SIGMA, correlation_range_km=None,
+                     percentiles=PERCENTILES, code_weights=None):
+    """
+    Closed-form (delta method) uncertainty of damage counts and shelter seekers.
+
+    Parameters
+    ----------
+    event_results : GeoDataFrame
+        Output of `building_clip_analysis`.
+    tract_factors : DataFrame
+        Per-tract 'GEOID', 'resi_prop', 'population' and 'SVI_Value_Mapped'.
+    bldng_usability : dict
+        Structure usability assumptions by damage category.
+    ul_severity : dict
+        Utility loss severity by risk level.
+    intensity_metric : str
+        Tract statistic used as the median intensity ('min', 'max', 'mean').
+    sigma : float, array-like or str
+        Lognormal standard deviation of intensity (see `monte_carlo_shelter`).
+    correlation_range_km : float, optional
+        Range of the exponential spatial correlation used for event totals.
+        Tracts are independent when None.
+    percentiles : sequence of float
+        Percentiles of the event totals to report (normal approximation).
+    code_weights : dict or DataFrame, optional
+        Seismic code level shares (see o4 `tract_code_weights`).
+
+    Returns
+    -------
+    tuple of DataFrame
+        - Summary of event totals, in the format of `monte_carlo_shelter`
+        - Per-tract 'GEOID', mean and std of each damage count column
+          ('{column}_mean', '{column}_std') and of shelter seekers
+    """
+    sigma = tract_sigma(event_results, sigma)
+    median = event_results[f"{intensity_metric}_intensity"].to_numpy(dtype="float64")
+    compiled = compile_fragility_tables()
+    list_bldgtypes, medians, betas, _, weights = select_fragility(compiled, event_results["GEOID"], code_weights)
+    counts = event_results[[f"{bldg_type}_COUNT" for bldg_type in list_bldgtypes]].to_numpy(dtype="float64")
+
+    # Damage counts at ln(median) - step, ln(median), ln(median) + step, in one
+    # exact fragility pass, and their first two derivatives
+    n_tracts = len(event_results)
+    f_down, f0, f_up = damage_state_counts(
+        np.concatenate([median * np.exp(-LOG_STEP), median, median * np.exp(LOG_STEP)]),
+        np.tile(counts, (3, 1)), medians, betas,
+        weights=None if weights is None else np.tile(weights, (3, 1, 1))
+    ).reshape(3, n_tracts, medians.shape[-1])
+    d1 = (f_up - f_down) / (2 * LOG_STEP)
+    d2 = (f_up - 2 * f0 + f_down) / LOG_STEP ** 2
+
+    var = (sigma ** 2)[:, None]
+    mean_counts = f0 + 0.5 * d2 * var
+    std_counts = np.abs(d1) * sigma[:, None]
+
+    # BHI factors are linear in the counts for a fixed risk level
+    total_buildings = total_building_count(event_results)
+    bhi = bhi_factor_arrays(mean_counts, total_buildings, bldng_usability, ul_severity)
+    usability = usability_matrix(bldng_usability)
+    severity = severity_table(ul_severity)[bhi["risk"]]
+    scale = np.nan_to_num(shelter_scale(event_results, tract_factors), nan=0.0)
+
+    tracts = {"GEOID": event_results["GEOID"].to_numpy()}
+    for i, col in enumerate(TOTAL_DAMAGE_COLUMNS):
+        tracts[f"{col}_mean"] = mean_counts[:, i]
+        tracts[f"{col}_std"] = std_counts[:, i]
+
+    factor = correlation_factor(event_results.geometry, correlation_range_km) if correlation_range_km else None
+    summary = {}
+    for bound, (fu, pu) in (("low", (0, 2)), ("high", (1, 3))):
+        # Weight of each damage level in the numerator of the BHI factor
+        coef = usability @ np.stack([severity[:, fu], severity[:, pu], np.ones(len(severity))])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.nan_to_num(bhi[f"BHI_factor_{bound}"] * scale, nan=0.0)
+            slope = np.nan_to_num((d1 * coef.T).sum(axis=1) / total_buildings * scale * sigma, nan=0.0)
+        tracts[f"shelter_seeking_{bound}_mean"] = mean
+        tracts[f"shelter_seeking_{bound}_std"] = np.abs(slope)
+
+        total_std = correlated_std(factor, slope) if factor is not None else np.sqrt((slope ** 2).sum())
+        summary[f"shelter_seeking_{bound}"] = summarize_totals(mean.sum(), total_std, percentiles)
+
+    return pd.DataFrame(summary).T, pd.DataFrame(tracts)
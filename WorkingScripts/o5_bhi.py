@@ -2,6 +2,8 @@ import geopandas as gpd
 import pandas as pd
 import numpy as np
 
+from WorkingScripts.tract_index import load_national_index, join_rows
+
 """
 Building Habitability Index (BHI) Estimation Module
 
@@ -21,8 +23,16 @@ Steps:
 3. Estimate total FU / PU / NU buildings per tract
 4. Compute low/high BHI factors incorporating utility service loss
 5. Join population estimates to final dataframe
+
+`bhi_factor_arrays` runs steps 2-4 on plain arrays of damage counts with any
+leading shape, e.g. (realizations, tracts) for the Monte Carlo engine.
 """
 
+# Risk levels, in the order of their integer codes
+RISK_LEVELS = ["low", "medium", "high"]
+# Damage levels, in the order of the damage count columns
+DAMAGE_LEVELS = ["Slight", "Moderate", "Extensive", "Complete"]
+
 
 def tract_damage_lvl(damage_dist):
     """
@@ -49,7 +59,133 @@ def tract_damage_lvl(damage_dist):
         return "low"
 
 
-def process_bhi(df, bldng_usability, ul_severity):
+def classify_risk(perc_extreme, perc_complete):
+    """
+    Array version of `tract_damage_lvl`, used by `process_bhi` for all tracts at once.
+
+    Returns
+    -------
+    numpy.ndarray of int
+        Index into `RISK_LEVELS` (0 low, 1 medium, 2 high). NaN ratios are "low".
+    """
+    destroyed = np.asarray(perc_complete)
+    major = np.asarray(perc_extreme)
+    return np.select(
+        [
+            (destroyed > 0.34) | (major > 0.34),
+            ((destroyed > 0.1) & (destroyed <= 0.34)) | ((major > 0.15) & (major <= 0.34)),
+        ],
+        [2, 1],
+        default=0,
+    )
+
+
+def usability_matrix(bldng_usability):
+    """
+    Share of FU, PU and NU buildings for each damage level.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (4, 3): rows follow `DAMAGE_LEVELS`, columns FU, PU, NU. Levels
+        missing from `bldng_usability` are zero.
+    """
+    matrix = np.zeros((len(DAMAGE_LEVELS), 3))
+    for level, shares in bldng_usability.items():
+        matrix[DAMAGE_LEVELS.index(level)] = [shares["FU"], shares["PU"], shares["NU"]]
+    return matrix
+
+
+def severity_table(ul_severity):
+    """
+    Utility loss ranges by risk level as a lookup table.
+
+    Returns
+    -------
+    numpy.ndarray
+        Shape (3, 4): rows follow `RISK_LEVELS`, columns FU low, FU high,
+        PU low, PU high.
+    """
+    return np.array([
+        [ul_severity[rl]["FU"][0], ul_severity[rl]["FU"][1], ul_severity[rl]["PU"][0], ul_severity[rl]["PU"][1]]
+        for rl in RISK_LEVELS
+    ])
+
+
+def bhi_factor_arrays(totals, total_buildings, bldng_usability, ul_severity):
+    """
+    Compute risk levels, FU/PU/NU counts and BHI factors from damage count arrays.
+
+    Parameters
+    ----------
+    totals : numpy.ndarray
+        Exclusive damage counts, shape (..., 4) in `DAMAGE_LEVELS` order.
+    total_buildings : numpy.ndarray
+        Number of buildings, shape (...) broadcastable against totals[..., 0].
+    bldng_usability : dict
+        Structure usability assumptions by damage category.
+    ul_severity : dict
+        Utility loss severity by risk level, containing [low, high] ranges.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        'risk' (index into `RISK_LEVELS`), 'usability' (..., 3) FU/PU/NU
+        counts, 'severity' (..., 4) utility loss ranges, and 'BHI_factor_low'
+        and 'BHI_factor_high' (before the residential share adjustment).
+    """
+    totals = np.asarray(totals, dtype="float64")
+    total_buildings = np.asarray(total_buildings, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        perc = totals / total_buildings[..., None]
+    risk = classify_risk(perc[..., 2], perc[..., 3])
+
+    usability = totals @ usability_matrix(bldng_usability)
+    severity = severity_table(ul_severity)[risk]
+    num_FU, num_PU, num_NU = usability[..., 0], usability[..., 1], usability[..., 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        low = (num_FU * severity[..., 0] + num_PU * severity[..., 2] + num_NU) / total_buildings
+        high = (num_FU * severity[..., 1] + num_PU * severity[..., 3] + num_NU) / total_buildings
+    return {"risk": risk, "usability": usability, "severity": severity,
+            "BHI_factor_low": low, "BHI_factor_high": high}
+
+
+# Per-metric output columns of `process_bhi`
+METRIC_COLUMNS = [
+    "Total_Num_Building_Slight", "Total_Num_Building_Moderate",
+    "Total_Num_Building_Extensive", "Total_Num_Building_Complete",
+    "risk_level", "num_FU", "perc_FU_NH_low", "perc_FU_NH_high",
+    "num_PU", "perc_PU_NH_low", "perc_PU_NH_high",
+    "num_NU", "BHI_factor_low", "BHI_factor_high"
+]
+
+
+def metric_bhi_columns(df, bldng_usability, ul_severity, metrics):
+    """
+    Steps 1-4 of `process_bhi` for several intensity metrics in one stacked pass.
+
+    Reads the '{column}_{metric}' damage count columns written by
+    `build_damage_estimates` for a list of metrics and adds the risk level,
+    FU/PU/NU counts, utility loss ranges and BHI factors of every metric as
+    '{column}_{metric}' columns.
+    """
+    levels = [f"Total_Num_Building_{level}" for level in DAMAGE_LEVELS]
+    totals = np.stack([df[[f"{col}_{metric}" for col in levels]].to_numpy(dtype="float64") for metric in metrics])
+    bhi = bhi_factor_arrays(totals, df["Total_Num_Building"].to_numpy(dtype="float64"), bldng_usability, ul_severity)
+
+    columns = {}
+    for i, metric in enumerate(metrics):
+        columns[f"risk_level_{metric}"] = np.array(RISK_LEVELS, dtype=object)[bhi["risk"][i]]
+        for j, name in enumerate(["num_FU", "num_PU", "num_NU"]):
+            columns[f"{name}_{metric}"] = bhi["usability"][i, :, j]
+        for j, name in enumerate(["perc_FU_NH_low", "perc_FU_NH_high", "perc_PU_NH_low", "perc_PU_NH_high"]):
+            columns[f"{name}_{metric}"] = bhi["severity"][i, :, j]
+        columns[f"BHI_factor_low_{metric}"] = bhi["BHI_factor_low"][i]
+        columns[f"BHI_factor_high_{metric}"] = bhi["BHI_factor_high"][i]
+    return pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
+
+
+def process_bhi(df, bldng_usability, ul_severity, metrics=None):
     """
     Compute BHI (Building Habitability Index) factors for each tract.
 
@@ -61,16 +197,18 @@ def process_bhi(df, bldng_usability, ul_severity):
         Structure usability assumptions by damage category.
     ul_severity : dict
         Utility loss severity by risk level, containing [low, high] ranges.
+    metrics : list of str, optional
+        Intensity metrics of a multi-metric `build_damage_estimates` run. The
+        damage and BHI columns are then computed and returned once per metric,
+        suffixed with '_{metric}'.
 
     Returns
     -------
     GeoDataFrame
         Updated dataframe with BHI factors and joined census population.
     """
-    # Step 0: Load population data
-    pop_data = pd.read_csv("Data/census_pop/USDECENNIALPL2020.csv").iloc[1:].reset_index(drop=True)
-    pop_data = pop_data[["GEO_ID", "NAME", "P1_001N"]]
-    pop_data["GEO_ID"] = pop_data["GEO_ID"].str.replace("1400000US", "", regex=False)
+    if metrics is not None:
+        return _finish_bhi(metric_bhi_columns(df, bldng_usability, ul_severity, metrics), metrics)
 
     # Step 1: Compute damage distribution ratios
     df["perc_slight"] = df["Total_Num_Building_Slight"] / df["Total_Num_Building"]
@@ -78,20 +216,20 @@ def process_bhi(df, bldng_usability, ul_severity):
     df["perc_extreme"] = df["Total_Num_Building_Extensive"] / df["Total_Num_Building"]
     df["perc_complete"] = df["Total_Num_Building_Complete"] / df["Total_Num_Building"]
 
-    df["risk_level"] = df[["perc_slight", "perc_moderate", "perc_extreme", "perc_complete"]].apply(
-        lambda row: tract_damage_lvl(row.to_dict()), axis=1
-    )
+    risk = classify_risk(df["perc_extreme"].to_numpy(), df["perc_complete"].to_numpy())
+    df["risk_level"] = np.array(RISK_LEVELS, dtype=object)[risk]
 
     # Step 2: Compute FU / PU / NU counts
     df["num_FU"] = sum(df[f"Total_Num_Building_{level}"] * bldng_usability[level]["FU"] for level in bldng_usability)
     df["num_PU"] = sum(df[f"Total_Num_Building_{level}"] * bldng_usability[level]["PU"] for level in bldng_usability)
     df["num_NU"] = sum(df[f"Total_Num_Building_{level}"] * bldng_usability[level]["NU"] for level in bldng_usability)
 
-    # Step 3: Assign utility loss severity based on risk
-    df["perc_FU_NH_low"] = df["risk_level"].apply(lambda rl: ul_severity[rl]["FU"][0])
-    df["perc_FU_NH_high"] = df["risk_level"].apply(lambda rl: ul_severity[rl]["FU"][1])
-    df["perc_PU_NH_low"] = df["risk_level"].apply(lambda rl: ul_severity[rl]["PU"][0])
-    df["perc_PU_NH_high"] = df["risk_level"].apply(lambda rl: ul_severity[rl]["PU"][1])
+    # Step 3: Assign utility loss severity based on risk (lookup by risk code)
+    severity = severity_table(ul_severity)[risk]
+    df["perc_FU_NH_low"] = severity[:, 0]
+    df["perc_FU_NH_high"] = severity[:, 1]
+    df["perc_PU_NH_low"] = severity[:, 2]
+    df["perc_PU_NH_high"] = severity[:, 3]
 
     # Step 4: Compute BHI factor (low/high) using utility impact
     df["BHI_factor_low"] = (
@@ -106,32 +244,34 @@ def process_bhi(df, bldng_usability, ul_severity):
         df["num_NU"]
     ) / df["Total_Num_Building"]
 
-    # Step 5: Adjust for residential share of total buildings
-    resi_df = pd.read_csv("Data/building_data_csv/aggregated_building_data.csv")
-    resi_df["CENSUSCODE"] = resi_df["CENSUSCODE"].astype(int)
+    return _finish_bhi(df)
+
+
+def _finish_bhi(df, metrics=None):
+    """
+    Steps 5-6 of `process_bhi`: residential share, population and final columns.
+
+    Both are gathered from the national tract index (`tract_index`); tracts
+    missing from the building count or population tables are dropped.
+    """
+    suffixes = [""] if metrics is None else [f"_{metric}" for metric in metrics]
+    index = load_national_index()
     df["GEOID"] = df["GEOID"].astype(int)
+    keep, rows = join_rows(index, df["GEOID"], "resi_prop", "population")
+    df = df.loc[keep].reset_index(drop=True)
+
+    # Step 5: Adjust for residential share of total buildings
+    df["resi_prop"] = index["resi_prop"][rows]
+    for suffix in suffixes:
+        df[f"BHI_factor_low{suffix}"] *= df["resi_prop"]
+        df[f"BHI_factor_high{suffix}"] *= df["resi_prop"]
+
+    # Step 6: Attach population and finalize columns
+    df["population"] = index["population"][rows]
 
-    df = df.merge(resi_df, left_on="GEOID", right_on="CENSUSCODE")
-    df["total_resi_count"] = (
-        df["RESIDENTIAL_MULTI FAMILY"] +
-        df["RESIDENTIAL_OTHER"] +
-        df["RESIDENTIAL_SINGLE FAMILY"]
+    final_cols = (
+        ["GEOID", "max_intensity", "resi_prop", "geometry", "Total_Num_Building"]
+        + [f"{col}{suffix}" for suffix in suffixes for col in METRIC_COLUMNS]
+        + ["population"]
     )
-    df["resi_prop"] = df["total_resi_count"] / df["TOTAL_BUILDING_COUNT"]
-    df["BHI_factor_low"] *= df["resi_prop"]
-    df["BHI_factor_high"] *= df["resi_prop"]
-
-    # Step 6: Merge population and finalize columns
-    pop_data["GEO_ID"] = pop_data["GEO_ID"].astype(int)
-    df = df.merge(pop_data[["GEO_ID", "P1_001N"]], how="inner", left_on="GEOID", right_on="GEO_ID")
-    df = df.rename(columns={"P1_001N": "population"}).drop(columns=["GEO_ID"])
-
-    final_cols = [
-        "GEOID", "max_intensity", "resi_prop", "geometry",
-        "Total_Num_Building", "Total_Num_Building_Slight", "Total_Num_Building_Moderate",
-        "Total_Num_Building_Extensive", "Total_Num_Building_Complete",
-        "risk_level", "num_FU", "perc_FU_NH_low", "perc_FU_NH_high",
-        "num_PU", "perc_PU_NH_low", "perc_PU_NH_high",
-        "num_NU", "BHI_factor_low", "BHI_factor_high", "population"
-    ]
     return df[final_cols].sort_values(by="max_intensity", ascending=False).reset_index(drop=True)
@@ -9,6 +9,8 @@ Key functions:
 - `read_svi_data`: Load raw SVI data (FIPS + composite vulnerability score)
 - `configure_svi_map`: Generate a function to map raw SVI score to a discrete vulnerability level
 - `process_svi`: Apply mapping to create a cleaned SVI dataframe for merging
+- `map_svi_values`: Array version of the mapping, for SVI scores already
+  aligned to the national tract index (see `tract_index`)
 
 Expected columns in input CSV:
 - FIPS: tract identifier
@@ -17,19 +19,29 @@ Expected columns in input CSV:
 
 import os
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 
+from WorkingScripts.stage_cache import warm_load
+
+SVI_CSV = "Data/SVI/SVI_2022_US.csv"
+# Upper edges of the low and medium SVI bins (see `configure_svi_map`)
+SVI_EDGES = [0.5, 0.8]
+
+
 def read_svi_data():
     """
     Read the CDC SVI 2022 CSV and return the relevant columns.
 
+    The table is parsed once per process (see `stage_cache.warm_load`);
+    callers must not modify it in place.
+
     Returns
     -------
     DataFrame
         Contains FIPS code and composite SVI score (RPL_THEMES).
     """
-    svi_path = "Data/SVI/SVI_2022_US.csv"
-    svi = pd.read_csv(svi_path)
+    svi = warm_load(SVI_CSV, pd.read_csv)
     return svi
 
 
@@ -59,6 +71,42 @@ def configure_svi_map(svi_factor_set):
     return map_range
 
 
+def svi_bins(svi_values):
+    """
+    Array version of `configure_svi_map`, returning bin codes.
+
+    Returns
+    -------
+    numpy.ndarray of int
+        SVI bin per tract (0 low, 1 medium, 2 high), or -1 for scores outside
+        [0, 1] (e.g. the -999 missing value), which map to no factor.
+    """
+    svi_values = np.asarray(svi_values, dtype="float64")
+    bins = np.digitize(svi_values, SVI_EDGES)
+    return np.where((svi_values >= 0) & (svi_values <= 1), bins, -1)
+
+
+def map_svi_values(svi_values, svi_factor_set):
+    """
+    Map SVI scores to shelter-seeking proportions for many tracts at once.
+
+    Parameters
+    ----------
+    svi_values : array-like
+        SVI scores (RPL_THEMES).
+    svi_factor_set : list of float
+        Proportions to apply for [low, medium, high] SVI bins.
+
+    Returns
+    -------
+    numpy.ndarray
+        Mapped proportion per tract, NaN where `configure_svi_map` gives None.
+    """
+    bins = svi_bins(svi_values)
+    factors = np.asarray(svi_factor_set, dtype="float64")
+    return np.where(bins >= 0, factors[np.maximum(bins, 0)], np.nan)
+
+
 def process_svi(svi_factor_set):
     """
     Load and process SVI data, applying a mapped shelter-seeking vulnerability level.
@@ -75,6 +123,5 @@ def process_svi(svi_factor_set):
     """
     svi_data = read_svi_data()
     svi_data = svi_data[["FIPS", "RPL_THEMES"]].rename(columns={"RPL_THEMES": "SVI_Value"})
-    map_range = configure_svi_map(svi_factor_set)
-    svi_data["SVI_Value_Mapped"] = svi_data["SVI_Value"].apply(map_range)
+    svi_data["SVI_Value_Mapped"] = map_svi_values(svi_data["SVI_Value"], svi_factor_set)
     return svi_data
@@ -0,0 +1,181 @@
+"""
+Batched Parameter Sweep Module
+
+Planners compare many variants of the `BLDNG_USABILITY`, `UL_SEVERITY` and
+`SVI_THRESHOLD` assumptions of `main.py`. None of them changes the damage
+estimate, and the tract risk level depends only on damage, so this module
+evaluates all variants against a single `build_damage_estimates` output:
+
+- The K parameter sets are stacked into arrays: usability matrices (K, 4, 3),
+  utility loss tables (K, 3, 4) and SVI factors (K, 3)
+- BHI factors, SVI scaling and shelter seekers of every (scenario, tract) pair
+  are computed in one broadcast pass per batch of scenarios
+- The tract-level inputs (residential share, population, SVI score) are joined
+  once, with the same index gathers as the single-scenario pipeline
+
+Output:
+- A tidy table with one row per (scenario, tract)
+- A summary of total shelter seekers per scenario
+"""
+
+import numpy as np
+import pandas as pd
+
+from WorkingScripts.o5_bhi import (
+    DAMAGE_LEVELS, RISK_LEVELS, classify_risk, process_bhi, severity_table, usability_matrix
+)
+from WorkingScripts.o5_svi_module import svi_bins
+from WorkingScripts.tract_index import load_national_index, join_rows
+
+# Scenarios evaluated per broadcast pass, bounding the (scenarios x tracts) arrays
+SCENARIO_BATCH = 64
+PARAMETER_KEYS = ["BLDNG_USABILITY", "UL_SEVERITY", "SVI_THRESHOLD"]
+
+
+def stack_scenarios(scenarios, base):
+    """
+    Complete each scenario from `base` and stack its parameters into arrays.
+
+    Parameters
+    ----------
+    scenarios : list of dict
+        Parameter overrides per scenario: any of 'BLDNG_USABILITY',
+        'UL_SEVERITY' and 'SVI_THRESHOLD', plus an optional 'name'.
+    base : dict
+        Configuration providing the parameters a scenario does not set.
+
+    Returns
+    -------
+    names : list of str
+        Scenario names ('scenario_{i}' when not given).
+    usability : numpy.ndarray
+        Shape (K, 4, 3), see `o5_bhi.usability_matrix`.
+    severity : numpy.ndarray
+        Shape (K, 3, 4), see `o5_bhi.severity_table`.
+    svi_factors : numpy.ndarray
+        Shape (K, 3): shelter-seeking proportion for the low, medium and high SVI bins.
+    """
+    if not scenarios:
+        raise ValueError("The sweep needs at least one scenario.")
+    names, usability, severity, svi_factors = [], [], [], []
+    for i, scenario in enumerate(scenarios):
+        unknown = set(scenario) - set(PARAMETER_KEYS) - {"name"}
+        if unknown:
+            raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+        params = {key: scenario.get(key, base[key]) for key in PARAMETER_KEYS}
+        names.append(str(scenario.get("name", f"scenario_{i}")))
+        usability.append(usability_matrix(params["BLDNG_USABILITY"]))
+        severity.append(severity_table(params["UL_SEVERITY"]))
+        svi_factors.append(params["SVI_THRESHOLD"])
+    if len(set(names)) != len(names):
+        raise ValueError("Scenario names must be unique.")
+    return names, np.stack(usability), np.stack(severity), np.asarray(svi_factors, dtype="float64")
+
+
+def sweep_arrays(totals, total_buildings, resi_prop, population, svi_bin,
+                 usability, severity, svi_factors):
+    """
+    BHI factors and shelter seekers of every scenario and tract.
+
+    Parameters
+    ----------
+    totals : numpy.ndarray
+        Exclusive damage counts, shape (tracts, 4) in `DAMAGE_LEVELS` order.
+    total_buildings, resi_prop, population : numpy.ndarray
+        Per-tract building count, residential share and population, shape (tracts,).
+    svi_bin : numpy.ndarray
+        SVI bin per tract (see `svi_bins`).
+    usability, severity, svi_factors : numpy.ndarray
+        Stacked scenario parameters (see `stack_scenarios`).
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        'risk' (tracts,) index into `RISK_LEVELS`, and 'BHI_factor_low',
+        'BHI_factor_high', 'shelter_seeking_low', 'shelter_seeking_high' of
+        shape (scenarios, tracts).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        perc = totals / total_buildings[:, None]
+    risk = classify_risk(perc[:, 2], perc[:, 3])
+
+    # (K, tracts, FU/PU/NU) counts and (K, tracts, 4) utility loss ranges
+    counts = np.einsum("ns,ksu->knu", totals, usability)
+    loss = severity[:, risk]
+    svi = np.where(svi_bin >= 0, svi_factors[:, np.maximum(svi_bin, 0)], np.nan)
+
+    out = {"risk": risk}
+    for bound, fu, pu in (("low", 0, 2), ("high", 1, 3)):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            factor = (counts[..., 0] * loss[..., fu] + counts[..., 1] * loss[..., pu] + counts[..., 2]) / total_buildings
+        factor = factor * resi_prop
+        out[f"BHI_factor_{bound}"] = factor
+        out[f"shelter_seeking_{bound}"] = factor * population * svi
+    return out
+
+
+def scenario_sweep(o4out, scenarios, base, batch_size=SCENARIO_BATCH):
+    """
+    Evaluate many BHI/SVI parameter sets against one damage estimate.
+
+    The tract inputs are prepared once by running `process_bhi` with the
+    `base` parameters and gathering SVI scores from the national tract
+    index (`tract_index`), so the tracts and their order
+    match the single-scenario output of `main.py`. A scenario equal to
+    `base` reproduces its shelter-seeking columns.
+
+    Parameters
+    ----------
+    o4out : GeoDataFrame
+        Output of `build_damage_estimates` for a single intensity metric.
+    scenarios : list of dict
+        Parameter sets (see `stack_scenarios`).
+    base : dict
+        Configuration with the default 'BLDNG_USABILITY', 'UL_SEVERITY' and
+        'SVI_THRESHOLD'.
+    batch_size : int
+        Scenarios evaluated per broadcast pass.
+
+    Returns
+    -------
+    tidy : DataFrame
+        One row per (scenario, tract): scenario, GEOID, risk_level, the
+        BHI factors and the shelter seekers.
+    summary : DataFrame
+        Total low and high shelter seekers per scenario.
+    """
+    names, usability, severity, svi_factors = stack_scenarios(scenarios, base)
+
+    df = process_bhi(o4out.copy(), base["BLDNG_USABILITY"], base["UL_SEVERITY"])
+    index = load_national_index()
+    keep, rows = join_rows(index, df["GEOID"], "svi")
+    df = df.loc[keep].reset_index(drop=True)
+    df["SVI_Value"] = index["svi"][rows]
+
+    totals = df[[f"Total_Num_Building_{level}" for level in DAMAGE_LEVELS]].to_numpy(dtype="float64")
+    tract_inputs = (
+        df["Total_Num_Building"].to_numpy(dtype="float64"),
+        df["resi_prop"].to_numpy(dtype="float64"),
+        df["population"].astype(int).to_numpy(dtype="float64"),
+        svi_bins(df["SVI_Value"]),
+    )
+
+    columns = ["BHI_factor_low", "BHI_factor_high", "shelter_seeking_low", "shelter_seeking_high"]
+    results = {col: [] for col in columns}
+    for start in range(0, len(names), batch_size):
+        batch = slice(start, start + batch_size)
+        out = sweep_arrays(totals, *tract_inputs, usability[batch], severity[batch], svi_factors[batch])
+        for col in columns:
+            results[col].append(out[col])
+    risk = out["risk"]
+
+    n_tracts = len(df)
+    tidy = pd.DataFrame({
+        "scenario": np.repeat(names, n_tracts),
+        "GEOID": np.tile(df["GEOID"].to_numpy(), len(names)),
+        "risk_level": np.tile(np.array(RISK_LEVELS, dtype=object)[risk], len(names)),
+        **{col: np.concatenate(results[col]).ravel() for col in columns},
+    })
+    summary = tidy.groupby("scenario", sort=False)[["shelter_seeking_low", "shelter_seeking_high"]].sum()
+    print(f"Evaluated {len(names)} scenarios over {n_tracts} tracts")
+    return tidy, summary
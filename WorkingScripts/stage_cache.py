@@ -0,0 +1,256 @@
+"""
+Pipeline Stage Cache
+
+`main()` is a chain of stages (census overlay and building merge, damage,
+BHI, SVI) whose outputs depend only on their inputs. This module stores each
+stage output on disk under a key hashing everything it depends on: the
+ShakeMap version, the versions of the reference files it reads, the relevant
+slice of the config and the keys of the stages it consumes. A rerun that only
+changes e.g. `UL_SEVERITY` finds the overlay and damage outputs under
+unchanged keys and recomputes only the BHI stage and the final merge.
+
+- Keys are sha256 digests of a canonical JSON encoding (`stage_key`);
+  DataFrames are hashed by content
+- Reference files enter keys by size and modification time (`path_version`)
+- Outputs are pickled (highest protocol) and written atomically through a
+  private temporary file, so processes can share the cache directory
+- The cache is bounded in bytes; the least recently used entries are evicted
+  first, with use tracked through file modification times
+
+Reference tables read by every run (population, SVI, building counts) are
+also memoized in process by `warm_load`, so a long-running process (see
+`model_server`) parses them once and rereads them only when they change.
+
+Output layout:
+- Data/stage_cache/{stage}-{key}.pkl
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import pandas as pd
+
+STAGE_CACHE_DIR = os.path.join(os.getcwd(), "Data", "stage_cache")
+# Total size of cached outputs before the least recently used are evicted
+STAGE_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Bump to invalidate every entry when a stage's output format changes
+STAGE_CACHE_VERSION = 1
+
+# In-process reference data: path -> (path_version, loaded object)
+_WARM = {}
+
+
+def path_version(path):
+    """
+    Identify the current version of a reference file or directory.
+
+    Returns
+    -------
+    list or None
+        [size, modification time in ns] of the file, of every file in the
+        directory (sorted by name), or None if the path does not exist.
+    """
+    if os.path.isdir(path):
+        return [[name, path_version(os.path.join(path, name))] for name in sorted(os.listdir(path))]
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def warm_load(path, loader):
+    """
+    Load a reference file once per process, reloading it when it changes.
+
+    Parameters
+    ----------
+    path : str
+        File or directory to load.
+    loader : callable
+        Function reading `path`, e.g. `pandas.read_csv`.
+
+    Returns
+    -------
+    object
+        The loaded object, shared between calls: callers must copy it
+        before modifying it.
+    """
+    version = path_version(path)
+    key = os.path.abspath(path)
+    cached = _WARM.get(key)
+    if cached is None or cached[0] != version:
+        cached = _WARM[key] = (version, loader(path))
+    return cached[1]
+
+
+def atomic_write(path, write, mode="wb"):
+    """
+    Write a file through a private temporary file, then move it into place.
+
+    Readers (also in other processes) see either the previous or the new
+    complete file, and concurrent writers never share a partial file; a file
+    another process has open or memory-mapped keeps its old contents.
+
+    Parameters
+    ----------
+    path : str
+        Destination path.
+    write : callable
+        Function writing the content to the open file object it is given.
+    mode : str
+        Open mode of the temporary file ('wb' or 'w').
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _encode(obj):
+    """
+    JSON fallback for key parts: DataFrames by content, anything else by repr.
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        columns = obj.columns if isinstance(obj, pd.DataFrame) else [obj.name]
+        return {"columns": [str(c) for c in columns],
+                "hash": int(pd.util.hash_pandas_object(obj, index=True).sum())}
+    return repr(obj)
+
+
+def stage_key(stage, *parts):
+    """
+    Content-addressed key of a stage output.
+
+    Parameters
+    ----------
+    stage : str
+        Stage name.
+    *parts
+        Everything the output depends on: config values, `path_version`
+        results and the keys of upstream stages.
+
+    Returns
+    -------
+    str
+        sha256 hex digest.
+    """
+    payload = json.dumps([STAGE_CACHE_VERSION, stage, parts], sort_keys=True, default=_encode)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_entries(cache_dir):
+    """
+    (modification time in ns, size, path) of every cached output.
+
+    Entries removed by another process while listing are left out.
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(".pkl"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    return entries
+
+
+def cache_size(cache_dir=STAGE_CACHE_DIR):
+    """
+    Total size in bytes of the cached stage outputs.
+    """
+    return sum(size for _, size, _ in _cache_entries(cache_dir))
+
+
+def evict_stage_cache(cache_dir=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_MAX_BYTES, keep=()):
+    """
+    Delete the least recently used outputs until the cache fits in `max_bytes`.
+
+    Parameters
+    ----------
+    keep : iterable of str
+        Paths never evicted (e.g. the entry just written).
+
+    Returns
+    -------
+    list of str
+        Paths of the evicted entries.
+    """
+    entries = sorted(_cache_entries(cache_dir))
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already evicted by another process sharing the cache
+            continue
+        evicted.append(path)
+    return evicted
+
+
+def cached_stage(stage, key, compute, cache_dir=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_MAX_BYTES,
+                 enabled=True):
+    """
+    Return the cached output of a stage, or compute and cache it.
+
+    Parameters
+    ----------
+    stage : str
+        Stage name, used in the file name and progress messages.
+    key : str
+        Output key from `stage_key`.
+    compute : callable
+        Function without arguments producing the stage output.
+    cache_dir : str
+        Cache directory.
+    max_bytes : int
+        Size bound of the cache (see `evict_stage_cache`).
+    enabled : bool
+        When False, always compute and leave the cache untouched.
+
+    Returns
+    -------
+    object
+        The stage output.
+    """
+    if not enabled:
+        return compute()
+
+    path = os.path.join(cache_dir, f"{stage}-{key}.pkl")
+    if os.path.isfile(path):
+        try:
+            with open(path, "rb") as f:
+                output = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            print(f"Stage cache entry for {stage} is unreadable; recomputing")
+        else:
+            # Mark as recently used for eviction
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            print(f"Stage {stage}: reused cached output")
+            return output
+
+    output = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    # Processes computing the same key each publish a complete file; the last one wins
+    atomic_write(path, lambda f: pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL))
+    evict_stage_cache(cache_dir, max_bytes, keep=(path,))
+    return output
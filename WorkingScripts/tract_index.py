@@ -0,0 +1,184 @@
+"""
+National Tract Index
+
+The tract-level reference tables (census population, residential share of
+buildings, CDC SVI) are keyed by GEOID in different forms: prefixed strings,
+zero-padded strings or integers. Instead of converting and merging them for
+every event, this module builds one canonical index once:
+
+- `geoid`: sorted int64 GEOID of every tract found in any of the tables; a
+  tract's position in it is its dense row id
+- Per-tract arrays aligned to that index: population, residential share and
+  SVI score, each with a mask of the tracts present in its source table
+
+Stages look up the row ids of their tracts once (`tract_rows`) and read any
+attribute with an integer gather, in place of a `pd.merge` per table. The
+index is rebuilt when a source table changes and kept in memory per process.
+
+Output layout:
+- Data/tract_index/tract_index.npz
+- Data/tract_index/tract_index.json (source modification times)
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from WorkingScripts.o5_svi_module import SVI_CSV, read_svi_data
+from WorkingScripts.stage_cache import warm_load, atomic_write
+
+TRACT_INDEX_DIR = os.path.join(os.getcwd(), "Data", "tract_index")
+INDEX_NAME = "tract_index.npz"
+SOURCES_NAME = "tract_index.json"
+POPULATION_CSV = "Data/census_pop/USDECENNIALPL2020.csv"
+BUILDING_DATA_CSV = "Data/building_data_csv/aggregated_building_data.csv"
+
+
+def tract_rows(index_geoid, geoids):
+    """
+    Dense row ids of tracts in a sorted GEOID index.
+
+    Parameters
+    ----------
+    index_geoid : numpy.ndarray
+        Sorted int64 GEOIDs (e.g. `load_national_index()['geoid']`).
+    geoids : array-like
+        Tract GEOIDs, as strings or integers.
+
+    Returns
+    -------
+    numpy.ndarray of int64
+        Row of each tract in the index, or -1 when it is not indexed.
+    """
+    geoids = np.asarray(geoids).astype("int64")
+    if len(index_geoid) == 0:
+        return np.full(len(geoids), -1, dtype="int64")
+    pos = np.searchsorted(index_geoid, geoids)
+    pos_clipped = np.minimum(pos, len(index_geoid) - 1)
+    return np.where(index_geoid[pos_clipped] == geoids, pos_clipped, -1).astype("int64")
+
+
+def join_rows(index, geoids, *tables):
+    """
+    Inner join of tracts with index attributes, as an integer gather.
+
+    Parameters
+    ----------
+    index : dict of numpy.ndarray
+        Output of `load_national_index`.
+    geoids : array-like
+        Tract GEOIDs.
+    *tables : str
+        Attributes the tracts must have ('population', 'resi_prop', 'svi').
+
+    Returns
+    -------
+    keep : numpy.ndarray of bool
+        Tracts that are indexed and present in every table, in input order.
+    rows : numpy.ndarray of int64
+        Index rows of the kept tracts.
+    """
+    rows = tract_rows(index["geoid"], geoids)
+    keep = rows >= 0
+    for table in tables:
+        keep &= index[f"has_{table}"][np.maximum(rows, 0)]
+    return keep, rows[keep]
+
+
+def _align(index_geoid, geoids, values, dtype="float64"):
+    """
+    Scatter one table's values onto the index rows; returns (values, present mask).
+
+    A tract listed twice keeps its first row.
+    """
+    geoids = np.asarray(geoids).astype("int64")
+    _, first = np.unique(geoids, return_index=True)
+    rows = np.searchsorted(index_geoid, geoids[first])
+    aligned = np.full(len(index_geoid), np.nan, dtype=dtype)
+    aligned[rows] = np.asarray(values, dtype=dtype)[first]
+    present = np.zeros(len(index_geoid), dtype=bool)
+    present[rows] = True
+    return aligned, present
+
+
+def national_index_is_current(index_dir=TRACT_INDEX_DIR):
+    """
+    Check whether the index exists and is newer than its source tables.
+    """
+    sources_path = os.path.join(index_dir, SOURCES_NAME)
+    if not os.path.isfile(sources_path) or not os.path.isfile(os.path.join(index_dir, INDEX_NAME)):
+        return False
+    with open(sources_path, "r") as f:
+        sources = json.load(f)
+    return all(
+        os.path.isfile(path) and sources.get(os.path.basename(path)) == os.path.getmtime(path)
+        for path in (POPULATION_CSV, BUILDING_DATA_CSV, SVI_CSV)
+    )
+
+
+def build_national_index(index_dir=TRACT_INDEX_DIR):
+    """
+    Build the national tract index and its aligned attribute arrays.
+
+    Returns
+    -------
+    str
+        Path to the saved index.
+    """
+    # Census population: the first data row holds the column labels
+    pop = pd.read_csv(POPULATION_CSV).iloc[1:]
+    pop_geoid = pop["GEO_ID"].str.replace("1400000US", "", regex=False).astype("int64").to_numpy()
+    population = pd.to_numeric(pop["P1_001N"]).to_numpy(dtype="float64")
+
+    # Residential share of the buildings in each tract
+    buildings = pd.read_csv(BUILDING_DATA_CSV)
+    resi_geoid = buildings["CENSUSCODE"].astype("int64").to_numpy()
+    total_resi_count = (
+        buildings["RESIDENTIAL_MULTI FAMILY"] +
+        buildings["RESIDENTIAL_OTHER"] +
+        buildings["RESIDENTIAL_SINGLE FAMILY"]
+    )
+    resi_prop = (total_resi_count / buildings["TOTAL_BUILDING_COUNT"]).to_numpy(dtype="float64")
+
+    # CDC SVI overall percentile rank
+    svi = read_svi_data()
+    svi_geoid = svi["FIPS"].astype("int64").to_numpy()
+
+    geoid = np.unique(np.concatenate([pop_geoid, resi_geoid, svi_geoid]))
+    arrays = {"geoid": geoid}
+    arrays["population"], arrays["has_population"] = _align(geoid, pop_geoid, population)
+    arrays["resi_prop"], arrays["has_resi_prop"] = _align(geoid, resi_geoid, resi_prop)
+    arrays["svi"], arrays["has_svi"] = _align(geoid, svi_geoid, svi["RPL_THEMES"].to_numpy())
+
+    os.makedirs(index_dir, exist_ok=True)
+    index_path = os.path.join(index_dir, INDEX_NAME)
+    atomic_write(index_path, lambda f: np.savez(f, **arrays))
+    # Written last so an interrupted build is never mistaken for a complete one
+    sources = {os.path.basename(path): os.path.getmtime(path)
+               for path in (POPULATION_CSV, BUILDING_DATA_CSV, SVI_CSV)}
+    atomic_write(os.path.join(index_dir, SOURCES_NAME), lambda f: json.dump(sources, f, indent=2), mode="w")
+    print(f"Saved national tract index ({len(geoid)} tracts) to {index_dir}")
+    return index_path
+
+
+def _read_index(path):
+    with np.load(path) as index:
+        return {key: index[key] for key in index.files}
+
+
+def load_national_index(index_dir=TRACT_INDEX_DIR):
+    """
+    Load the national tract index, building it first when missing or stale.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        'geoid' (int64, sorted) and, aligned to it, 'population',
+        'resi_prop' and 'svi' (float64, NaN when absent) with the masks
+        'has_population', 'has_resi_prop' and 'has_svi'. The arrays are
+        shared between calls and must not be modified.
+    """
+    if not national_index_is_current(index_dir):
+        build_national_index(index_dir)
+    return warm_load(os.path.join(index_dir, INDEX_NAME), _read_index)
@@ -2,28 +2,50 @@
 # ========== O1 ====================================
 from WorkingScripts.o1_getshakemap import FEEDURL
 from WorkingScripts.o1_getshakemap import fetch_earthquake_data, retrieve_event_data, download_and_extract_shakemap
+from WorkingScripts.o1_getshakemap import load_shakemap_layers
+from WorkingScripts.o1_event_watcher import watch_events
+from WorkingScripts.model_server import serve
 # ========== O2 ====================================
 from WorkingScripts.o2_download_census import download_census
-from WorkingScripts.o2_census_intersect import shakemap_into_census_geo
+from WorkingScripts.o2_census_intersect import shakemap_into_census_geo, read_intensity_histogram
+from WorkingScripts.o2_tract_store import build_tract_store, tract_store_exists, TRACT_STORE_DIR, TRACTS_GPKG
 # ========== O3 ====================================
-from WorkingScripts.o3_clip_eventdata_buildingstocks import building_clip_analysis
+from WorkingScripts.o3_clip_eventdata_buildingstocks import building_clip_analysis, build_exposure_store
+from WorkingScripts.o3_clip_eventdata_buildingstocks import BUILDING_COUNT_CSV, BUILDING_STOCK_CSV
+from WorkingScripts.o3_exposure_store import EXPOSURE_STORE_DIR
 from WorkingScripts.o3_get_building_structure import o3_get_building_structures
 # ========== O4 ====================================
-from WorkingScripts.o4_TractLevel_DamageAssessmentModel import build_damage_estimates
+from WorkingScripts.o4_TractLevel_DamageAssessmentModel import build_damage_estimates, TOTAL_DAMAGE_COLUMNS
+from WorkingScripts.o4_TractLevel_DamageAssessmentModel import FRAGILITY_CSV
+from WorkingScripts.o4_uncertainty import monte_carlo_shelter, analytic_shelter
 # ========== O5 ====================================
 from WorkingScripts.o5_bhi import process_bhi
-from WorkingScripts.o5_svi_module import process_svi
+from WorkingScripts.o5_svi_module import map_svi_values
+from WorkingScripts.tract_index import load_national_index, join_rows, POPULATION_CSV
+# ========== O7 ====================================
+from WorkingScripts.o7_scenario_sweep import scenario_sweep
+# ========== Stage cache ===========================
+from WorkingScripts.stage_cache import cached_stage, stage_key, path_version
 
 import os
+import asyncio
 import pandas as pd
 import time
 
 # Set to true if user wishes to rebuild building centroid data
 DOWNLOAD_BUILDING_CENTROID = False
+# Set to true to keep polling the USGS feed and process new/updated ShakeMaps
+WATCH_EVENTS = False
+# Set to true to keep reference data in memory and answer requests over local HTTP
+SERVE_MODEL = False
 
 def main(**config):
     """
     config is the dictionary with user specified arguments
+
+    Returns the final tract-level output table (also written to Data/). With
+    a "sweep", the table's attrs["sweep_summary"] maps each scenario name to
+    its total low and high shelter seekers.
     """
     # ==============================================
     # user parameters
@@ -34,24 +56,27 @@ def main(**config):
     # o1 - retrieve shakemap for specified event ID
     # ==============================================
     # o1 parameters
-    feed_url = FEEDURL.format(EVENT_ID)
+    feed_url = config.get("feed_url", FEEDURL).format(EVENT_ID)
     # o1 process
     jdict = fetch_earthquake_data(feed_url=feed_url)
     event = retrieve_event_data(jdict)
-    download_and_extract_shakemap(event)
+    # "disk" extracts shape.zip into the event folder; "shape" and "contour"
+    # read the ShakeMap in memory without touching disk
+    shakemap_source = config.get("shakemap_source", "disk")
+    if shakemap_source == "disk":
+        download_and_extract_shakemap(event)
+
+    # stage outputs are cached under keys hashing their inputs (see stage_cache),
+    # so a rerun only recomputes the stages whose inputs changed
+    use_cache = config.get("stage_cache", True)
 
     # ================================================
     # o2 - Download US Census Tract Shapemap (Optional)
     # ================================================    
     # download national census data if missing
     download_census()
-
-    # ================================================
-    # o2 - Overlay US Census Tract Data onto ShakeMap
-    # ================================================
-    # clip census and shakemaps, min,max,mean pga per census tract
-    event_dir = os.path.join(os.getcwd(), 'Data', 'Shakemap', EVENT_ID)
-    shakemap_into_census_geo(event_dir)
+    # write the state-partitioned GeoParquet tract store if missing or stale
+    build_tract_store()
 
     # ================================================
     # o3 - Download Building Centroid Data (Optional)
@@ -62,32 +87,90 @@ def main(**config):
         o3_get_building_structures()
         end_time = time.time()
         print(f"Function took {end_time - start_time:.4f} seconds to run.")
+    # write the per-tract exposure store if missing or stale, before any event reads it
+    build_exposure_store()
 
     # ================================================
+    # o2 - Overlay US Census Tract Data onto ShakeMap
     # o3 - Building Centroids
     #     Perform building clip analysis for a specific event ID
     # ================================================
-    event_results = building_clip_analysis(EVENT_ID)
+    # clip census and shakemaps, min,max,mean pga per census tract
+    event_dir = os.path.join(os.getcwd(), 'Data', 'Shakemap', EVENT_ID)
+    # the overlay reads tracts from the tract store, or from the national
+    # GeoPackage when there is no store; the key follows the one actually read
+    tracts_source = TRACT_STORE_DIR if tract_store_exists(TRACT_STORE_DIR) else TRACTS_GPKG
+    event_key = stage_key(
+        "o2_o3", EVENT_ID, shakemap_source,
+        [event.get(k) for k in ("shakemap_version", "shakemap_update_time", "shakemap_sha256")],
+        path_version(os.path.join(event_dir, "pga.shp")) if shakemap_source == "disk" else None,
+        path_version(tracts_source), path_version(EXPOSURE_STORE_DIR),
+        path_version(BUILDING_COUNT_CSV), path_version(BUILDING_STOCK_CSV))
+
+    def overlay_and_merge():
+        pga_gdf = None
+        if shakemap_source != "disk":
+            pga_gdf = load_shakemap_layers(event, layers=("pga",), source=shakemap_source)["pga"]
+        shakemap_into_census_geo(event_dir, pga_gdf=pga_gdf,
+                                 keep_in_memory=config.get("keep_in_memory", False))
+        return {"event_results": building_clip_analysis(EVENT_ID),
+                "intensity_hist": read_intensity_histogram(event_dir)}
+
+    event_stage = cached_stage("o2_o3", event_key, overlay_and_merge, enabled=use_cache)
+    event_results = event_stage["event_results"]
 
     # ========================================================
     # o4 - Apply Damage Functions using Building Code Data
     # ========================================================
-    o4out = build_damage_estimates(event_results, config["intensity_metric"])
+    # a list of metrics (e.g. ["min", "max", "mean"]) is evaluated in one pass,
+    # with per-metric output columns suffixed "_{metric}"
+    intensity_metric = config["intensity_metric"]
+    metrics = None if isinstance(intensity_metric, str) else list(intensity_metric)
+    suffixes = [""] if metrics is None else [f"_{metric}" for metric in metrics]
+    # "area" integrates damage over each tract's area-weighted PGA distribution
+    intensity_hist = event_stage["intensity_hist"] if "area" in (metrics or [intensity_metric]) else None
+    damage_key = stage_key("o4", event_key, intensity_metric, config.get("fragility_mode", "exact"),
+                           config.get("code_weights"), path_version(FRAGILITY_CSV))
+    o4out = cached_stage("o4", damage_key, lambda: build_damage_estimates(
+        event_results, intensity_metric,
+        mode=config.get("fragility_mode", "exact"),
+        code_weights=config.get("code_weights"),
+        intensity_hist=intensity_hist), enabled=use_cache)
+
+    # ================================================
+    # o7 - Parameter sweep over BHI/SVI assumptions (Optional)
+    # ================================================
+    # every scenario reuses the damage estimate above
+    sweep_summary = None
+    if config.get("sweep"):
+        # with several metrics, the sweep uses the damage of the first one
+        sweep_input = o4out if metrics is None else o4out.rename(
+            columns={f"{col}_{metrics[0]}": col for col in TOTAL_DAMAGE_COLUMNS})
+        tidy, sweep_summary = scenario_sweep(sweep_input, config["sweep"], config)
+        tidy.to_parquet("Data/apr28_sweep_{}.parquet".format(config["name"]), index=False)
+        print("shelter seeking by scenario")
+        print(sweep_summary)
 
     # ================================================
     # o5 - Implement BHI
     # ================================================
-    df = process_bhi(o4out, config["BLDNG_USABILITY"], config["UL_SEVERITY"])
+    bhi_key = stage_key("o5", damage_key, config["BLDNG_USABILITY"], config["UL_SEVERITY"],
+                        path_version(POPULATION_CSV), path_version(BUILDING_COUNT_CSV))
+    df = cached_stage("o5", bhi_key, lambda: process_bhi(
+        o4out, config["BLDNG_USABILITY"], config["UL_SEVERITY"], metrics=metrics), enabled=use_cache)
 
     df["population"] = df["population"].astype(int)
-    df["shelter_seeking_low"] = df["BHI_factor_low"]*df["population"]
-    df["shelter_seeking_high"] = df["BHI_factor_high"]*df["population"]
-    cols = ["GEOID", "max_intensity", "population", 
-            "Total_Num_Building", "risk_level", "geometry",
-            "BHI_factor_low", "BHI_factor_high",
-            "shelter_seeking_low", "shelter_seeking_high",
-            "Total_Num_Building_Slight", "Total_Num_Building_Moderate", 
-            "Total_Num_Building_Extensive", "Total_Num_Building_Complete"]
+    for suffix in suffixes:
+        df[f"shelter_seeking_low{suffix}"] = df[f"BHI_factor_low{suffix}"]*df["population"]
+        df[f"shelter_seeking_high{suffix}"] = df[f"BHI_factor_high{suffix}"]*df["population"]
+    metric_cols = ["risk_level",
+                   "BHI_factor_low", "BHI_factor_high",
+                   "shelter_seeking_low", "shelter_seeking_high",
+                   "Total_Num_Building_Slight", "Total_Num_Building_Moderate", 
+                   "Total_Num_Building_Extensive", "Total_Num_Building_Complete"]
+    cols = (["GEOID", "max_intensity", "population", "resi_prop",
+             "Total_Num_Building", "geometry"]
+            + [f"{col}{suffix}" for suffix in suffixes for col in metric_cols])
     df = df[cols]
     df["GEOID"] = df["GEOID"].astype(int)
     
@@ -95,41 +178,75 @@ def main(**config):
     # ================================================
     # o6 - Download SVI data 
     # ================================================
-    # apply SVI 
-    svi = process_svi(config["SVI_THRESHOLD"])
-    svi["FIPS"] = svi["FIPS"].astype(int)
+    # apply SVI to the national tract index
+    tract_index = load_national_index()
+    svi_mapped = map_svi_values(tract_index["svi"], config["SVI_THRESHOLD"])
     
     # ================================================
     # o7 - Combine SVI and BHI, Format Output Data
     # ================================================
-    df = df.merge(svi, left_on = "GEOID", right_on="FIPS")
-    df["shelter_seeking_low"] = df["shelter_seeking_low"]*df["SVI_Value_Mapped"] 
-    df["shelter_seeking_high"] = df["shelter_seeking_high"]*df["SVI_Value_Mapped"]
-    df = df.drop(columns=["FIPS"])
+    # inner join on GEOID as an index gather
+    keep, rows = join_rows(tract_index, df["GEOID"], "svi")
+    df = df.loc[keep].reset_index(drop=True)
+    df["SVI_Value"] = tract_index["svi"][rows]
+    df["SVI_Value_Mapped"] = svi_mapped[rows]
+    for suffix in suffixes:
+        df[f"shelter_seeking_low{suffix}"] = df[f"shelter_seeking_low{suffix}"]*df["SVI_Value_Mapped"] 
+        df[f"shelter_seeking_high{suffix}"] = df[f"shelter_seeking_high{suffix}"]*df["SVI_Value_Mapped"]
     
-    columns = [
-        "GEOID",
-        "max_intensity",
-        "population",
-        "Total_Num_Building",
-        "risk_level",
-        "BHI_factor_low",
-        "BHI_factor_high",
-        "shelter_seeking_low",
-        "shelter_seeking_high",
-        "Total_Num_Building_Slight",
-        "Total_Num_Building_Moderate",
-        "Total_Num_Building_Extensive",
-        "Total_Num_Building_Complete",
-        "SVI_Value",
-        "SVI_Value_Mapped"]
+    columns = (
+        ["GEOID",
+         "max_intensity",
+         "population",
+         "Total_Num_Building"]
+        + [f"{col}{suffix}" for suffix in suffixes for col in metric_cols]
+        + ["SVI_Value",
+           "SVI_Value_Mapped"])
 
+    # per-tract factors of the shelter estimate, for the uncertainty analysis
+    tract_factors = df[["GEOID", "resi_prop", "population", "SVI_Value_Mapped"]]
     df = df[columns]
     df.to_csv("Data/apr28_output_{}.csv".format(config["name"]), index=False)
-    print("lower bound")
-    print(df["shelter_seeking_low"].sum())
-    print("upper bound")
-    print(df["shelter_seeking_high"].sum())
+    for suffix in suffixes:
+        print("lower bound{}".format(suffix.replace("_", " ")))
+        print(df[f"shelter_seeking_low{suffix}"].sum())
+        print("upper bound{}".format(suffix.replace("_", " ")))
+        print(df[f"shelter_seeking_high{suffix}"].sum())
+
+    # ================================================
+    # Monte Carlo ground-motion uncertainty (Optional)
+    # ================================================
+    # sampled around a single tract statistic; "area" falls back to the weighted mean
+    point_metrics = [metric for metric in (metrics or [intensity_metric]) if metric != "area"]
+    uncertainty_metric = point_metrics[0] if point_metrics else "weighted_mean"
+    if config.get("monte_carlo"):
+        summary, _ = monte_carlo_shelter(
+            event_results, tract_factors, config["BLDNG_USABILITY"], config["UL_SEVERITY"],
+            intensity_metric=uncertainty_metric,
+            code_weights=config.get("code_weights"), **config["monte_carlo"]
+        )
+        summary.to_csv("Data/apr28_uncertainty_{}.csv".format(config["name"]))
+        print("shelter seeking percentiles")
+        print(summary)
+
+    # closed-form error bars, no sampling
+    if config.get("analytic_uncertainty"):
+        summary, tract_bands = analytic_shelter(
+            event_results, tract_factors, config["BLDNG_USABILITY"], config["UL_SEVERITY"],
+            intensity_metric=uncertainty_metric,
+            code_weights=config.get("code_weights"), **config["analytic_uncertainty"]
+        )
+        tract_bands.to_csv("Data/apr28_analytic_bands_{}.csv".format(config["name"]), index=False)
+        print("shelter seeking error bars")
+        print(summary)
+
+    if sweep_summary is not None:
+        # plain floats, so the attrs survive copies and concatenation of the table
+        df.attrs["sweep_summary"] = {
+            str(scenario): {col: float(value) for col, value in row.items()}
+            for scenario, row in sweep_summary.iterrows()
+        }
+    return df
 
 
 if __name__ == "__main__":
@@ -144,8 +261,29 @@ if __name__ == "__main__":
     config = {
         "event_id": "nc72282711",
         "name": "2014NapaValley",
-        # TODO maps to "max_intensity", "min_intensity", "mean_intensity" in o4
+        # maps to "max_intensity", "min_intensity", "mean_intensity" in o4; a list such as
+        # ["min", "max", "mean"] evaluates every metric in one pass with "_{metric}" columns;
+        # "area" integrates over each tract's area-weighted PGA histogram (o2)
         "intensity_metric": "min",
+        # "disk" (extract shape.zip), "shape" (shape.zip in memory) or "contour" (GeoJSON contours;
+        # an approximation: bands are contour levels, below the lowest one is PGA 0)
+        "shakemap_source": "disk",
+        # "exact" (normal CDF) or "interp" (compiled fragility tables, error < 2e-6)
+        "fragility_mode": "exact",
+        # Seismic code level mix, e.g. {"HC": 0.2, "MC": 0.5, "LC": 0.3}, or a DataFrame
+        # per STATEFP/GEOID (see o4 tract_code_weights); None uses the highest code level
+        "code_weights": None,
+        # Monte Carlo intensity uncertainty, e.g. {"n_realizations": 10000, "sigma": 0.6,
+        # "correlation_range_km": 20, "seed": 42}; None skips it (see o4_uncertainty)
+        "monte_carlo": None,
+        # Delta-method error bars, e.g. {"sigma": 0.6, "correlation_range_km": 20}; None skips it
+        "analytic_uncertainty": None,
+        # Parameter sweep: a list of scenarios overriding any of BLDNG_USABILITY, UL_SEVERITY
+        # and SVI_THRESHOLD (plus an optional "name"), all evaluated against one damage
+        # estimate; None skips it (see o7_scenario_sweep)
+        "sweep": None,
+        # Reuse cached stage outputs whose inputs are unchanged (Data/stage_cache)
+        "stage_cache": True,
         "BLDNG_USABILITY": {
                 "Slight":{"FU":1.00,"PU":0.00,"NU":0.00},
                 "Moderate":{"FU":0.87,"PU":0.13,"NU":0.00},
@@ -165,7 +303,12 @@ if __name__ == "__main__":
         }
 
 
-    main(**config)
+    if WATCH_EVENTS:
+        asyncio.run(watch_events(config, min_magnitude=4.5, poll_interval=60))
+    elif SERVE_MODEL:
+        serve(config)
+    else:
+        main(**config)
         
 
 